@@ -1,32 +1,279 @@
-from django.contrib import admin
-from .models import Book, Author, Category, BorrowRecord
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import BadRequest, FieldDoesNotExist, ValidationError
+from django.db import router
+from django.utils import timezone
+
+from . import fragments, search, services, stats
+from .models import ArchivedBorrowRecord, Book, Author, BorrowerProfile, Category, BorrowRecord, Hold
+from .pagination import KeysetPaginator
+
+# -----------------------------
+# CHANGELISTS AT SCALE
+# -----------------------------
+# The big changelists page with keyset cursors (book.pagination) instead of
+# ?p=N, so the last page costs what the first does, and never run a full
+# COUNT(*): an unfiltered list shows a running total (LibraryStats) where one
+# exists, anything else counts at most COUNT_CAP rows and shows "N+". Foreign
+# key filters and fields pick their row with the admin's autocomplete widget,
+# which reads only the selected row instead of rendering every author or
+# borrower. The bulk actions are set-based UPDATEs (book.services) that keep
+# the counters and cached fragments in step like the rest of the circulation.
+
+CURSOR_VAR = 'cursor'
+#a changelist without a running total counts at most this many rows
+COUNT_CAP = 1000
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    #a foreign key filter picked with the autocomplete widget; only the selected row is read
+    template = 'admin/book/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        #the changelist passes every parameter as a list of values
+        self.lookup_val = (params.get(self.lookup_kwarg) or [None])[-1]
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.choice_field = forms.ModelChoiceField(
+            field.remote_field.model._default_manager.all(), required=False,
+            widget=AutocompleteSelect(field, model_admin.admin_site, attrs={'data-width': '100%'}),
+        )
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg]),
+            'display': 'All',
+        }
+
+    def widget(self):
+        return self.choice_field.widget.render(self.lookup_kwarg, self.lookup_val)
+
+
+class KeysetChangeList(ChangeList):
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        #filter, search and sort links start again from the first page
+        return super().get_query_string(new_params, [*(remove or ()), CURSOR_VAR])
+
+    def keyset_ordering(self):
+        #the ordering as KeysetPaginator keys, None when a key can't be held in a cursor
+        #(an expression, a related model's field, a nullable column). A foreign key is
+        #ordered by its id column, the value a cursor holds, and the pk tie-breaker
+        #Django appends is left to the paginator, in the direction of the last key.
+        ordering, seen = [], set()
+        for name in self.queryset.query.order_by:
+            if not isinstance(name, str):
+                return None
+            descending, name = name.startswith('-'), name.lstrip('-')
+            if name in ('pk', self.opts.pk.name):
+                if not ordering:
+                    ordering.append(('-' if descending else '') + name)
+                break
+            try:
+                field = self.opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field.null or (field.is_relation and not field.many_to_one):
+                return None
+            #the queryset's own ordering repeats after the changelist's
+            if field.attname not in seen:
+                seen.add(field.attname)
+                ordering.append(('-' if descending else '') + field.attname)
+        return ordering
+
+    def get_results(self, request):
+        ordering = self.keyset_ordering()
+        if ordering is None or self.list_editable:
+            return super().get_results(request)
+        paginator = KeysetPaginator(self.queryset, ordering=ordering, per_page=self.list_per_page)
+        try:
+            page = paginator.page(request.GET.get(CURSOR_VAR) or None)
+        except BadRequest:
+            raise IncorrectLookupParameters
+        self.result_count, self.result_count_capped = self.model_admin.estimated_count(self)
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = page.object_list
+        self.can_show_all = False
+        #admin/book/pagination.html links the neighbouring pages from the cursors
+        self.multi_page = False
+        self.paginator = paginator
+        self.keyset_page = page
+        self.first_query = self.get_query_string()
+        self.next_query = self.get_query_string({CURSOR_VAR: page.next_cursor}) if page.has_next else ''
+        self.previous_query = self.get_query_string({CURSOR_VAR: page.previous_cursor}) if page.has_previous else ''
+
+
+class ScaledAdmin(admin.ModelAdmin):
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def total_count(self):
+        #the unfiltered row count from a running total, None to count (up to COUNT_CAP) instead
+        return None
+
+    def estimated_count(self, changelist):
+        #(rows in the changelist, whether the count stopped at COUNT_CAP)
+        if not changelist.has_active_filters and not changelist.query:
+            total = self.total_count()
+            if total is not None:
+                return total, False
+        counted = changelist.queryset.order_by().values('pk')[:COUNT_CAP + 1].count()
+        return min(counted, COUNT_CAP), counted > COUNT_CAP
+
+    @property
+    def media(self):
+        #select2 for the autocomplete filters, which a changelist doesn't load by itself
+        media = super().media
+        filtered = [item[0] for item in self.list_filter
+                    if isinstance(item, (list, tuple)) and item[1] is AutocompleteFilter]
+        if filtered:
+            widget = AutocompleteSelect(self.opts.get_field(filtered[0]), self.admin_site)
+            media += widget.media + forms.Media(js=['js/admin_filters.js'])
+        return media
 
 
 # Register your models here.
 
 @admin.register(Author)
-class AuthorAdmin(admin.ModelAdmin):
+class AuthorAdmin(ScaledAdmin):
     list_display = ('name', 'birth_date', 'created_at', 'updated_at')
     search_fields = ('name',)
     ordering = ('name',)
 
+    def total_count(self):
+        return stats.get_stats().total_authors
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'created_at', 'updated_at')
     search_fields = ('name',)
     ordering = ('name',)
 
+
+class BookActionForm(ActionForm):
+    #where "Move selected books to a category" moves them
+    category = forms.ModelChoiceField(
+        Category.objects.all(), required=False,
+        widget=AutocompleteSelect(Book._meta.get_field('category'), admin.site),
+    )
+
+
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(ScaledAdmin):
     list_display = ('title', 'author', 'category', 'status', 'published_date', 'created_at')
-    list_filter = ('status', 'category', 'author')
+    list_filter = ('status', ('category', AutocompleteFilter), ('author', AutocompleteFilter))
+    list_select_related = ('author', 'category')
+    autocomplete_fields = ('author', 'category')
     search_fields = ('title', 'isbn', 'author__name')
     ordering = ('title',)
+    action_form = BookActionForm
+    actions = ('mark_available', 'move_to_category')
+
+    def total_count(self):
+        return stats.get_stats().total_books
+
+    def get_search_results(self, request, queryset, search_term):
+        #the full-text index (book.search) instead of a LIKE scan of every title, isbn and author;
+        #a search, and the book pickers that use it, show the best MAX_RESULTS matches
+        using = router.db_for_read(Book)
+        if not search_term.strip() or not search.is_supported(using):
+            return super().get_search_results(request, queryset, search_term)
+        hits = search.search_books(search_term, search.MAX_RESULTS, using)
+        return queryset.filter(pk__in=[pk for pk, _, _, _ in hits]), False
+
+    @admin.action(description='Mark selected books available')
+    def mark_available(self, request, queryset):
+        released = services.release_books(queryset)
+        self.message_user(request, f'{released} books put back into circulation; books on loan or '
+                                   f'set aside for a hold were left as they are.', messages.SUCCESS)
+
+    @admin.action(description='Move selected books to a category')
+    def move_to_category(self, request, queryset):
+        try:
+            category = self.action_form.base_fields['category'].clean(request.POST.get('category'))
+        except ValidationError:
+            category = None
+        if category is None:
+            self.message_user(request, 'Pick the category to move the books to.', messages.ERROR)
+            return
+        moved = queryset.update(category=category, updated_at=timezone.now())
+        fragments.invalidate(Book)
+        self.message_user(request, f'{moved} books moved to {category}.', messages.SUCCESS)
 
 @admin.register(BorrowRecord)
-class BorrowRecordAdmin(admin.ModelAdmin):
+class BorrowRecordAdmin(ScaledAdmin):
     list_display = ('book', 'borrower', 'borrow_date', 'due_date', 'is_returned')
-    list_filter = ('is_returned',)
+    list_filter = ('is_returned', ('book', AutocompleteFilter), ('borrower', AutocompleteFilter))
+    list_select_related = ('book__author', 'borrower')
+    autocomplete_fields = ('book', 'borrower')
     search_fields = ('book__title', 'borrower__username')
     ordering = ('-borrow_date',)
+    actions = ('return_selected',)
+
+    @admin.action(description='Return selected loans')
+    def return_selected(self, request, queryset):
+        returned = services.return_loans(queryset)
+        self.message_user(request, f'{returned} loans returned.', messages.SUCCESS)
+
+
+@admin.register(ArchivedBorrowRecord)
+class ArchivedBorrowRecordAdmin(ScaledAdmin):
+    #read-only: rows get here through the archive_loans command
+    list_display = ('book', 'borrower', 'borrow_date', 'return_date', 'archived_at')
+    list_select_related = ('book__author', 'borrower')
+    search_fields = ('book__title', 'borrower__username')
+    ordering = ('-borrow_date',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(BorrowerProfile)
+class BorrowerProfileAdmin(admin.ModelAdmin):
+    #the counters are maintained by the circulation code, only the loan limit is edited here
+    list_display = ('user', 'active_loans', 'overdue_loans', 'loan_limit', 'updated_at')
+    search_fields = ('user__username',)
+    list_select_related = ('user',)
+    readonly_fields = ('user', 'active_loans', 'overdue_loans', 'updated_at')
+    ordering = ('user__username',)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Hold)
+class HoldAdmin(ScaledAdmin):
+    #queue changes go through book.services so copies are handed on, holds are only viewed here
+    list_display = ('book', 'borrower', 'status', 'placed_at', 'expires_at')
+    list_filter = ('status',)
+    search_fields = ('book__title', 'borrower__username')
+    list_select_related = ('book__author', 'borrower')
+    ordering = ('-pk',)
+
+    def has_add_permission(self, request):
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,115 @@
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import F
+
+from .models import Author, Book, BorrowRecord, Category
+from .pagination import KeysetPaginator, paginate
+
+# -----------------------------
+# JSON READ API
+# -----------------------------
+# Each resource is a queryset read with values(): rows come back as plain dicts
+# straight from the cursor, no model instances are built and only the columns
+# asked for with ?fields= are selected. Paging is the same keyset pagination as
+# the HTML lists, ?cursor= / ?per_page=.
+
+
+class Resource:
+    def __init__(self, model, fields, default_fields, ordering, filters=None, annotate=None):
+        self.model = model
+        #public field name -> ORM lookup
+        self.fields = fields
+        self.default_fields = default_fields
+        self.ordering = ordering
+        #query parameter -> ORM lookup
+        self.filters = filters or {}
+        #public field name -> function(queryset) adding it as an annotation, only when requested
+        self.annotate = annotate or {}
+
+    def queryset(self, request):
+        return self.model.objects.all()
+
+
+class OpenLoans(Resource):
+    def queryset(self, request):
+        #?overdue=1 switches to the overdue loans, most overdue first
+        if request.GET.get('overdue') in ('1', 'true', 'yes'):
+            return BorrowRecord.objects.overdue()
+        return BorrowRecord.objects.open()
+
+
+RESOURCES = {
+    'books': Resource(
+        Book,
+        fields={
+            'id': 'pk', 'title': 'title', 'isbn': 'isbn', 'status': 'status',
+            'author': 'author__name', 'author_id': 'author_id',
+            'category': 'category__name', 'category_id': 'category_id',
+            'description': 'description', 'published_date': 'published_date', 'pages': 'pages',
+            'updated_at': 'updated_at',
+        },
+        default_fields=['id', 'title', 'author', 'status'],
+        ordering=['title'],
+        filters={'status': 'status', 'category': 'category_id', 'author': 'author_id'},
+    ),
+    'authors': Resource(
+        Author,
+        fields={'id': 'pk', 'name': 'name', 'bio': 'bio', 'birth_date': 'birth_date'},
+        default_fields=['id', 'name'],
+        ordering=['name'],
+    ),
+    'categories': Resource(
+        Category,
+        fields={'id': 'pk', 'name': 'name', 'description': 'description', 'book_count': 'book_count'},
+        default_fields=['id', 'name'],
+        ordering=['name'],
+        annotate={'book_count': lambda queryset: queryset.with_book_counts()},
+    ),
+    'loans': OpenLoans(
+        BorrowRecord,
+        fields={
+            'id': 'pk', 'book_id': 'book_id', 'book': 'book__title',
+            'borrower_id': 'borrower_id', 'borrower': 'borrower__username',
+            'borrow_date': 'borrow_date', 'due_date': 'due_date', 'overdue_since': 'overdue_since',
+        },
+        default_fields=['id', 'book_id', 'book', 'borrower', 'due_date'],
+        ordering=None,  # the queryset's own: newest loans first, or due date with ?overdue=1
+        filters={'book': 'book_id', 'borrower': 'borrower_id'},
+    ),
+}
+
+
+def requested_fields(request, resource):
+    raw = request.GET.get('fields')
+    if not raw:
+        return resource.default_fields
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in resource.fields]
+    if unknown or not fields:
+        raise BadRequest(f"Unknown fields {', '.join(unknown) or raw!r}, choose from {', '.join(resource.fields)}.")
+    return fields
+
+
+def page(request, name):
+    #{'results': [...], 'next': '?cursor=...', 'previous': ...} for one page of a resource
+    resource = RESOURCES[name]
+    fields = requested_fields(request, resource)
+    queryset = resource.queryset(request)
+    for param, lookup in resource.filters.items():
+        if param in request.GET:
+            try:
+                queryset = queryset.filter(**{lookup: request.GET[param]})
+            except (ValueError, ValidationError):
+                raise BadRequest(f"Invalid value for {param!r}.")
+    for field in fields:
+        if field in resource.annotate:
+            queryset = resource.annotate[field](queryset)
+
+    #select the requested columns under their public names, plus the keys the cursor needs
+    keys = [key for key, _ in KeysetPaginator._ordering_keys(queryset, resource.ordering)]
+    columns = {f'f_{field}': F(resource.fields[field]) for field in fields}
+    rows = paginate(request, queryset.values(*keys, **columns), ordering=resource.ordering)
+    return {
+        'results': [{field: row[f'f_{field}'] for field in fields} for row in rows],
+        'next': rows.next_query or None,
+        'previous': rows.previous_query or None,
+    }
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BookConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'book'
+
+    def ready(self):
+        #connect the signal handlers for the stats counters and the cover pipeline,
+        #and register the vendored asset and profiling cache checks
+        from . import assets, profiling, signals  # noqa: F401
@@ -0,0 +1,101 @@
+import heapq
+from datetime import timedelta
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Max
+from django.utils import timezone
+
+from . import fragments
+from .models import ArchivedBorrowRecord, BorrowRecord
+from .services import run_with_retry
+
+# -----------------------------
+# BORROW HISTORY ARCHIVE
+# -----------------------------
+# Returned loans older than ARCHIVE_AFTER_DAYS are moved from book_borrowrecord
+# into book_archivedborrowrecord, keeping their ids, so the hot table holds only
+# open and recent loans and every open-loan query works against a small table.
+#
+# archive_returned() moves BATCH_SIZE rows per transaction: an INSERT ... SELECT
+# into the archive and a DELETE from the hot table, both over the same rows, so a
+# run that is interrupted (or stopped by max_batches) leaves every loan in
+# exactly one of the two tables and the next run carries on from there. Rows are
+# moved with plain SQL and send no signals: a loan stays counted in the stats
+# counters and circulation rollups wherever it lives.
+#
+# Readers that go back in time merge both tables, ordered by their keys: the
+# return history (return_list) once a page reaches the archived dates, and the
+# borrow export when its range starts on or before the newest archived loan.
+
+BATCH_SIZE = 1000
+
+#columns copied as they are, in this order; archived_at is filled in by the INSERT
+_COLUMNS = ('id', 'book_id', 'borrower_id', 'borrow_date', 'return_date', 'due_date', 'is_returned',
+            'notes', 'overdue_since', 'created_at', 'updated_at')
+
+
+def archive_after_days():
+    return getattr(settings, 'ARCHIVE_AFTER_DAYS', 365)
+
+
+def archivable(older_than_days=None, now=None):
+    #returned loans whose return is older than the cutoff, oldest first along book_return_date_idx;
+    #read from the primary, the replica may still list loans that were just moved
+    cutoff = (now or timezone.now()) - timedelta(days=archive_after_days() if older_than_days is None
+                                                 else older_than_days)
+    return (BorrowRecord.objects.using(router.db_for_write(BorrowRecord))
+            .filter(is_returned=True, return_date__lt=cutoff).order_by('return_date', 'pk'))
+
+
+def _move(loans, batch_size, archived_at):
+    #one batch: copy the first batch_size loans into the archive and delete them from the
+    #hot table; in one transaction the subquery picks the same rows both times
+    connection = connections[loans.db]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in _COLUMNS)
+    batch, params = loans.values('pk')[:batch_size].query.sql_with_params()
+    hot = quote(BorrowRecord._meta.db_table)
+    cold = quote(ArchivedBorrowRecord._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {cold} ({columns}, {quote("archived_at")}) '
+            f'SELECT {columns}, %s FROM {hot} WHERE id IN ({batch})',
+            [connection.ops.adapt_datetimefield_value(archived_at), *params],
+        )
+        cursor.execute(f'DELETE FROM {hot} WHERE id IN ({batch})', params)
+        return cursor.rowcount
+
+
+def archive_returned(older_than_days=None, batch_size=BATCH_SIZE, max_batches=None,
+                     log=lambda moved: None):
+    """
+    Move the archivable loans into the archive, batch_size per transaction.
+    Stops after max_batches batches when given; `log` receives the running total
+    after each batch. Returns the number of loans moved.
+    """
+    now = timezone.now()
+    loans = archivable(older_than_days, now)
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = run_with_retry(lambda: _move(loans, batch_size, now), using=loans.db)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        log(moved)
+    if moved:
+        fragments.invalidate(BorrowRecord)
+    return moved
+
+
+def newest(field, **lookups):
+    #the latest value of `field` among the archived loans matching `lookups`, None if there are none
+    #(an index lookup when an index leads with the lookups and then `field`)
+    return ArchivedBorrowRecord.objects.filter(**lookups).aggregate(newest=Max(field))['newest']
+
+
+def merge_sorted(columns, *row_iterators):
+    #merge row streams that are each sorted by the values at the `columns` positions
+    return heapq.merge(*row_iterators, key=itemgetter(*columns))
@@ -0,0 +1,234 @@
+import functools
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler, StaticFilesHandler
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.checks import Error, Tags, Warning, register
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.templatetags.static import static
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# -----------------------------
+# STATIC ASSETS
+# -----------------------------
+# `manage.py collectstatic` copies every asset to STATIC_ROOT under a name
+# carrying a hash of its content (css/styles.3f2a91c0d4e5.css, listed in
+# staticfiles.json) and writes a .gz next to each text file, plus a .br when
+# the optional brotli package is installed. {% static %} links the hashed
+# names, so the wsgi/asgi entry points serve them with a year-long `immutable`
+# Cache-Control: a changed file gets a new URL and browsers never revalidate
+# the old one. The handler sends the smallest variant the Accept-Encoding of
+# the request allows, without compressing anything per request.
+#
+# Third-party CSS/JS is kept under static/vendor/ (`manage.py vendor_assets`
+# fetches the pinned versions below once, and the files are committed), so
+# pages load nothing from a CDN. Until a file is vendored {% vendor_url %}
+# links its pinned CDN URL, so the pages keep their styles and scripts, and
+# `manage.py check` reports it (as an error with --deploy). Whether a file is
+# vendored is looked up once per process.
+
+VENDOR_DIR = 'vendor'
+#path under static/vendor/ -> (pinned upstream URL, its SRI hash when published)
+VENDOR = {
+    'bootstrap/css/bootstrap.min.css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.0.2/dist/css/bootstrap.min.css',
+        'sha384-EVSTQN3/azprG1Anm3QDgpJLIm9Nao0Yz1ztcQTwFspd3yD65VohhpuuCOmLASjC',
+    ),
+    'bootstrap/css/bootstrap.min.css.map': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.0.2/dist/css/bootstrap.min.css.map', None,
+    ),
+    'bootstrap/js/bootstrap.bundle.min.js': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+        'sha384-C6RzsynM9kWDrMNeT87bh95OGNyZPhcTNXj1NW7RuBCsyN/o0jlpcV8Qyq46cDfL',
+    ),
+    'bootstrap/js/bootstrap.bundle.min.js.map': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js.map', None,
+    ),
+    #the stylesheet loads its font from ./fonts/, so both are vendored side by side
+    'bootstrap-icons/bootstrap-icons.css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.1/font/bootstrap-icons.css', None,
+    ),
+    'bootstrap-icons/fonts/bootstrap-icons.woff2': (
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.1/font/fonts/bootstrap-icons.woff2', None,
+    ),
+    'bootstrap-icons/fonts/bootstrap-icons.woff': (
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.1/font/fonts/bootstrap-icons.woff', None,
+    ),
+}
+
+#extensions worth precompressing; images and woff fonts are compressed already
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ttf', '.eot')
+#below this many bytes the compressed copy saves less than its headers cost
+MIN_COMPRESS_SIZE = 256
+#Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+#unhashed names (the source names collectstatic also keeps) may change under the same URL
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+
+#VENDOR name -> its static path
+VENDOR_PATHS = {name: f'{VENDOR_DIR}/{name}' for name in VENDOR}
+
+
+@functools.cache
+def is_vendored(name):
+    #whether a staticfiles finder has the local copy of a VENDOR file
+    return finders.find(VENDOR_PATHS[name]) is not None
+
+
+@receiver(setting_changed)
+def _forget_vendored(setting, **kwargs):
+    if setting in ('STATICFILES_DIRS', 'STATICFILES_FINDERS', 'STATIC_ROOT'):
+        is_vendored.cache_clear()
+
+
+def vendor_url(name):
+    #the vendored copy of a VENDOR file, or its pinned upstream URL until it has been fetched
+    if is_vendored(name):
+        return static(VENDOR_PATHS[name])
+    return VENDOR[name][0]
+
+
+def missing_vendor_files():
+    #the VENDOR paths no staticfiles finder has
+    return [VENDOR_PATHS[name] for name in VENDOR if not is_vendored(name)]
+
+
+def _vendor_messages(level, id):
+    return [
+        level(f"Vendored asset {path} is missing, pages load it from the CDN.",
+              hint="Run `manage.py vendor_assets` and commit static/vendor/.", id=id)
+        for path in missing_vendor_files()
+    ]
+
+
+@register(Tags.staticfiles)
+def check_vendor_files(app_configs, **kwargs):
+    return _vendor_messages(Warning, 'book.W001')
+
+
+@register(Tags.staticfiles, deploy=True)
+def check_vendor_files_deployed(app_configs, **kwargs):
+    #a deployment should not depend on a third-party CDN
+    return _vendor_messages(Error, 'book.E001')
+
+
+def compress(data):
+    #{suffix: bytes} of the encodings that make `data` smaller
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data)}
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        #before collectstatic has written a manifest (development, the test suite) link the
+        #source names instead of failing on every {% static %}
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if not dry_run:
+            self.compress_files({*self.hashed_files, *self.hashed_files.values()})
+
+    def compress_files(self, names):
+        for name in names:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            with self.open(name) as original:
+                data = original.read()
+            if len(data) < MIN_COMPRESS_SIZE:
+                continue
+            for suffix, body in compress(data).items():
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self.save(name + suffix, ContentFile(body))
+
+
+def accepted_encodings(header):
+    #the content codings an Accept-Encoding header allows (q=0 refuses one)
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip().removeprefix('q=')
+        try:
+            refused = params and float(quality) == 0
+        except ValueError:
+            refused = False
+        if coding and not refused:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class PrecompressedMixin:
+    """
+    Serve collected files from STATIC_ROOT, choosing the precompressed variant
+    the client accepts and marking content-hashed names immutable.
+    """
+
+    _immutable_names = None
+
+    def immutable_names(self):
+        #the hashed names of the manifest, read once per process like the manifest itself
+        if self._immutable_names is None:
+            self._immutable_names = frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        return self._immutable_names
+
+    def serve(self, request):
+        name = request.path.removeprefix(self.base_url.path)
+        try:
+            path = safe_join(settings.STATIC_ROOT, self.file_path(request.path))
+        except SuspiciousFileOperation:
+            raise Http404(name)
+        if not os.path.isfile(path):
+            raise Http404(name)
+        mtime = os.stat(path).st_mtime
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime):
+            response = HttpResponseNotModified()
+        else:
+            content_type, _ = mimetypes.guess_type(path)
+            accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            variants = [(coding, path + suffix) for coding, suffix in ENCODINGS if os.path.isfile(path + suffix)]
+            coding, served = next(((coding, variant) for coding, variant in variants if coding in accepted),
+                                  (None, path))
+            response = FileResponse(open(served, 'rb'), content_type=content_type or 'application/octet-stream',
+                                    filename=os.path.basename(path))
+            if coding:
+                response.headers['Content-Encoding'] = coding
+            if variants:
+                patch_vary_headers(response, ('Accept-Encoding',))
+            response.headers['Last-Modified'] = http_date(mtime)
+        immutable = name in self.immutable_names()
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        return response
+
+
+class StaticAssetsHandler(PrecompressedMixin, StaticFilesHandler):
+    #WSGI: wraps book_display.wsgi.application
+    pass
+
+
+class ASGIStaticAssetsHandler(PrecompressedMixin, ASGIStaticFilesHandler):
+    #ASGI: wraps book_display.asgi.application
+    pass
@@ -0,0 +1,137 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import aget_object_or_404, render
+
+from .conditional import conditional_page
+from .fragments import acached_fragment
+from .models import Author, Book, BorrowRecord, Category
+from .pagination import apaginate
+from .querybudget import query_budget
+from .search import find_books
+from .stats import aget_stats
+
+# -----------------------------
+# ASYNC READ VIEWS
+# -----------------------------
+# Native async versions of the read-heavy views in book.views, routed instead
+# of them when settings.ASYNC_READ_VIEWS is on (BOOK_ASYNC_VIEWS=1 under ASGI).
+# They take the same query budgets and render the same templates; every row is
+# loaded with the async ORM before rendering, because a template must not touch
+# the database from the event loop.
+
+
+def _resolve_user(view):
+    #swap the lazy request.user for the user loaded by the async auth check, so the
+    #ETag function and the templates can read it without a query from the event loop
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.user = await request.auser()
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def _alist(queryset):
+    return [row async for row in queryset.aiterator()]
+
+
+# Dashboard view
+@login_required
+@_resolve_user
+@query_budget(3)
+async def dashboard(request):
+    # the three reads don't depend on each other, so they are issued together
+    stats, recent_activity, categories = await asyncio.gather(
+        aget_stats(),
+        _alist(BorrowRecord.objects.select_related('book', 'borrower')[:10]),
+        _alist(Category.objects.with_book_counts()[:10]),
+    )
+    context = {
+        'total_books': stats.total_books,
+        'available_books': stats.available_books,
+        'borrowed_books': stats.borrowed_books,
+        'total_authors': stats.total_authors,
+        'total_categories': stats.total_categories,
+        'recent_activity': recent_activity,
+        'categories': categories,
+    }
+    return render(request, 'dashboard.html', context)
+
+
+# ------------------ Book Views ------------------
+@login_required
+@_resolve_user
+@conditional_page(Book, Author, Category)
+@query_budget(2)
+async def book_list(request):
+    search_query = request.GET.get('search', '').strip()
+
+    async def get_context():
+        if search_query:
+            # the FTS5 query is raw SQL on a plain cursor, run it on the sync thread
+            books = await sync_to_async(find_books)(search_query)
+        else:
+            books = await apaginate(request, Book.objects.select_related('author', 'category'))
+        return {'books': books, 'search_query': search_query}
+
+    table = await acached_fragment(request, 'book_list', [Book, Author, Category],
+                                   'book_list_table.html', get_context)
+    context = {'table': table, 'title': 'Books', 'search_query': search_query}
+    return render(request, 'book_list.html', context)
+
+
+@login_required
+@_resolve_user
+@conditional_page(Book, Author, Category)
+@query_budget(1)
+async def book_detail(request, pk):
+    book = await aget_object_or_404(Book.objects.select_related('author', 'category'), pk=pk)
+    return render(request, 'book_detail.html', {'book': book, 'title': book.title})
+
+
+# ------------------ Author Views ------------------
+@login_required
+@_resolve_user
+@conditional_page(Author)
+@query_budget(1)
+async def author_list(request):
+    async def get_context():
+        return {'authors': await apaginate(request, Author.objects.all())}
+
+    table = await acached_fragment(request, 'author_list', [Author], 'author_table.html', get_context)
+    return render(request, 'author_list.html', {'table': table, 'title': 'Authors'})
+
+
+@login_required
+@_resolve_user
+@conditional_page(Author, Book, Category)
+@query_budget(2)
+async def author_detail(request, pk):
+    author = await aget_object_or_404(Author, pk=pk)
+    books = await apaginate(request, author.books.select_related('category'))
+    return render(request, 'author_detail.html', {'author': author, 'books': books, 'title': author.name})
+
+
+# ------------------ Category Views ------------------
+@login_required
+@_resolve_user
+@conditional_page(Category, Book)
+@query_budget(1)
+async def category_list(request):
+    async def get_context():
+        return {'categories': await apaginate(request, Category.objects.with_book_counts())}
+
+    table = await acached_fragment(request, 'category_list', [Category, Book], 'category_table.html', get_context)
+    return render(request, 'category_list.html', {'table': table, 'title': 'Categories'})
+
+
+@login_required
+@_resolve_user
+@conditional_page(Category, Book, Author)
+@query_budget(2)
+async def category_detail(request, pk):
+    category = await aget_object_or_404(Category, pk=pk)
+    books = await apaginate(request, category.books.select_related('author'))
+    return render(request, 'category_detail.html', {'category': category, 'books': books, 'title': category.name})
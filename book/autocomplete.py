@@ -0,0 +1,140 @@
+import hashlib
+import string
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connections
+from django.db.models.functions import Lower
+
+from . import fragments
+from .models import Author, Book, Category
+
+# -----------------------------
+# TYPEAHEAD LOOKUPS
+# -----------------------------
+# The pickers of the borrow and book forms load their choices from
+# /autocomplete/<source>/?q= instead of rendering an <option> per row. A query
+# is a prefix match on a lower() expression index (the username one on
+# auth_user is created by migration 0012): a range scan from the prefix to its
+# successor string, read in index order and cut at LIMIT rows, so it costs the
+# same with 200 or 200,000 rows. Results are cached for CACHE_SECONDS under a
+# key that includes the fragment generations of the source's models, so an
+# edit through the ORM shows up at once; the short TTL bounds how long writes
+# made with raw SQL or bulk loads, which move no generation, can be missed.
+#
+# The prefix is lowercased the way the index key is: SQLite's lower() folds
+# only the ASCII letters, so Python's Unicode lower() would turn 'É' into an
+# 'é' the index never holds.
+
+LIMIT = 10
+CACHE_SECONDS = 30
+MAX_QUERY_LENGTH = 100
+
+#book statuses a borrow form can lend: on the shelf, or put aside for the borrower's hold
+BORROWABLE = ('available', 'reserved')
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _cache():
+    return caches[getattr(settings, 'AUTOCOMPLETE_CACHE', 'default')]
+
+
+def prefix_bounds(prefix):
+    #(low, high) with low <= s < high for exactly the strings s that start with prefix
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class Source:
+    def __init__(self, queryset, key, fields, label, models=()):
+        #queryset() -> rows to search; key: the indexed expression matched by prefix;
+        #fields: values() read for label(row) -> the text shown in the picker
+        self.queryset = queryset
+        self.key = key
+        self.fields = fields
+        self.label = label
+        #models whose fragment generations are part of the cache key
+        self.models = models
+
+    def fold(self, text):
+        #text lowercased the way the database's lower() builds the index key
+        if connections[self.queryset().db].vendor == 'sqlite':
+            return text.translate(_ASCII_LOWER)
+        return text.lower()
+
+    def matches(self, prefix):
+        queryset = self.queryset()
+        if prefix:
+            low, high = prefix_bounds(prefix)
+            queryset = queryset.alias(prefix_key=self.key).filter(prefix_key__gte=low, prefix_key__lt=high)
+        return queryset.order_by(self.key, 'pk')
+
+    def rows(self, queryset, limit=LIMIT):
+        return list(queryset.values('pk', *self.fields)[:limit])
+
+    def lookup(self, text):
+        return [{'id': row['pk'], 'text': self.label(row)} for row in self.rows(self.matches(self.fold(text)))]
+
+
+class BookSource(Source):
+    def lookup(self, text):
+        #an ISBN prefix also walks the unique isbn index: those books come first, and the
+        #titles starting with the same digits ("1984", "2001") fill the rest of the list
+        isbn = text.replace('-', '').upper()
+        if len(isbn) < 3 or not isbn.rstrip('X').isdigit():
+            return super().lookup(text)
+        low, high = prefix_bounds(isbn)
+        rows = self.rows(self.queryset().filter(isbn__gte=low, isbn__lt=high).order_by('isbn'))
+        if len(rows) < LIMIT:
+            found = {row['pk'] for row in rows}
+            titles = self.rows(self.matches(self.fold(text)), LIMIT + len(found))
+            rows += [row for row in titles if row['pk'] not in found][:LIMIT - len(rows)]
+        return [{'id': row['pk'], 'text': self.label(row)} for row in rows]
+
+
+SOURCES = {
+    'books': BookSource(
+        lambda: Book.objects.filter(status__in=BORROWABLE),
+        key=Lower('title'),
+        fields=('title', 'isbn', 'author__name'),
+        label=lambda row: f"{row['title']} by {row['author__name']}" + (f" ({row['isbn']})" if row['isbn'] else ''),
+        models=(Book, Author),
+    ),
+    'borrowers': Source(
+        lambda: User.objects.filter(is_active=True),
+        key=Lower('username'),
+        fields=('username',),
+        label=lambda row: row['username'],
+        models=(User,),
+    ),
+    'authors': Source(
+        Author.objects.all,
+        key=Lower('name'),
+        fields=('name',),
+        label=lambda row: row['name'],
+        models=(Author,),
+    ),
+    'categories': Source(
+        Category.objects.all,
+        key=Lower('name'),
+        fields=('name',),
+        label=lambda row: row['name'],
+        models=(Category,),
+    ),
+}
+
+
+def suggest(name, text):
+    #[{'id': pk, 'text': label}] for the first LIMIT rows of a source starting with text
+    source = SOURCES[name]
+    text = (text or '').strip()[:MAX_QUERY_LENGTH]
+    generations = fragments.generations(*source.models)
+    digest = hashlib.sha1(source.fold(text).encode()).hexdigest()
+    key = f"book:autocomplete:{name}:{'.'.join(map(str, generations))}:{digest}"
+    cache = _cache()
+    results = cache.get(key)
+    if results is None:
+        results = source.lookup(text)
+        cache.set(key, results, CACHE_SECONDS)
+    return results
@@ -0,0 +1,147 @@
+import platform
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+import django
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+from django.urls import resolve
+from django.utils import timezone
+
+from . import replica
+from .models import Author, Book, BorrowRecord, Category
+from .querybudget import _QueryCounter, _watch
+from .queryplans import view_urls
+from .seeding import WORDS
+
+# -----------------------------
+# VIEW BENCHMARKS
+# -----------------------------
+# Every GET view in book.urls (the same URL list the query plan checks use) is
+# requested with the test client, logged in, against whatever data the database
+# holds, normally a library loaded by seed_bench. For each URL the results
+# record latency percentiles over `repeat` requests, the number of SQL queries
+# and the peak Python memory of one request. Peak memory is measured on an extra
+# request, because tracemalloc slows down everything it watches.
+#
+# The results are JSON, keyed by URL name plus query string (not by primary
+# keys, which differ between databases), so a run can be saved as a baseline
+# and later runs compared against it.
+
+BENCH_USER = 'bench-views'
+
+#a metric only counts as changed past both limits, to ride out timer noise
+LATENCY_TOLERANCE = 0.25
+LATENCY_FLOOR_MS = 2.0
+MEMORY_TOLERANCE = 0.25
+MEMORY_FLOOR_KB = 256
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def url_key(url):
+    parts = urlsplit(url)
+    name = resolve(parts.path).url_name
+    return f'{name}?{parts.query}' if parts.query else name
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def measure(client, url, repeat):
+    counter = _QueryCounter()
+    with _watch(counter):
+        response = _get(client, url)
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        _get(client, url)
+        latencies.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    try:
+        _get(client, url)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'queries': len(counter.queries),
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p90_ms': round(percentile(latencies, 0.9), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(max(latencies), 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(repeat=20, urls=None, log=lambda key, result: None):
+    #{'meta': {...}, 'urls': {key: result}} for every view, with DEBUG off as in production
+    user, created = User.objects.get_or_create(username=BENCH_USER, defaults={'is_staff': True})
+    if created:
+        #its borrower profile is read from the replica, which the pages use when there is one
+        replica.sync()
+    results = {}
+    with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+        client = Client()
+        client.force_login(user)
+        for url in urls or view_urls(search=WORDS[0]):
+            key = url_key(url)
+            results[key] = measure(client, url, repeat)
+            log(key, results[key])
+    return {
+        'meta': {
+            'created': timezone.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'repeat': repeat,
+            'rows': {
+                'books': Book.objects.count(), 'authors': Author.objects.count(),
+                'categories': Category.objects.count(), 'loans': BorrowRecord.objects.count(),
+                'users': User.objects.count(),
+            },
+        },
+        'urls': results,
+    }
+
+
+def _moved(old, new, tolerance, floor):
+    #changed by more than `tolerance` (a fraction) and more than `floor`, either way
+    return abs(new - old) > floor and abs(new - old) > old * tolerance
+
+
+def compare(baseline, current):
+    """
+    [(key, metric, baseline value, current value, is_regression)] for every
+    metric that moved beyond the noise limits, and for URLs missing from either run.
+    """
+    changes = []
+    old_urls, new_urls = baseline['urls'], current['urls']
+    for key in sorted(old_urls.keys() | new_urls.keys()):
+        old, new = old_urls.get(key), new_urls.get(key)
+        if old is None or new is None:
+            changes.append((key, 'url', 'present' if old else 'missing', 'present' if new else 'missing',
+                            new is None))
+            continue
+        if old['status'] != new['status']:
+            changes.append((key, 'status', old['status'], new['status'], True))
+        if old['queries'] != new['queries']:
+            changes.append((key, 'queries', old['queries'], new['queries'], new['queries'] > old['queries']))
+        #p99 is the slowest one or two requests of a short run, it is shown but never fails
+        limits = {
+            'p50_ms': (LATENCY_TOLERANCE, LATENCY_FLOOR_MS, True),
+            'p99_ms': (LATENCY_TOLERANCE, LATENCY_FLOOR_MS, False),
+            'peak_kb': (MEMORY_TOLERANCE, MEMORY_FLOOR_KB, True),
+        }
+        for metric, (tolerance, floor, fails) in limits.items():
+            if _moved(old[metric], new[metric], tolerance, floor):
+                changes.append((key, metric, old[metric], new[metric], fails and new[metric] > old[metric]))
+    return changes
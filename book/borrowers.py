@@ -0,0 +1,155 @@
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import router, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils import timezone
+
+from .models import BorrowerProfile, BorrowRecord
+
+# -----------------------------
+# BORROWER PROFILES
+# -----------------------------
+# Every user has a BorrowerProfile row holding the number of loans they have
+# open and how many of those sweep_overdue has marked overdue. checkout() reads
+# that one row to enforce the loan limits, instead of counting the borrower's
+# loans on every checkout.
+#
+# Loans created, returned or deleted through the ORM move the counters from
+# book.signals (a deleted book's loans in one pass); return_loan(),
+# return_loans() and sweep_overdue write with QuerySet.update() and move them
+# themselves, in the same transaction. A missing profile (a user created before the profiles
+# existed, or rows written by bulk_create) is recounted from the loans the
+# first time it is needed.
+
+#profile fields rebuilt by recount()
+COUNTERS = ('active_loans', 'overdue_loans')
+RECOUNT_BATCH = 1000
+
+
+def loan_limit(profile):
+    #the borrower's own limit, else LOAN_LIMIT; None means unlimited
+    if profile.loan_limit is not None:
+        return profile.loan_limit
+    return getattr(settings, 'LOAN_LIMIT', None)
+
+
+def overdue_limit():
+    #checkout is refused once a borrower has this many overdue loans; None means never
+    return getattr(settings, 'OVERDUE_LOAN_LIMIT', None)
+
+
+def open_counts(state):
+    #(active, overdue) counter contributions of a loan in the given state, a dict of its fields
+    if state is None or state['is_returned']:
+        return 0, 0
+    return 1, 1 if state['overdue_since'] is not None else 0
+
+
+def bump(user_id, using=None, **deltas):
+    #add the given deltas to one borrower's counters with a single UPDATE ... SET x = x + n
+    changes = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    if not changes:
+        return
+    #a missing profile is left alone: recount() reads the loans as they are once it is needed,
+    #and creating it here could race the cascade of a user being deleted
+    BorrowerProfile.objects.using(using or router.db_for_write(BorrowerProfile)).filter(
+        pk=user_id).update(updated_at=timezone.now(), **changes)
+
+
+def loan_changed(old, new, using=None):
+    #move the counters from a loan's old state to its new one (None for created / deleted)
+    deltas = {}
+    for state, sign in ((old, -1), (new, 1)):
+        if state is None:
+            continue
+        active, overdue = open_counts(state)
+        counts = deltas.setdefault(state['borrower_id'], [0, 0])
+        counts[0] += sign * active
+        counts[1] += sign * overdue
+    for user_id, (active, overdue) in deltas.items():
+        bump(user_id, using, active_loans=active, overdue_loans=overdue)
+
+
+def _add(counts, counter, using):
+    #add {user id: n} to one counter of many borrowers with a single UPDATE ... SET x = x + CASE ...
+    if not counts:
+        return
+    increment = Case(*[When(pk=user_id, then=Value(count)) for user_id, count in counts.items()], default=0)
+    BorrowerProfile.objects.using(using).filter(pk__in=counts).update(
+        **{counter: F(counter) + increment}, updated_at=timezone.now())
+
+
+def _open_counts_by_borrower(loans):
+    #{borrower id: (open loans, overdue loans)} of a queryset of loans, one GROUP BY
+    return {
+        row['borrower']: (row['active'], row['overdue'])
+        for row in loans.open().order_by().values('borrower').annotate(
+            active=Count('pk'), overdue=Count('pk', filter=Q(overdue_since__isnull=False)))
+    }
+
+
+def overdue_marked(pks, marked_at, using=None):
+    #count the loans among `pks` that sweep_overdue stamped at `marked_at`
+    using = using or router.db_for_write(BorrowerProfile)
+    marked = _open_counts_by_borrower(
+        BorrowRecord.objects.using(using).filter(pk__in=pks, overdue_since=marked_at))
+    _add({user_id: overdue for user_id, (_, overdue) in marked.items()}, 'overdue_loans', using)
+
+
+def loans_removed(loans, using=None):
+    #take a queryset of loans about to be deleted out of their borrowers' counters
+    using = using or router.db_for_write(BorrowerProfile)
+    removed = _open_counts_by_borrower(loans.using(using))
+    _add({user_id: -active for user_id, (active, _) in removed.items()}, 'active_loans', using)
+    _add({user_id: -overdue for user_id, (_, overdue) in removed.items() if overdue}, 'overdue_loans', using)
+
+
+def loans_returned(loans, using=None):
+    #take loans just closed by return_loans(), dicts with borrower_id and overdue_since, out of
+    #their borrowers' counters
+    using = using or router.db_for_write(BorrowerProfile)
+    active, overdue = Counter(), Counter()
+    for loan in loans:
+        active[loan['borrower_id']] -= 1
+        if loan['overdue_since'] is not None:
+            overdue[loan['borrower_id']] -= 1
+    _add(active, 'active_loans', using)
+    _add(overdue, 'overdue_loans', using)
+
+
+def recount(user_ids, using=None):
+    #rebuild the counters of the given users from their open loans, keeping their loan limits
+    using = using or router.db_for_write(BorrowerProfile)
+    counts = _open_counts_by_borrower(BorrowRecord.objects.using(using).filter(borrower__in=user_ids))
+    now = timezone.now()
+    profiles = [
+        BorrowerProfile(user_id=user_id, updated_at=now, **dict(zip(COUNTERS, counts.get(user_id, (0, 0)))))
+        for user_id in user_ids
+    ]
+    BorrowerProfile.objects.using(using).bulk_create(
+        profiles, update_conflicts=True, unique_fields=['user'], update_fields=[*COUNTERS, 'updated_at'])
+
+
+def get_profile(user_id, for_update=False, using=None):
+    #one primary key lookup, recounting the profile first if it doesn't exist yet
+    using = using or router.db_for_write(BorrowerProfile)
+    profiles = BorrowerProfile.objects.using(using)
+    if for_update:
+        profiles = profiles.select_for_update()
+    profile = profiles.filter(pk=user_id).first()
+    if profile is None:
+        recount([user_id], using)
+        profile = profiles.get(pk=user_id)
+    return profile
+
+
+@transaction.atomic
+def recompute():
+    #rebuild every borrower's counters, used by the recompute_stats command and after seeding;
+    #returns the number of profiles written
+    user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(user_ids), RECOUNT_BATCH):
+        recount(user_ids[start:start + RECOUNT_BATCH])
+    return len(user_ids)
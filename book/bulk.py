@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from itertools import islice
+
+# -----------------------------
+# BULK LOADING HELPERS
+# -----------------------------
+# Shared by the import/seed commands: fixed-size chunking of any iterable and a
+# bounded name -> id cache that resolves (and creates) Author/Category rows a
+# whole chunk at a time instead of one query per input row.
+
+
+def chunked(iterable, size):
+    #yield lists of up to `size` items without reading the whole iterable
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class NameCache:
+    #LRU map of name -> pk for a model with a `name` field, capped at max_size entries
+
+    def __init__(self, model, max_size=100_000):
+        self.model = model
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self.created = 0
+
+    def _remember(self, name, pk):
+        self._ids[name] = pk
+        self._ids.move_to_end(name)
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def resolve(self, names):
+        #return {name: pk} for every name, creating the missing rows with one bulk_create
+        wanted = {name for name in names if name}
+        found = {}
+        for name in wanted:
+            if name in self._ids:
+                self._ids.move_to_end(name)
+                found[name] = self._ids[name]
+        missing = wanted - found.keys()
+        if missing:
+            # Author.name isn't unique, the oldest row with the name wins
+            rows = (
+                self.model.objects.filter(name__in=missing)
+                .order_by('-pk')
+                .values_list('name', 'pk')
+            )
+            found.update(rows)
+            to_create = [self.model(name=name) for name in missing - found.keys()]
+            if to_create:
+                # SQLite returns the new primary keys from bulk_create
+                for obj in self.model.objects.bulk_create(to_create):
+                    found[obj.name] = obj.pk
+                self.created += len(to_create)
+        for name in missing:
+            self._remember(name, found[name])
+        return found
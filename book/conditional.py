@@ -0,0 +1,65 @@
+import functools
+import hashlib
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.views.decorators.http import condition
+
+from .fragments import arequest_generations, request_generations
+
+# -----------------------------
+# CONDITIONAL GET
+# -----------------------------
+# Read views send an ETag built from the generation numbers that book.fragments
+# keeps for every model in the database (one primary key lookup, which the
+# page's fragments then reuse), so a repeat visit whose If-None-Match still
+# matches gets a 304 before the view body runs a query or renders a template.
+# The tag is the same from every server process. It also covers the URL, the
+# user and the CSRF cookie, since the page embeds all three. Only a 200 keeps
+# the tag: an error page sent with it could later be confirmed with a 304.
+
+
+def _etag(request, versions):
+    #a pending flash message must be rendered, never answered with a 304
+    if len(get_messages(request)):
+        return None
+    parts = [
+        request.get_full_path(),
+        str(request.user.pk),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        *map(str, versions),
+    ]
+    return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def _only_ok(response):
+    #the tag describes the page, not an error response the view returned instead
+    if response.status_code not in (200, 304) and response.has_header('ETag'):
+        del response.headers['ETag']
+    return response
+
+
+def conditional_page(*models):
+    #decorator: ETag / If-None-Match handling for a page that shows rows of `models`
+    def decorator(view):
+        if not iscoroutinefunction(view):
+            def etag(request, *args, **kwargs):
+                return _etag(request, request_generations(request, models))
+            checked = condition(etag_func=etag)(view)
+
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                return _only_ok(checked(request, *args, **kwargs))
+            return wrapper
+
+        #condition() calls the ETag function synchronously, so an async view reads the
+        #generations with the async ORM first
+        checked = condition(etag_func=lambda request, *args, **kwargs: request._page_etag)(view)
+
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request._page_etag = _etag(request, await arequest_generations(request, models))
+            return _only_ok(await checked(request, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,181 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection, transaction
+from PIL import Image, ImageOps
+
+from . import fragments
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# COVER IMAGES
+# -----------------------------
+# Uploaded covers are stored under the SHA-256 of their bytes
+# (book_covers/ab/abcdef....jpg), so the same image uploaded for many books is
+# kept once. Catalog pages never serve the original: after the book is saved a
+# background worker renders fixed-size WebP derivatives next to it
+# (book_covers/derived/<hash>_thumb.webp) and the {% cover_url %} tag picks the
+# one that fits, falling back to the original until it exists.
+
+COVER_DIR = 'book_covers'
+DERIVED_DIR = f'{COVER_DIR}/derived'
+#name -> bounding box (width, height), the aspect ratio is kept
+SIZES = {
+    'thumb': (200, 300),
+    'medium': (480, 720),
+}
+DERIVED_FORMAT = 'WEBP'
+DERIVED_EXTENSION = 'webp'
+DERIVED_QUALITY = 80
+
+_executor = None
+_executor_lock = threading.Lock()
+#cover name -> Future of the job already queued for it
+_pending = {}
+#derivative name -> pixel width, hashed derivatives never change once written
+_widths = {}
+WIDTH_CACHE_SIZE = 10000
+
+
+def content_hash(file):
+    #hex SHA-256 of a file object, read in chunks and rewound afterwards
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(digest, filename):
+    extension = os.path.splitext(filename)[1].lower() or '.jpg'
+    return f'{COVER_DIR}/{digest[:2]}/{digest}{extension}'
+
+
+def store_original(file, storage=default_storage):
+    #save an uploaded cover under its content hash, reusing the stored copy if there is one
+    name = hashed_name(content_hash(file), file.name)
+    if not storage.exists(name):
+        saved = storage.save(name, file)
+        if saved != name:
+            #another upload of the same bytes won the race, keep the first copy
+            storage.delete(saved)
+    return name
+
+
+def cover_digest(name):
+    #the content hash in a hashed cover name, None for covers stored before hashing
+    stem = os.path.splitext(os.path.basename(name or ''))[0]
+    return stem if len(stem) == 64 and all(ch in '0123456789abcdef' for ch in stem) else None
+
+
+def derivative_name(name, size):
+    key = cover_digest(name) or os.path.splitext(name)[0].replace('/', '_')
+    return f'{DERIVED_DIR}/{key}_{size}.{DERIVED_EXTENSION}'
+
+
+def render_derivative(image, size):
+    resized = image.copy()
+    resized.thumbnail(SIZES[size], Image.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, DERIVED_FORMAT, quality=DERIVED_QUALITY, method=4)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_derivatives(name, storage=default_storage):
+    #render every missing size of one stored cover, returns the names written
+    missing = {size: derivative_name(name, size) for size in SIZES}
+    missing = {size: target for size, target in missing.items() if not storage.exists(target)}
+    if not missing:
+        return []
+    with storage.open(name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        written = []
+        for size, target in missing.items():
+            content = render_derivative(image, size)
+            if not storage.exists(target):
+                written.append(storage.save(target, content))
+    return written
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'COVER_WORKERS', 2),
+                thread_name_prefix='covers',
+            )
+        return _executor
+
+
+def _run(name):
+    try:
+        written = generate_derivatives(name)
+    except Exception:
+        logger.exception('could not build derivatives for %s', name)
+        raise
+    if written:
+        #pages cached or tagged while the original was still in use now point at the derivatives;
+        #if the database is busy they keep the original until the next change to a book
+        try:
+            fragments.bump(Book)
+        except DatabaseError:
+            logger.warning('could not move the book generation after rendering %s', name, exc_info=True)
+        finally:
+            #the pool threads don't keep a connection open between covers
+            connection.close()
+    return written
+
+
+def process_cover(name):
+    #hand one cover to the worker pool, returns the Future (shared with a job already queued for it)
+    executor = _get_executor()
+    with _executor_lock:
+        future = _pending.get(name)
+        if future is None:
+            future = _pending[name] = executor.submit(_run, name)
+            future.add_done_callback(lambda done: _pending.pop(name, None))
+    return future
+
+
+def schedule(name, using=None):
+    #process the cover once the transaction that saved it commits
+    if name:
+        transaction.on_commit(lambda: process_cover(name), using=using)
+
+
+def derivative_url(name, size, storage=default_storage):
+    #URL of a rendered size, or of the original while the worker hasn't got to it yet
+    target = derivative_name(name, size)
+    if storage.exists(target):
+        return storage.url(target)
+    return storage.url(name)
+
+
+def derivative_width(name, size, storage=default_storage):
+    #pixel width of a rendered size (smaller than the box for small originals, which are never
+    #upscaled), None while the worker hasn't got to it yet
+    target = derivative_name(name, size)
+    width = _widths.get(target)
+    if width is None:
+        if not storage.exists(target):
+            return None
+        with storage.open(target, 'rb') as stream:
+            #only the header is read
+            width = Image.open(stream).width
+        if cover_digest(name):
+            if len(_widths) >= WIDTH_CACHE_SIZE:
+                _widths.clear()
+            _widths[target] = width
+    return width
@@ -0,0 +1,268 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.db import router
+from django.db.models import Case, Value, When
+
+from . import fragments, rollups, stats
+from .bulk import chunked
+from .models import ArchivedBorrowRecord, Author, Book, BorrowRecord, Hold
+from .services import run_with_retry
+
+# -----------------------------
+# DUPLICATE DETECTION
+# -----------------------------
+# Near-duplicate authors and books are found without comparing every pair.
+# Each row is normalized once (accents, case and punctuation folded away, an
+# ISBN-10 or ISBN-13 checked and turned into its ISBN-13) and put in a block
+# with the rows it could duplicate:
+#   authors: by surname and first initial ("tolkien j")
+#   books:   by valid ISBN, and by author, read along book_author_title_idx
+#            so only one author's books are held at a time
+# Inside a block the rows are sorted by their normalized key and each one is
+# scored against the next WINDOW rows only (a sorted neighbourhood), with the
+# Jaccard similarity of their character trigrams, so the work grows with the
+# number of rows rather than with its square. The trigrams of a block are
+# numbered once and each row's set packed into an int bitmask, so a pair is
+# scored with one AND and a popcount instead of building set intersections
+# and unions, and pairs whose trigram counts alone rule out MIN_SCORE are
+# skipped. Pairs scoring at least MIN_SCORE are joined into groups, and a
+# group keeps its lowest id.
+#
+# merge_authors() and merge_books() repoint the foreign keys of the rest of a
+# group with one UPDATE per table and delete them, a batch of groups per
+# transaction. A book is only merged away while it is on the shelf with no
+# hold on it, so no open loan or hold queue changes hands, and only into a
+# book of the same author and category, so the per-author and per-category
+# rollups and counters stay as they are.
+
+WINDOW = 20
+MIN_SCORE = 0.85
+#rows fetched per round trip while blocking
+READ_CHUNK = 5000
+#groups merged per transaction
+MERGE_BATCH = 100
+
+_SEPARATORS = re.compile(r'[\W_]+')
+ARTICLES = {'the', 'a', 'an'}
+
+
+def fold(text):
+    #the words of `text`, lowercased, without accents or punctuation
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return _SEPARATORS.sub(' ', text).split()
+
+
+def _isbn13_check(digits):
+    return str(-sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(digits)) % 10)
+
+
+def isbn13(value):
+    #the ISBN-13 of an ISBN-10 or ISBN-13 in any formatting, None when its check digit is wrong
+    isbn = ''.join(ch for ch in str(value or '') if ch.isalnum()).upper()
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        check = 10 if isbn[9] == 'X' else int(isbn[9])
+        if (sum((10 - index) * int(digit) for index, digit in enumerate(isbn[:9])) + check) % 11:
+            return None
+        return '978' + isbn[:9] + _isbn13_check('978' + isbn[:9])
+    if len(isbn) == 13 and isbn.isdigit() and _isbn13_check(isbn[:12]) == isbn[12]:
+        return isbn
+    return None
+
+
+def author_tokens(name):
+    #"Tolkien, J.R.R." is read as "J.R.R. Tolkien"
+    if (name or '').count(',') == 1:
+        surname, given = name.split(',')
+        name = f'{given} {surname}'
+    return fold(name)
+
+
+def title_key(title):
+    words = fold(title)
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def trigram_masks(keys):
+    #([bitmask of each key's trigrams], [their counts]), trigrams numbered once for the whole block
+    bits = {}
+    masks = []
+    for key in keys:
+        mask = 0
+        for gram in trigrams(key):
+            mask |= 1 << bits.setdefault(gram, len(bits))
+        masks.append(mask)
+    return masks, [mask.bit_count() for mask in masks]
+
+
+def alike(rows, min_score=MIN_SCORE, window=WINDOW):
+    """
+    Yield the (pk, pk) pairs of one block that look like duplicates. `rows`
+    are (key, pk, isbn) tuples; two rows with different valid ISBNs are
+    different editions and never paired.
+    """
+    rows = sorted(rows)
+    masks, sizes = trigram_masks([key for key, _, _ in rows])
+    for index, (key, pk, isbn) in enumerate(rows):
+        mask, size = masks[index], sizes[index]
+        for other in range(index + 1, min(index + 1 + window, len(rows))):
+            other_key, other_pk, other_isbn = rows[other]
+            if isbn and other_isbn and isbn != other_isbn:
+                continue
+            if key == other_key:
+                yield pk, other_pk
+                continue
+            #the Jaccard score is at most the ratio of the two trigram counts
+            other_size = sizes[other]
+            if min(size, other_size) < min_score * max(size, other_size):
+                continue
+            shared = (mask & masks[other]).bit_count()
+            if shared >= min_score * (size + other_size - shared):
+                yield pk, other_pk
+
+
+class Groups:
+    #union-find over primary keys; every group is rooted at its lowest id
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, pk):
+        path = []
+        while pk in self.parent:
+            path.append(pk)
+            pk = self.parent[pk]
+        for node in path:
+            self.parent[node] = pk
+        return pk
+
+    def join(self, pairs):
+        for first, second in pairs:
+            first, second = self.find(first), self.find(second)
+            if first != second:
+                self.parent[max(first, second)] = min(first, second)
+
+    def groups(self):
+        #[[kept id, duplicate id, ...]] ordered by kept id
+        members = defaultdict(list)
+        for pk in self.parent:
+            members[self.find(pk)].append(pk)
+        return [[root, *sorted(pks)] for root, pks in sorted(members.items())]
+
+
+def find_authors(min_score=MIN_SCORE, using=None):
+    using = using or router.db_for_read(Author)
+    blocks = defaultdict(list)
+    authors = Author.objects.using(using).order_by().values_list('pk', 'name')
+    for pk, name in authors.iterator(chunk_size=READ_CHUNK):
+        tokens = author_tokens(name)
+        if tokens:
+            blocks[(tokens[-1], tokens[0][0])].append((''.join(tokens), pk, None))
+    groups = Groups()
+    for rows in blocks.values():
+        groups.join(alike(rows, min_score))
+    return groups.groups()
+
+
+def find_books(min_score=MIN_SCORE, using=None):
+    using = using or router.db_for_read(Book)
+    groups = Groups()
+    #ISBN-13 (as an int, to keep millions of them small) -> first book seen with it
+    first_with_isbn = {}
+    block, block_author = [], None
+    books = Book.objects.using(using).order_by('author_id', 'title', 'pk').values_list(
+        'author_id', 'pk', 'title', 'isbn')
+    for author_id, pk, title, isbn in books.iterator(chunk_size=READ_CHUNK):
+        isbn = isbn13(isbn)
+        if isbn is not None:
+            first = first_with_isbn.setdefault(int(isbn), pk)
+            if first != pk:
+                groups.join([(first, pk)])
+        if author_id != block_author:
+            groups.join(alike(block, min_score))
+            block, block_author = [], author_id
+        block.append((title_key(title), pk, isbn))
+    groups.join(alike(block, min_score))
+    return groups.groups()
+
+
+def _repoint(model, field, mapping, using):
+    #one UPDATE moving the rows of `model` whose `field` is a key of `mapping` to its value
+    if not mapping:
+        return 0
+    target = Case(*[When(**{field: old}, then=Value(new)) for old, new in mapping.items()])
+    return model.objects.using(using).filter(**{f'{field}__in': list(mapping)}).update(**{field: target})
+
+
+def merge_authors(groups, using=None):
+    #give each group's books to its kept author and delete the others; returns the number deleted
+    using = using or router.db_for_write(Author)
+
+    def operation(batch):
+        mapping = {other: kept for kept, *others in batch for other in others}
+        _repoint(Book, 'author_id', mapping, using)
+        rollups.merge_objects('author', mapping, using)
+        with stats.batched(), fragments.batched():
+            Author.objects.using(using).filter(pk__in=list(mapping)).delete()
+        fragments.invalidate(Author, Book, using=using)
+        return len(mapping)
+
+    return sum(run_with_retry(lambda: operation(batch), using=using) for batch in chunked(groups, MERGE_BATCH))
+
+
+def merge_books(groups, using=None):
+    """
+    Move the loans and holds of each group's books to its kept book and delete
+    them; a kept book without a valid ISBN takes theirs. Books that are out,
+    held, carry a different valid ISBN than the kept one, or have another
+    author or category (an ISBN match may), stay. Returns the number of books
+    deleted.
+    """
+    using = using or router.db_for_write(Book)
+
+    def operation(batch):
+        pks = [pk for group in batch for pk in group]
+        books = {pk: (status, isbn13(isbn), (author_id, category_id))
+                 for pk, status, isbn, author_id, category_id in Book.objects.using(using).filter(pk__in=pks)
+                 .values_list('pk', 'status', 'isbn', 'author_id', 'category_id')}
+        busy = set(Hold.objects.using(using).filter(book_id__in=pks, status__in=Hold.ACTIVE)
+                   .values_list('book_id', flat=True))
+        busy.update(BorrowRecord.objects.using(using).open().filter(book_id__in=pks).values_list('book_id', flat=True))
+        mapping, isbns = {}, {}
+        for kept, *others in batch:
+            if kept not in books:
+                continue
+            kept_isbn = books[kept][1]
+            for other in others:
+                if other not in books or other in busy or books[other][0] != 'available':
+                    continue
+                #the loans would move to another author's or category's counts
+                if books[other][2] != books[kept][2]:
+                    continue
+                other_isbn = books[other][1]
+                if kept_isbn and other_isbn and other_isbn != kept_isbn:
+                    continue
+                mapping[other] = kept
+                if not kept_isbn and other_isbn:
+                    kept_isbn = isbns[kept] = other_isbn
+        for model in (BorrowRecord, ArchivedBorrowRecord, Hold):
+            _repoint(model, 'book_id', mapping, using)
+        rollups.merge_objects('book', mapping, using)
+        with stats.batched(), fragments.batched():
+            Book.objects.using(using).filter(pk__in=list(mapping)).delete()
+        #set once the merged books, which may hold the same ISBN, are gone
+        for kept, isbn in isbns.items():
+            if not Book.objects.using(using).filter(isbn=isbn).exists():
+                Book.objects.using(using).filter(pk=kept).update(isbn=isbn)
+        fragments.invalidate(Book, BorrowRecord, using=using)
+        return len(mapping)
+
+    return sum(run_with_retry(lambda: operation(batch), using=using) for batch in chunked(groups, MERGE_BATCH))
@@ -0,0 +1,168 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+
+from django.utils import timezone
+
+from . import archive
+from .models import ArchivedBorrowRecord, Book, BorrowRecord
+
+# -----------------------------
+# STREAMING EXPORTS
+# -----------------------------
+# Full dumps of the catalog and the borrow history. Rows come straight off a
+# values_list() iterator, so no model instances are built and only one chunk of
+# rows is held in memory at a time; they are encoded (and optionally gzipped)
+# as they arrive, so the first bytes go out before the query has finished. The
+# borrow history streams the archive table alongside, merged by id, or by
+# borrow date and id for a date range, which is read along the borrow_date
+# indexes so only the rows of the range are visited.
+
+CHUNK_SIZE = 2000
+#flush encoded rows once this many bytes are buffered
+BUFFER_SIZE = 64 * 1024
+
+#export name -> (model, [(column header, values_list lookup)])
+EXPORTS = {
+    'books': (Book, [
+        ('id', 'id'),
+        ('title', 'title'),
+        ('isbn', 'isbn'),
+        ('author', 'author__name'),
+        ('category', 'category__name'),
+        ('status', 'status'),
+        ('published_date', 'published_date'),
+        ('pages', 'pages'),
+        ('created_at', 'created_at'),
+        ('updated_at', 'updated_at'),
+    ]),
+    'borrows': (BorrowRecord, [
+        ('id', 'id'),
+        ('book_id', 'book_id'),
+        ('book', 'book__title'),
+        ('borrower', 'borrower__username'),
+        ('borrow_date', 'borrow_date'),
+        ('due_date', 'due_date'),
+        ('return_date', 'return_date'),
+        ('is_returned', 'is_returned'),
+        ('notes', 'notes'),
+    ]),
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def parse_day(value):
+    #'YYYY-MM-DD' -> date, None for an empty value, ValueError otherwise
+    if not value:
+        return None
+    return date.fromisoformat(value)
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _borrowed_between(queryset, start, end):
+    #plain datetime bounds keep the borrow_date index usable, unlike __date lookups
+    if start:
+        queryset = queryset.filter(borrow_date__gte=_start_of_day(start))
+    if end:
+        queryset = queryset.filter(borrow_date__lt=_start_of_day(end + timedelta(days=1)))
+    return queryset
+
+
+def export_rows(kind, start=None, end=None):
+    #(headers, row iterator) for one export, borrows limited to start <= borrow_date day <= end
+    model, columns = EXPORTS[kind]
+    lookups = [lookup for _, lookup in columns]
+    #a date range seeks its first day on the (borrow_date, id) index instead of walking every id
+    ordering = ['borrow_date', 'id'] if kind == 'borrows' and (start or end) else ['id']
+    queryset = model.objects.order_by(*ordering)
+    if kind == 'borrows':
+        queryset = _borrowed_between(queryset, start, end)
+    rows = queryset.values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+    if kind == 'borrows':
+        rows = _with_archive(rows, lookups, ordering, start, end)
+    return [header for header, _ in columns], rows
+
+
+def _with_archive(rows, lookups, ordering, start, end):
+    #archived loans merged in, in the same order, when the range goes back far enough to hold
+    #any; a generator, so like the rows themselves the archive is only read once streaming starts
+    newest = archive.newest('borrow_date')
+    if newest is not None and (not start or _start_of_day(start) <= newest):
+        archived = _borrowed_between(ArchivedBorrowRecord.objects.order_by(*ordering), start, end)
+        rows = archive.merge_sorted([lookups.index(name) for name in ordering], rows,
+                                    archived.values_list(*lookups).iterator(chunk_size=CHUNK_SIZE))
+    yield from rows
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def encode_csv(headers, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    #send the header right away so the client sees the download start
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow([_iso(value) for value in row])
+        if buffer.tell() >= BUFFER_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def encode_jsonl(headers, rows):
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(headers, map(_iso, row))), ensure_ascii=False) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(lines).encode()
+            lines, size = [], 0
+    if lines:
+        yield ''.join(lines).encode()
+
+
+ENCODERS = {
+    'csv': encode_csv,
+    'jsonl': encode_jsonl,
+}
+
+
+def gzip_chunks(chunks):
+    #compress a stream of byte chunks into one gzip member as they arrive
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(kind, fmt='csv', compress=False, start=None, end=None):
+    #byte chunks of a whole export, ready for StreamingHttpResponse or a file
+    headers, rows = export_rows(kind, start, end)
+    chunks = ENCODERS[fmt](headers, rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(kind, fmt='csv', compress=False, start=None, end=None):
+    name = kind
+    if start or end:
+        name += f"_{start or ''}_{end or ''}"
+    return f"{name}.{fmt}" + ('.gz' if compress else '')
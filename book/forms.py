@@ -1,8 +1,60 @@
 from django import forms
 from .models import Book, Author, Category, BorrowRecord
 from django.utils import timezone
+from django.urls import reverse
+from django.utils.html import format_html
 from datetime import timedelta
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from .autocomplete import BORROWABLE
+
+
+class AutocompleteSelect(forms.Widget):
+    #a text box that loads matching choices from the autocomplete endpoint as you type and a
+    #hidden input holding the chosen pk; rendering reads only the selected row, never the choices,
+    #and ModelChoiceField validates the submitted pk with a single lookup
+    class Media:
+        js = ['js/autocomplete.js']
+
+    def __init__(self, source, attrs=None):
+        super().__init__(attrs)
+        self.source = source
+
+    def format_value(self, value):
+        return getattr(value, 'pk', value)
+
+    def selected_label(self, value):
+        #the text shown for the current value, from the field's own queryset
+        field = getattr(self.choices, 'field', None)
+        if value in (None, '') or field is None:
+            return ''
+        if isinstance(value, field.queryset.model):
+            return field.label_from_instance(value)
+        try:
+            obj = field.queryset.filter(pk=value).first()
+        except (ValueError, TypeError, ValidationError):
+            return ''
+        return field.label_from_instance(obj) if obj is not None else ''
+
+    def id_for_label(self, id_):
+        #the label focuses the text box, the hidden input keeps the field's own id
+        return f'{id_}_search' if id_ else id_
+
+    def render(self, name, value, attrs=None, renderer=None):
+        attrs = self.build_attrs(self.attrs, attrs)
+        field_id = attrs.pop('id', None) or f'id_{name}'
+        attrs.setdefault('class', 'form-control')
+        attrs.pop('required', None)
+        return format_html(
+            '<div class="position-relative">'
+            '<input type="hidden" name="{}" id="{}" value="{}">'
+            '<input type="search" id="{}_search" class="{}" value="{}" autocomplete="off" '
+            'placeholder="Start typing to search" data-autocomplete-url="{}" data-autocomplete-target="{}">'
+            '</div>',
+            name, field_id, self.format_value(value) or '',
+            field_id, attrs['class'], self.selected_label(value),
+            reverse('book:autocomplete', args=[self.source]), field_id,
+        )
 
 class AuthorForm(forms.ModelForm):
     #form for creating and updating authors
@@ -64,12 +116,8 @@ class BookForm(forms.ModelForm):
                 'class': 'form-control',
                 'placeholder': 'Enter ISBN (optional)'
             }),
-            'author': forms.Select(attrs={
-                'class': 'form-control'
-            }),
-            'category': forms.Select(attrs={
-                'class': 'form-control'
-            }),
+            'author': AutocompleteSelect('authors'),
+            'category': AutocompleteSelect('categories'),
             'description': forms.Textarea(attrs={
                 'class': 'form-control',
                 'rows': 5,
@@ -112,7 +160,7 @@ class BorrowForm(forms.ModelForm):
     #form for borrowing books
     borrower = forms.ModelChoiceField(
         queryset=User.objects.all(),
-        widget=forms.Select(attrs={'class': 'form-select'}),
+        widget=AutocompleteSelect('borrowers'),
         label='Borrower'
     )
 
@@ -120,12 +168,10 @@ class BorrowForm(forms.ModelForm):
         model = BorrowRecord
         fields = ['book', 'borrower', 'due_date', 'notes']
         widgets = {
-            'book': forms.Select(attrs={
-                'class': 'form-select'
-            }),
-            'due_date': forms.Select(attrs={
+            'book': AutocompleteSelect('books'),
+            'due_date': forms.DateTimeInput(attrs={
                 'class': 'form-control',
-                'type': 'datetime-control'
+                'type': 'datetime-local'
             }),
             'notes': forms.Textarea(attrs={
                 'class': 'form-control',
@@ -140,14 +186,15 @@ class BorrowForm(forms.ModelForm):
             'notes': 'Notes',
         }
 
-        #display/show available books
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-            self.fields['book'].queryset = Book.objects.filter(status='available')
-            #we can set the due date to 14 days from now
-            if not self.instance.pk:
-                default_due = timezone.now() + timedelta(days=14)
-                self.fields['due_date'].initial = default_due.strftime('%Y-%m-%dT%H:%M')
+    #books that can be lent: available, or reserved for the borrower's hold (checkout decides)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        #Book.__str__ uses the author name, so load it with the book
+        self.fields['book'].queryset = Book.objects.filter(status__in=BORROWABLE).select_related('author')
+        #we can set the due date to 14 days from now
+        if not self.instance.pk:
+            default_due = timezone.now() + timedelta(days=14)
+            self.fields['due_date'].initial = default_due.strftime('%Y-%m-%dT%H:%M')
 
 #form for returning books
 class ReturnForm(forms.ModelForm):
@@ -157,7 +204,7 @@ class ReturnForm(forms.ModelForm):
         widgets = {
             'return_date': forms.DateTimeInput(attrs={
                 'class': 'form-control',
-                'type': 'datetime-control'
+                'type': 'datetime-local'
             }),
             'notes': forms.Textarea(attrs={
                 'class': 'form-control',
@@ -170,10 +217,10 @@ class ReturnForm(forms.ModelForm):
             'notes': 'Notes',
         }
 
-        #set the return date as now
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-            #set default time here
-            if not self.instance.return_date:
-                self.fields['return_date'].initial = timezone.now().strftime('%Y-%m-%dT%H:%M')
-                #%Y-%m-%d %H:%M:%S” represents the year, month, day, hour, minute, and second in a specific order
\ No newline at end of file
+    #set the return date as now
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        #set default time here
+        if not self.instance.return_date:
+            self.fields['return_date'].initial = timezone.now().strftime('%Y-%m-%dT%H:%M')
+            #%Y-%m-%d %H:%M:%S” represents the year, month, day, hour, minute, and second in a specific order
\ No newline at end of file
@@ -0,0 +1,186 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import FragmentGeneration
+
+# -----------------------------
+# FRAGMENT CACHE
+# -----------------------------
+# The catalog lists are rendered once and served from the cache until the data
+# behind them changes. Each model has a "generation" number and a fragment key
+# includes the generations of every model it shows, so a change to any of them
+# moves readers onto fresh keys; stale fragments are never looked up again and
+# simply expire.
+#
+# The generations are rows of book_fragmentgeneration, read with the data they
+# describe: every server process sees the same numbers whatever cache backend
+# it uses, and a generation moves in the transaction of the write behind it, so
+# it commits or rolls back with that write. Reads routed to the replica read
+# its copy of the generations too, which always matches its copy of the data.
+# book.signals bumps the generation of a saved or deleted model; code that
+# writes with QuerySet.update(), raw SQL or bulk_create (no signals) calls
+# invalidate() itself.
+
+KEY_PREFIX = 'book:fragment'
+COUNTER_KEYS = {'hits': f'{KEY_PREFIX}:hits', 'misses': f'{KEY_PREFIX}:misses'}
+
+#a bumped generation goes up by one, or to the current time in nanoseconds if that is
+#higher, so a number rolled back with its transaction (or lost with a restored database)
+#is never handed out again for different data
+_BUMP = """
+    INSERT INTO {table} (label, value) VALUES {values}
+    ON CONFLICT (label) DO UPDATE SET
+        value = CASE WHEN excluded.value > value + 1 THEN excluded.value ELSE value + 1 END
+"""
+
+
+def _cache():
+    return caches[getattr(settings, 'FRAGMENT_CACHE', 'default')]
+
+
+def _labels(models):
+    return [model._meta.label_lower for model in models]
+
+
+def generations(*models):
+    #one primary key lookup; a model never written since the table was created is at 0
+    labels = _labels(models)
+    values = dict(FragmentGeneration.objects.filter(label__in=labels).values_list('label', 'value'))
+    return [values.get(label, 0) for label in labels]
+
+
+async def agenerations(*models):
+    labels = _labels(models)
+    values = {label: value async for label, value in
+              FragmentGeneration.objects.filter(label__in=labels).values_list('label', 'value')}
+    return [values.get(label, 0) for label in labels]
+
+
+def request_generations(request, models):
+    #generations() read once per request: the ETag of a page and its fragments share the lookup
+    known = request.__dict__.setdefault('_fragment_generations', {})
+    missing = [model for model in models if model._meta.label_lower not in known]
+    if missing:
+        known.update(zip(_labels(missing), generations(*missing)))
+    return [known[label] for label in _labels(models)]
+
+
+async def arequest_generations(request, models):
+    known = request.__dict__.setdefault('_fragment_generations', {})
+    missing = [model for model in models if model._meta.label_lower not in known]
+    if missing:
+        known.update(zip(_labels(missing), await agenerations(*missing)))
+    return [known[label] for label in _labels(models)]
+
+
+_pending = threading.local()
+
+
+@contextmanager
+def batched():
+    #collect the models of every bump() made inside the block and bump each once at the end,
+    #e.g. around a delete that cascades to thousands of borrow records
+    outer = getattr(_pending, 'models', None)
+    if outer is not None:
+        yield
+        return
+    _pending.models = set()
+    try:
+        yield
+        models = _pending.models
+    finally:
+        _pending.models = None
+    bump(*models)
+
+
+def bump(*models, using=None):
+    pending = getattr(_pending, 'models', None)
+    if pending is not None:
+        pending.update(models)
+        return
+    labels = sorted(set(_labels(models)))
+    if not labels:
+        return
+    using = using or router.db_for_write(FragmentGeneration)
+    table = connections[using].ops.quote_name(FragmentGeneration._meta.db_table)
+    fresh = time.time_ns()
+    with connections[using].cursor() as cursor:
+        cursor.execute(_BUMP.format(table=table, values=', '.join(['(%s, %s)'] * len(labels))),
+                       [value for label in labels for value in (label, fresh)])
+
+
+def invalidate(*models, using=None):
+    #drop every fragment built from these models, as of the transaction this runs in
+    bump(*models, using=using)
+
+
+def _count(name):
+    cache = _cache()
+    try:
+        cache.incr(COUNTER_KEYS[name])
+    except ValueError:
+        cache.add(COUNTER_KEYS[name], 1, None)
+
+
+async def _acount(name):
+    cache = _cache()
+    try:
+        await cache.aincr(COUNTER_KEYS[name])
+    except ValueError:
+        await cache.aadd(COUNTER_KEYS[name], 1, None)
+
+
+def counters():
+    values = _cache().get_many(COUNTER_KEYS.values())
+    return {name: values.get(key, 0) for name, key in COUNTER_KEYS.items()}
+
+
+def reset_counters():
+    _cache().delete_many(COUNTER_KEYS.values())
+
+
+def _fragment_key(name, request, versions):
+    #one key per fragment, query string and set of model generations
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    return f"{KEY_PREFIX}:{name}:{'.'.join(map(str, versions))}:{digest}"
+
+
+def fragment_key(name, request, models):
+    return _fragment_key(name, request, request_generations(request, models))
+
+
+def cached_fragment(request, name, models, template, get_context):
+    #rendered `template` for this request, get_context() only runs (and queries) on a miss
+    cache = _cache()
+    key = fragment_key(name, request, models)
+    html = cache.get(key)
+    if html is None:
+        _count('misses')
+        html = render_to_string(template, get_context(), request)
+        cache.set(key, html, getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 3600))
+    else:
+        _count('hits')
+    return mark_safe(html)
+
+
+async def acached_fragment(request, name, models, template, get_context):
+    #cached_fragment() for async views, get_context is a coroutine function
+    cache = _cache()
+    key = _fragment_key(name, request, await arequest_generations(request, models))
+    html = await cache.aget(key)
+    if html is None:
+        await _acount('misses')
+        html = render_to_string(template, await get_context(), request)
+        await cache.aset(key, html, getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 3600))
+    else:
+        await _acount('hits')
+    return mark_safe(html)
@@ -0,0 +1,91 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from . import fragments, stats
+from .models import Book, Hold
+
+# -----------------------------
+# HOLD QUEUE
+# -----------------------------
+# Patrons waiting for a copy that is out place a Hold instead of retrying the
+# borrow page. Each book's waiting holds form a FIFO in id order, kept in the
+# book_hold_queue_idx partial index: finding the next in line is one index seek
+# and a hold's position is a count over the entries ahead of it, however much
+# hold history the table keeps.
+#
+# When a copy comes back (return_loan) or a hold on it lapses or is cancelled,
+# hand_off() gives it to the oldest waiting hold in the same transaction: the
+# hold turns 'ready' with a pickup deadline and the book 'reserved', so only
+# that holder can check it out. With nobody waiting the book is 'available'
+# again. expire_ready() closes the ready holds that were not collected in time,
+# a batch per UPDATE, and hands their copies on. Statuses move with
+# QuerySet.update(), so the stats counters are bumped here as well.
+
+
+def pickup_days():
+    return getattr(settings, 'HOLD_PICKUP_DAYS', 3)
+
+
+def position(hold):
+    #1 for the next in line; the waiting holds ahead of it, counted along the queue index
+    return Hold.objects.queue(hold.book_id).filter(pk__lt=hold.pk).count() + 1
+
+
+def hand_off(book_ids, from_status, now=None, using=None):
+    """
+    Put each of the given books, currently `from_status`, aside for the oldest
+    waiting hold on it, or make it available when nobody is waiting. Returns
+    the stats counter deltas of the status changes for the caller to bump;
+    the caller invalidates the Book fragments too, once with its own changes.
+    """
+    now = now or timezone.now()
+    using = using or router.db_for_write(Hold)
+    #one seek into each book's queue, as a correlated subquery
+    heads = dict(
+        Book.objects.using(using).filter(pk__in=book_ids).order_by()
+        .annotate(head=Subquery(Hold.objects.queue(OuterRef('pk')).values('pk')[:1]))
+        .values_list('pk', 'head')
+    )
+    waited_for = [book_id for book_id, head in heads.items() if head is not None]
+    free = [book_id for book_id, head in heads.items() if head is None]
+    deltas = Counter()
+    if waited_for:
+        Hold.objects.using(using).filter(pk__in=[heads[book_id] for book_id in waited_for]).update(
+            status=Hold.READY, ready_at=now, expires_at=now + timedelta(days=pickup_days()))
+        if from_status != 'reserved':
+            reserved = Book.objects.using(using).filter(pk__in=waited_for, status=from_status).update(
+                status='reserved', updated_at=now)
+            deltas.update(stats.status_deltas(from_status, 'reserved', reserved))
+    if free:
+        released = Book.objects.using(using).filter(pk__in=free, status=from_status).update(
+            status='available', updated_at=now)
+        deltas.update(stats.status_deltas(from_status, 'available', released))
+    return {name: delta for name, delta in deltas.items() if delta}
+
+
+def collect(book_id, borrower_id, now=None):
+    #close the borrower's ready hold on the book as they check it out; False if they have none
+    return bool(Hold.objects.filter(book_id=book_id, borrower_id=borrower_id, status=Hold.READY).update(
+        status=Hold.FULFILLED, closed_at=now or timezone.now()))
+
+
+def expire_ready(batch_size, now=None):
+    #close up to batch_size ready holds past their pickup deadline and hand their copies on;
+    #one transaction's worth, returns the number expired
+    now = now or timezone.now()
+    lapsed = list(Hold.objects.filter(status=Hold.READY, expires_at__lt=now)
+                  .order_by('expires_at', 'pk').values_list('pk', 'book_id')[:batch_size])
+    if not lapsed:
+        return 0
+    expired = Hold.objects.filter(pk__in=[pk for pk, _ in lapsed], status=Hold.READY).update(
+        status=Hold.EXPIRED, closed_at=now)
+    deltas = hand_off({book_id for _, book_id in lapsed}, 'reserved', now)
+    stats.bump(**deltas)
+    if deltas:
+        fragments.invalidate(Book)
+    return expired
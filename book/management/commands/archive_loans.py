@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book import archive
+
+
+class Command(BaseCommand):
+    help = ('Move returned loans older than ARCHIVE_AFTER_DAYS from the borrow records into the '
+            'archive table, in batches; an interrupted run carries on where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, metavar='DAYS',
+                            help='Archive loans returned more than DAYS ago (default: ARCHIVE_AFTER_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE,
+                            help='Loans moved per transaction.')
+        parser.add_argument('--max-batches', type=int,
+                            help='Stop after this many batches, to spread a large backlog over several runs.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        days = archive.archive_after_days() if options['older_than'] is None else options['older_than']
+
+        def log(moved):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {moved} loans archived ({time.monotonic() - started:.1f}s)')
+
+        moved = archive.archive_returned(days, options['batch_size'], options['max_batches'], log)
+        remaining = archive.archivable(days).count()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{moved} loans returned more than {days} days ago archived, {remaining} left ({elapsed:.2f}s)."
+        ))
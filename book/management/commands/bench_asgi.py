@@ -0,0 +1,147 @@
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from book.benchmark import percentile
+from book.models import Author, Book, Category
+
+BENCH_USER = 'bench-asgi'
+
+#server name -> (uvicorn application, extra uvicorn arguments, BOOK_ASYNC_VIEWS)
+SERVERS = {
+    'wsgi': ('book_display.wsgi:application', ['--interface', 'wsgi'], '0'),
+    'asgi': ('book_display.asgi:application', ['--interface', 'asgi3'], '1'),
+}
+
+
+def login_cookie():
+    #a session for the bench user, so the login_required pages answer 200
+    user, _ = User.objects.get_or_create(username=BENCH_USER)
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def load(port, paths, total, concurrency, cookie):
+    #fire `total` GETs over `concurrency` keep-alive connections, returns (seconds, latencies, errors)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        try:
+            for index in counter:
+                path = paths[index % len(paths)]
+                started = time.perf_counter()
+                connection.request('GET', path, headers={'Cookie': cookie})
+                response = connection.getresponse()
+                response.read()
+                mine.append(time.perf_counter() - started)
+                if response.status != 200:
+                    with lock:
+                        errors.append(f'{path}: {response.status}')
+        except (OSError, http.client.HTTPException) as exc:
+            with lock:
+                errors.append(repr(exc))
+        finally:
+            connection.close()
+            with lock:
+                latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, errors
+
+
+def wait_for(port, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f'The server on port {port} exited with code {process.returncode}.')
+        try:
+            http.client.HTTPConnection('127.0.0.1', port, timeout=1).connect()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError(f'The server on port {port} did not start within {timeout}s.')
+
+
+class Command(BaseCommand):
+    help = ('Serve the site with uvicorn over WSGI (sync views) and over ASGI (async views) '
+            'and compare requests/sec and latency percentiles on the read pages.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per server.')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes.')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+
+    def handle(self, *args, **options):
+        if find_spec('uvicorn') is None:
+            raise CommandError('The benchmark needs uvicorn: pip install uvicorn')
+        book = Book.objects.order_by('pk').first()
+        author = Author.objects.order_by('pk').first()
+        category = Category.objects.order_by('pk').first()
+        if not (book and author and category):
+            raise CommandError('The catalog is empty, load some books first (import_catalog).')
+        paths = [
+            reverse('book:dashboard'),
+            reverse('book:book_list'),
+            reverse('book:book_detail', args=[book.pk]),
+            reverse('book:author_list'),
+            reverse('book:author_detail', args=[author.pk]),
+            reverse('book:category_list'),
+            reverse('book:category_detail', args=[category.pk]),
+        ]
+        cookie = login_cookie()
+
+        for offset, name in enumerate(options['servers']):
+            application, extra, async_views = SERVERS[name]
+            port = options['port'] + offset
+            env = dict(os.environ, BOOK_ASYNC_VIEWS=async_views)
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', application, '--port', str(port),
+                 '--workers', str(options['workers']), '--log-level', 'warning', '--no-access-log', *extra],
+                env=env,
+            )
+            try:
+                wait_for(port, process)
+                #warm up: imports, template loading, fragment cache
+                load(port, paths, len(paths) * 2, 1, cookie)
+                elapsed, latencies, errors = load(
+                    port, paths, options['requests'], options['concurrency'], cookie)
+            finally:
+                process.terminate()
+                process.wait()
+
+            if errors:
+                raise CommandError(f'{name}: {len(errors)} failed requests, first: {errors[0]}')
+            self.stdout.write(
+                f"{name}: {len(latencies) / elapsed:.0f} req/s, "
+                f"p50 {statistics.median(latencies) * 1000:.1f}ms, "
+                f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms "
+                f"({len(latencies)} requests, concurrency {options['concurrency']})"
+            )
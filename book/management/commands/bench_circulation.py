@@ -0,0 +1,126 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from book import fragments, stats
+from book.models import Author, Book, BorrowerProfile, BorrowRecord
+from book.services import BookUnavailable, checkout, return_loan
+
+BENCH_PREFIX = 'bench-circulation'
+
+
+def run_contention(book_ids, borrower_id, threads, attempts_per_thread):
+    #every thread keeps grabbing the books in turn and hands back what it wins, so
+    #each book goes through many borrow/return cycles with all threads racing for it
+    results = {'won': 0, 'lost': 0, 'returned': 0, 'errors': []}
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+    due = timezone.now() + timedelta(days=14)
+
+    def worker(offset):
+        won = lost = returned = 0
+        try:
+            start.wait()
+            for attempt in range(attempts_per_thread):
+                book_id = book_ids[(offset + attempt) % len(book_ids)]
+                try:
+                    record = checkout(book_id, borrower_id, due)
+                except BookUnavailable:
+                    lost += 1
+                    continue
+                won += 1
+                return_loan(record)
+                returned += 1
+        except Exception as exc:  # reported, not swallowed
+            with lock:
+                results['errors'].append(repr(exc))
+        finally:
+            connection.close()
+            with lock:
+                results['won'] += won
+                results['lost'] += lost
+                results['returned'] += returned
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    results['elapsed'] = time.perf_counter() - started
+    return results
+
+
+def double_loans(book_ids):
+    #loans of the same book whose [borrow_date, return_date) periods overlap, plus
+    #books whose status disagrees with their number of open loans
+    problems = []
+    records = (
+        BorrowRecord.objects.filter(book_id__in=book_ids)
+        .order_by('book_id', 'borrow_date', 'pk')
+        .values_list('book_id', 'pk', 'borrow_date', 'return_date')
+    )
+    previous = None
+    for book_id, pk, borrow_date, return_date in records:
+        if previous and previous[0] == book_id and (previous[3] is None or previous[3] > borrow_date):
+            problems.append(('overlap', previous[1], pk))
+        previous = (book_id, pk, borrow_date, return_date)
+
+    open_loans = dict(
+        BorrowRecord.objects.filter(book_id__in=book_ids, is_returned=False)
+        .values_list('book_id').annotate(n=Count('pk')).values_list('book_id', 'n')
+    )
+    for book_id, status in Book.objects.filter(pk__in=book_ids).values_list('pk', 'status'):
+        loans = open_loans.get(book_id, 0)
+        if loans > 1 or (status == 'borrowed') != (loans == 1):
+            problems.append(('status', book_id, status, loans))
+    return problems
+
+
+class Command(BaseCommand):
+    help = 'Fire concurrent checkouts at a few books and verify no copy is ever lent twice.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--checkouts', type=int, default=4000,
+                            help='Total checkout attempts across all threads.')
+        parser.add_argument('--books', type=int, default=5)
+
+    def handle(self, *args, **options):
+        threads, books = options['threads'], options['books']
+        per_thread = max(1, options['checkouts'] // threads)
+
+        author = Author.objects.create(name=BENCH_PREFIX)
+        borrower = User.objects.create(username=f'{BENCH_PREFIX}-{int(time.time())}')
+        #one borrower races for every book, so it may hold all of them at once
+        BorrowerProfile.objects.filter(pk=borrower.pk).update(loan_limit=books)
+        book_ids = [
+            Book.objects.create(title=f'{BENCH_PREFIX} {index}', author=author).pk
+            for index in range(books)
+        ]
+        try:
+            results = run_contention(book_ids, borrower.pk, threads, per_thread)
+            problems = double_loans(book_ids)
+        finally:
+            with stats.batched(), fragments.batched():
+                author.delete()
+                borrower.delete()
+
+        attempts = results['won'] + results['lost']
+        operations = attempts + results['returned']
+        self.stdout.write(
+            f"{threads} threads, {attempts} checkout attempts on {books} books in {results['elapsed']:.2f}s: "
+            f"{results['won']} loans, {results['lost']} refused, {results['returned']} returns, "
+            f"{operations / results['elapsed']:.0f} ops/s"
+        )
+        if results['errors']:
+            raise CommandError(f"{len(results['errors'])} worker errors, first: {results['errors'][0]}")
+        if problems:
+            raise CommandError(f'Double loans detected: {problems[:10]}')
+        self.stdout.write(self.style.SUCCESS('No double loans.'))
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from book import benchmark
+from book.models import Book
+
+
+class Command(BaseCommand):
+    help = ('Request every view with the test client and record latency percentiles, query counts '
+            'and peak memory; save the results as a JSON baseline or compare them with one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per URL.')
+        parser.add_argument('--save', metavar='PATH', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', metavar='PATH',
+                            help='Baseline JSON to diff against; fails when a view got slower, '
+                                 'heavier or issues more queries.')
+
+    def handle(self, *args, **options):
+        if not Book.objects.exists():
+            raise CommandError('The catalog is empty, load a benchmark library first (seed_bench).')
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as stream:
+                    baseline = json.load(stream)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read the baseline {options['compare']}: {exc}")
+
+        def log(key, result):
+            self.stdout.write(
+                f"{key:<48} {result['status']} {result['queries']:>3} queries  "
+                f"p50 {result['p50_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms  "
+                f"peak {result['peak_kb']:>9.1f}KB"
+            )
+
+        results = benchmark.run(options['repeat'], log=log)
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as stream:
+                json.dump(results, stream, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['save']}."))
+        if baseline is None:
+            return
+
+        if baseline['meta'].get('rows') != results['meta']['rows']:
+            self.stdout.write(self.style.WARNING(
+                f"The baseline was taken on different data: {baseline['meta'].get('rows')}"))
+        changes = benchmark.compare(baseline, results)
+        regressions = [change for change in changes if change[-1]]
+        for key, metric, old, new, regression in changes:
+            line = f"{key:<48} {metric:<8} {old} -> {new}"
+            self.stdout.write(self.style.ERROR(line) if regression else line)
+        if regressions:
+            raise CommandError(f'{len(regressions)} regressions against {options["compare"]}.')
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}."))
@@ -0,0 +1,31 @@
+import time
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from book import covers
+from book.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Render the missing cover derivatives for every stored cover on the worker pool.'
+
+    def handle(self, *args, **options):
+        names = (
+            Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+            .order_by().values_list('cover_image', flat=True).distinct()
+        )
+        started = time.monotonic()
+        futures = [covers.process_cover(name) for name in names.iterator()]
+        written = failed = 0
+        for future in as_completed(futures):
+            try:
+                written += len(future.result())
+            except Exception:
+                failed += 1
+        elapsed = time.monotonic() - started
+        message = f"{len(futures)} covers checked, {written} derivatives written in {elapsed:.2f}s"
+        if failed:
+            self.stderr.write(f"{message}, {failed} covers could not be read (see the log).")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{message}."))
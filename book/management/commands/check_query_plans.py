@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from book import queryplans
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN QUERY PLAN on every statement the views issue against seeded data '
+            'and fail on full scans of large tables or temporary B-tree sorts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=40,
+                            help='Seed size: users, authors and categories; size squared books.')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Also run ANALYZE on the real database afterwards.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plan checks read SQLite EXPLAIN QUERY PLAN output.')
+
+        report = queryplans.check_views(options['size'])
+        failures = [(name, sql, problems) for name, sql, problems in report if problems]
+        if options['verbosity'] > 1:
+            for name, sql, problems in report:
+                self.stdout.write(f"{name}: {sql}")
+        for name, sql, problems in failures:
+            self.stderr.write(f"{name}: {', '.join(problems)}\n    {sql}")
+
+        if options['analyze']:
+            queryplans.analyze()
+            self.stdout.write('Planner statistics refreshed (ANALYZE).')
+        if failures:
+            raise CommandError(f"{len(failures)} of {len(report)} statements have bad query plans.")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(report)} statements from {len({name for name, _, _ in report})} views, all plans use indexes."
+        ))
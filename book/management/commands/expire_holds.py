@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from book import holds
+from book.services import run_with_retry
+
+
+class Command(BaseCommand):
+    help = 'Expire holds whose copy was not collected in time and hand the copies to the next in line.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Holds expired per UPDATE and per transaction.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        started = time.monotonic()
+        expired = 0
+        while True:
+            # expired holds leave the ready-hold index, so every batch starts at its head
+            count = run_with_retry(lambda: holds.expire_ready(options['batch_size'], now))
+            if not count:
+                break
+            expired += count
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"{expired} uncollected holds expired ({elapsed:.2f}s)."))
@@ -0,0 +1,49 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from book.export import EXPORTS, FORMATS, parse_day, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Stream the catalog or the borrow history to a CSV or JSONL file, optionally gzipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--start', help='Only borrows on or after this day (YYYY-MM-DD).')
+        parser.add_argument('--end', help='Only borrows on or before this day (YYYY-MM-DD).')
+        parser.add_argument('-o', '--output', default='-', help="Output file, or '-' for stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_day(options['start'])
+            end = parse_day(options['end'])
+        except ValueError:
+            raise CommandError('Dates must be given as YYYY-MM-DD.')
+
+        chunks = stream_export(options['kind'], options['format'], options['gzip'], start, end)
+        started = time.monotonic()
+        written = 0
+        output = options['output']
+        try:
+            stream = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        except OSError as exc:
+            raise CommandError(exc)
+        try:
+            for chunk in chunks:
+                stream.write(chunk)
+                written += len(chunk)
+        finally:
+            if output == '-':
+                stream.flush()
+            else:
+                stream.close()
+
+        #the data itself may be on stdout, so the summary goes to stderr
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stderr.write(self.style.SUCCESS(
+            f"Wrote {written} bytes of {options['kind']} in {elapsed:.2f}s."
+        ))
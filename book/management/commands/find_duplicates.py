@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book import duplicates
+from book.models import Author, Book
+
+KINDS = {
+    #kind -> (finder, merger, model)
+    'authors': (duplicates.find_authors, duplicates.merge_authors, Author),
+    'books': (duplicates.find_books, duplicates.merge_books, Book),
+}
+
+
+class Command(BaseCommand):
+    help = ('Find near-duplicate authors and books by blocking on normalized names, titles and ISBNs, '
+            'and optionally merge each group into its oldest row.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', action='store_true', help='Only look at authors.')
+        parser.add_argument('--books', action='store_true', help='Only look at books.')
+        parser.add_argument('--min-score', type=float, default=duplicates.MIN_SCORE,
+                            help='Trigram similarity (0-1) from which two names or titles count as the same.')
+        parser.add_argument('--show', type=int, default=20,
+                            help='Groups to list per kind.')
+        parser.add_argument('--merge', action='store_true',
+                            help='Merge every group found; without it nothing is changed.')
+
+    def handle(self, *args, **options):
+        #both by default; authors go first so the books of merged authors are compared with each other
+        kinds = [kind for kind in KINDS if options[kind]] or list(KINDS)
+        for kind in kinds:
+            find, merge, model = KINDS[kind]
+            started = time.monotonic()
+            groups = find(options['min_score'])
+            found = sum(len(group) - 1 for group in groups)
+            self.stdout.write(f"{len(groups)} groups of duplicate {kind}, {found} rows to merge away "
+                              f"({time.monotonic() - started:.2f}s).")
+            shown = groups[:options['show']]
+            names = model.objects.in_bulk([pk for group in shown for pk in group])
+            for kept, *others in shown:
+                merged = ', '.join(f"{pk} {names[pk]}" for pk in others if pk in names)
+                self.stdout.write(f"  {kept} {names.get(kept, '?')} <- {merged}")
+            if options['merge']:
+                started = time.monotonic()
+                merged = merge(groups)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{merged} {kind} merged ({time.monotonic() - started:.2f}s)."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from book import fragments
+
+
+class Command(BaseCommand):
+    help = 'Show the hit and miss counters of the catalog fragment cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after reporting.')
+
+    def handle(self, *args, **options):
+        counts = fragments.counters()
+        lookups = counts['hits'] + counts['misses']
+        ratio = counts['hits'] / lookups if lookups else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['hits']} hits, {counts['misses']} misses ({ratio:.1%} hit rate)."
+        ))
+        if options['reset']:
+            fragments.reset_counters()
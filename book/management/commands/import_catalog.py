@@ -0,0 +1,177 @@
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from book import fragments
+from book.bulk import NameCache, chunked
+from book.models import Author, Book, Category
+from book.stats import recompute
+
+#columns --on-conflict update overwrites. A status column in the input is ignored: new books
+#are available, an existing one may be on loan or set aside for a hold and keeps its status
+#(the circulation engine owns that column, a loan or hold stands behind every other value)
+BOOK_FIELDS = ['title', 'author_id', 'category_id', 'description', 'published_date', 'pages', 'updated_at']
+
+
+def open_input(path):
+    #text stream over a file, a .gz file or stdin ('-'), read lazily line by line
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_rows(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def normalize_isbn(value):
+    isbn = ''.join(ch for ch in str(value or '') if ch.isalnum()).upper()
+    return isbn or None
+
+
+def clean_row(row):
+    #validated field dict for one input row, raises ValueError on bad data
+    title = (row.get('title') or '').strip()
+    author = (row.get('author') or '').strip()
+    if not title or not author:
+        raise ValueError('title and author are required')
+    isbn = normalize_isbn(row.get('isbn'))
+    if isbn and len(isbn) > 13:
+        raise ValueError(f'isbn {isbn!r} is longer than 13 characters')
+    published = row.get('published_date') or None
+    pages = row.get('pages') or None
+    return {
+        'title': title[:300],
+        'isbn': isbn,
+        'author': author[:200],
+        'category': (row.get('category') or '').strip()[:100] or None,
+        'description': row.get('description') or None,
+        'published_date': date.fromisoformat(str(published)) if published else None,
+        'pages': int(pages) if pages is not None else None,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Stream books from a CSV or JSONL file (optionally gzipped) into the catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format, guessed from the file extension by default.')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows per bulk_create and per transaction.')
+        parser.add_argument('--on-conflict', choices=['skip', 'update'], default='skip',
+                            help='What to do when an ISBN is already in the catalog.')
+        parser.add_argument('--cache-size', type=int, default=100_000,
+                            help='Maximum author/category names kept in memory.')
+        parser.add_argument('--progress-every', type=int, default=100_000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if '.csv' in path else 'jsonl' if '.jsonl' in path else None)
+        if fmt is None:
+            raise CommandError('Cannot guess the input format, pass --format csv or --format jsonl.')
+
+        self.authors = NameCache(Author, options['cache_size'])
+        self.categories = NameCache(Category, options['cache_size'])
+        self.update_conflicts = options['on_conflict'] == 'update'
+        self.counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        seen = errors = 0
+        next_report = options['progress_every']
+        started = time.monotonic()
+
+        try:
+            stream = open_input(path)
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream:
+            for batch in chunked(read_rows(stream, fmt), options['batch_size']):
+                rows = []
+                for number, row in enumerate(batch, start=seen + 1):
+                    try:
+                        rows.append(clean_row(row))
+                    except (ValueError, TypeError, AttributeError) as exc:
+                        errors += 1
+                        if errors <= 10:
+                            self.stderr.write(f'Row {number}: {exc}')
+                seen += len(batch)
+                self.write_batch(rows)
+                if seen >= next_report:
+                    self.report(seen, errors, started)
+                    next_report += options['progress_every']
+
+        # bulk_create sends no signals, bring the dashboard counters and cached pages up to date once
+        recompute()
+        fragments.invalidate(Book, Author, Category)
+        self.report(seen, errors, started, done=True)
+
+    @transaction.atomic
+    def write_batch(self, rows):
+        if not rows:
+            return
+        # one indexed lookup per batch tells inserts from ISBN conflicts
+        existing = set(
+            Book.objects.filter(isbn__in={row['isbn'] for row in rows if row['isbn']})
+            .values_list('isbn', flat=True)
+        )
+        batch_isbns = set()
+        kept = []
+        for row in rows:
+            isbn = row['isbn']
+            if isbn and (isbn in existing or isbn in batch_isbns):
+                if not self.update_conflicts:
+                    self.counts['skipped'] += 1
+                    continue
+                self.counts['updated'] += 1
+            else:
+                self.counts['inserted'] += 1
+            if isbn:
+                batch_isbns.add(isbn)
+            kept.append(row)
+        rows = kept
+        if not rows:
+            return
+        author_ids = self.authors.resolve(row['author'] for row in rows)
+        category_ids = self.categories.resolve(row['category'] for row in rows)
+        books = [
+            Book(
+                title=row['title'],
+                isbn=row['isbn'],
+                author_id=author_ids[row['author']],
+                category_id=category_ids.get(row['category']),
+                description=row['description'],
+                published_date=row['published_date'],
+                pages=row['pages'],
+            )
+            for row in rows
+        ]
+        if self.update_conflicts:
+            Book.objects.bulk_create(
+                books, update_conflicts=True, unique_fields=['isbn'], update_fields=BOOK_FIELDS)
+        else:
+            # still ignore conflicts in case another writer added the ISBN meanwhile
+            Book.objects.bulk_create(books, ignore_conflicts=True)
+
+    def report(self, seen, errors, started, done=False):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        message = (
+            f"{seen} rows read: {self.counts['inserted']} inserted, {self.counts['updated']} updated, "
+            f'{self.counts["skipped"]} skipped as duplicate ISBNs, {errors} rejected, '
+            f'{self.authors.created} authors and {self.categories.created} categories created, '
+            f'{seen / elapsed:.0f} rows/s'
+        )
+        self.stdout.write(self.style.SUCCESS(message) if done else message)
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from book import profiling
+
+
+class Command(BaseCommand):
+    help = ('Show the slowest routes of the last minutes and their worst SQL statements, '
+            'from the timings ProfilingMiddleware collects in the shared cache.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='Routes to show.')
+        parser.add_argument('--windows', type=int, default=profiling.WINDOWS,
+                            help=f'Minutes to cover, at most {profiling.WINDOWS}.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+        parser.add_argument('--reset', action='store_true', help='Drop the collected timings afterwards.')
+
+    def handle(self, *args, **options):
+        windows = min(max(options['windows'], 1), profiling.WINDOWS)
+        rows = profiling.summary(profiling.snapshot(windows), options['limit'])
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+        elif not rows:
+            self.stdout.write('No requests recorded in the last '
+                              f'{windows * profiling.WINDOW_SECONDS // 60} minutes.')
+        for row in rows if not options['json'] else ():
+            self.stdout.write(self.style.SUCCESS(
+                f"{row['route']}: {row['count']} requests, {row['errors']} errors, "
+                f"mean {row['mean_ms']}ms, p50 <{row['p50_ms']:g}ms, p95 <{row['p95_ms']:g}ms, "
+                f"max {row['max_ms']}ms"
+            ))
+            self.stdout.write(
+                f"    per request: {row['sql_per_request']} queries in {row['sql_ms']}ms, "
+                f"templates {row['template_ms']}ms"
+            )
+            for query in row['worst_queries']:
+                self.stdout.write(
+                    f"    {query['max_ms']:>8.2f}ms max {query['mean_ms']:>8.2f}ms mean "
+                    f"x{query['count']}  {query['sql'][:160]}"
+                )
+        if options['reset']:
+            profiling.reset()
+            self.stdout.write(self.style.SUCCESS('Timings reset.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from book import borrowers
+from book.stats import recompute
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the dashboard statistics counters and borrower profiles from the catalog and borrow tables.'
+
+    def handle(self, *args, **options):
+        stats = recompute()
+        profiles = borrowers.recompute()
+        self.stdout.write(self.style.SUCCESS(
+            f"Stats rebuilt: {stats.total_books} books "
+            f"({stats.available_books} available, {stats.borrowed_books} borrowed, "
+            f"{stats.reserved_books} reserved), {stats.total_authors} authors, "
+            f"{stats.total_categories} categories, {stats.active_loans} active loans, "
+            f"{profiles} borrower profiles."
+        ))
@@ -0,0 +1,49 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from book.models import Book
+from book.seeding import USER_PREFIX, seed_library
+
+#named sizes: users, categories, authors, books, borrow records
+PRESETS = {
+    'small': (200, 16, 500, 10_000, 100_000),
+    'medium': (2_000, 40, 10_000, 200_000, 2_000_000),
+    'large': (20_000, 80, 100_000, 2_000_000, 20_000_000),
+}
+
+
+class Command(BaseCommand):
+    help = ('Fill an empty catalog with a reproducible, Zipf-skewed benchmark library '
+            '(authors, books, borrowers and borrow history) using bulk inserts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=sorted(PRESETS), default='small',
+                            help='Named sizes, large is 100k authors, 2M books and 20M borrow records.')
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--categories', type=int)
+        parser.add_argument('--authors', type=int)
+        parser.add_argument('--books', type=int)
+        parser.add_argument('--loans', type=int, help='Borrow records, open and returned.')
+        parser.add_argument('--seed', type=int, default=1, help='Same seed and sizes, same rows.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows per bulk_create and per transaction.')
+
+    def handle(self, *args, **options):
+        if Book.objects.exists() or User.objects.filter(username__startswith=f'{USER_PREFIX}-').exists():
+            raise CommandError('The benchmark library is loaded into an empty catalog, flush the database first.')
+        sizes = dict(zip(('users', 'categories', 'authors', 'books', 'loans'), PRESETS[options['preset']]))
+        sizes.update({name: options[name] for name in sizes if options[name] is not None})
+        if sizes['users'] < 1 or sizes['authors'] < 1 or sizes['categories'] < 1:
+            raise CommandError('At least one user, author and category is needed.')
+
+        started = time.perf_counter()
+        counts = seed_library(
+            **sizes, seed=options['seed'], batch_size=options['batch_size'],
+            log=lambda message: self.stdout.write(f'  {message} ({time.perf_counter() - started:.1f}s)'),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {counts['books']} books by {counts['authors']} authors and "
+            f"{counts['loans']} borrow records in {time.perf_counter() - started:.1f}s."
+        ))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from book import borrowers, fragments, rollups
+from book.models import BorrowRecord
+from book.services import run_with_retry
+
+
+class Command(BaseCommand):
+    help = 'Stamp overdue_since on every open loan that has gone past its due date.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Loans marked per UPDATE and per transaction.')
+
+    def mark(self, pks, now):
+        #one transaction: stamp the batch and count its loans into the overdue rollups
+        #and their borrowers' overdue counters
+        count = BorrowRecord.objects.filter(pk__in=pks, overdue_since__isnull=True).update(overdue_since=now)
+        if count:
+            rollups.overdue_marked(pks, now)
+            borrowers.overdue_marked(pks, now)
+        return count
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        started = time.monotonic()
+        batch_size = options['batch_size']
+        overdue = BorrowRecord.objects.overdue(now)
+        marked = 0
+        last = None
+        while True:
+            # walk the (due_date, id) index from where the previous batch stopped,
+            # so loans marked by earlier sweeps are passed over only once
+            batch = overdue
+            if last is not None:
+                batch = batch.filter(Q(due_date__gt=last[0]) | Q(due_date=last[0], pk__gt=last[1]),
+                                     due_date__gte=last[0])
+            rows = list(batch.values_list('due_date', 'pk')[:batch_size])
+            if not rows:
+                break
+            last = rows[-1]
+            marked += run_with_retry(lambda: self.mark([pk for _, pk in rows], now))
+
+        if marked:
+            fragments.invalidate(BorrowRecord)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{marked} loans newly marked overdue, {overdue.count()} overdue in total ({elapsed:.2f}s)."
+        ))
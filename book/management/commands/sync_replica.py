@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from book.replica import ReplicaSync, database_path, is_separate
+from book.routers import REPLICA
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary database into the read replica with the SQLite backup API, '
+            'once or every --interval seconds until stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running and copy every N seconds '
+                                 '(default: settings.REPLICA_SYNC_INTERVAL with --loop).')
+        parser.add_argument('--loop', action='store_true', help='Keep running until stopped.')
+
+    def handle(self, *args, **options):
+        if not is_separate():
+            raise CommandError(f"settings.DATABASES has no separate {REPLICA!r} database to sync; "
+                               f"set BOOK_REPLICA_SYNC_INTERVAL to configure one.")
+        interval = options['interval']
+        if interval is None and options['loop']:
+            interval = getattr(settings, 'REPLICA_SYNC_INTERVAL', 2)
+
+        replica = ReplicaSync()
+        try:
+            started = time.perf_counter()
+            replica.run(force=True)
+            self.stdout.write(self.style.SUCCESS(
+                f"Replica {database_path(REPLICA)} synced in {(time.perf_counter() - started) * 1000:.0f}ms."
+            ))
+            if interval is None:
+                return
+            copies = 0
+            try:
+                while True:
+                    time.sleep(interval)
+                    copies += replica.run()
+            except KeyboardInterrupt:
+                self.stdout.write(self.style.SUCCESS(f'Stopped after {copies} more copies.'))
+        finally:
+            replica.close()
@@ -0,0 +1,38 @@
+import base64
+import hashlib
+import os
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from book import assets
+
+
+class Command(BaseCommand):
+    help = 'Download the pinned third-party CSS/JS into static/vendor/ so pages load no asset from a CDN.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Download again the files that are vendored already.')
+
+    def handle(self, *args, **options):
+        root = os.path.join(settings.STATICFILES_DIRS[0], assets.VENDOR_DIR)
+        fetched = 0
+        for name, (url, integrity) in assets.VENDOR.items():
+            path = os.path.join(root, *name.split('/'))
+            if os.path.exists(path) and not options['force']:
+                continue
+            with urlopen(url, timeout=30) as response:
+                data = response.read()
+            if integrity:
+                algorithm, _, expected = integrity.partition('-')
+                digest = base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+                if digest != expected:
+                    raise CommandError(f"{url} does not match its pinned {algorithm} hash.")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as stream:
+                stream.write(data)
+            fetched += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"{fetched} vendored files downloaded, {len(assets.VENDOR) - fetched} already present."))
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:13
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def seed_library_stats(apps, schema_editor):
+    Author = apps.get_model('book', 'Author')
+    Book = apps.get_model('book', 'Book')
+    BorrowRecord = apps.get_model('book', 'BorrowRecord')
+    Category = apps.get_model('book', 'Category')
+    LibraryStats = apps.get_model('book', 'LibraryStats')
+    db = schema_editor.connection.alias
+    books = Book.objects.using(db).aggregate(
+        total_books=Count('pk'),
+        available_books=Count('pk', filter=Q(status='available')),
+        borrowed_books=Count('pk', filter=Q(status='borrowed')),
+        reserved_books=Count('pk', filter=Q(status='reserved')),
+    )
+    loans = BorrowRecord.objects.using(db).aggregate(
+        total_loans=Count('pk'),
+        active_loans=Count('pk', filter=Q(is_returned=False)),
+    )
+    LibraryStats.objects.using(db).update_or_create(pk=1, defaults={
+        **books,
+        **loans,
+        'total_authors': Author.objects.using(db).count(),
+        'total_categories': Category.objects.using(db).count(),
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibraryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_books', models.IntegerField(default=0)),
+                ('available_books', models.IntegerField(default=0)),
+                ('borrowed_books', models.IntegerField(default=0)),
+                ('reserved_books', models.IntegerField(default=0)),
+                ('total_authors', models.IntegerField(default=0)),
+                ('total_categories', models.IntegerField(default=0)),
+                ('total_loans', models.IntegerField(default=0)),
+                ('active_loans', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Library Stats',
+                'verbose_name_plural': 'Library Stats',
+            },
+        ),
+        migrations.AlterField(
+            model_name='borrowrecord',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='borrowrecord',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['borrow_date', 'id'], name='book_borrow_date_idx'),
+        ),
+        migrations.RunPython(seed_library_stats, migrations.RunPython.noop),
+    ]
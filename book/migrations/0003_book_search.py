@@ -0,0 +1,36 @@
+from django.db import migrations
+
+from book.search import CREATE_SQL, DROP_SQL
+
+
+def create_search_index(apps, schema_editor):
+    #FTS5 is SQLite only, other backends fall back to plain filtering in book.views
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+    schema_editor.execute(
+        "INSERT INTO book_search(rowid, title, isbn, description, author, category) "
+        "SELECT b.id, b.title, coalesce(b.isbn, ''), coalesce(b.description, ''), "
+        "coalesce(a.name, ''), coalesce(c.name, '') FROM book_book b "
+        "LEFT JOIN book_author a ON a.id = b.author_id "
+        "LEFT JOIN book_category c ON c.id = b.category_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0002_librarystats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
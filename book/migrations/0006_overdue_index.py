@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0005_category_shelf_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrowrecord',
+            name='overdue_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(condition=models.Q(('is_returned', False)), fields=['due_date', 'id'], name='book_open_due_idx'),
+        ),
+    ]
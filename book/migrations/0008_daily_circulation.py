@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+from book.rollups import backfill
+
+
+def backfill_rollups(apps, schema_editor):
+    BorrowRecord = apps.get_model('book', 'BorrowRecord')
+    db = schema_editor.connection.alias
+    backfill(BorrowRecord.objects.using(db), db)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0007_author_title_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCirculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('library', 'Library'), ('book', 'Book'), ('author', 'Author'), ('category', 'Category'), ('borrower', 'Borrower')], max_length=10)),
+                ('object_id', models.BigIntegerField(default=0)),
+                ('loans', models.IntegerField(default=0)),
+                ('returns', models.IntegerField(default=0)),
+                ('overdue', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Daily Circulation',
+                'verbose_name_plural': 'Daily Circulation',
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'day', 'object_id'), name='book_daily_circulation_key')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
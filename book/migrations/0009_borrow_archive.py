@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0008_daily_circulation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBorrowRecord',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('borrow_date', models.DateTimeField()),
+                ('return_date', models.DateTimeField(blank=True, null=True)),
+                ('due_date', models.DateTimeField()),
+                ('is_returned', models.BooleanField(default=True)),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('overdue_since', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrow_records', to='book.book')),
+                ('borrower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrow_records', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Borrow Record',
+                'verbose_name_plural': 'Archived Borrow Records',
+                'ordering': ['-borrow_date'],
+                'indexes': [models.Index(fields=['borrow_date', 'id'], name='book_archive_borrow_date_idx'), models.Index(fields=['return_date', 'id'], name='book_archive_return_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def create_profiles(apps, schema_editor):
+    #a profile for every existing user, counted from their open loans
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    BorrowerProfile = apps.get_model('book', 'BorrowerProfile')
+    BorrowRecord = apps.get_model('book', 'BorrowRecord')
+    db = schema_editor.connection.alias
+    counts = {
+        row['borrower']: row
+        for row in BorrowRecord.objects.using(db).filter(is_returned=False).order_by()
+        .values('borrower').annotate(active=Count('pk'), overdue=Count('pk', filter=Q(overdue_since__isnull=False)))
+    }
+    BorrowerProfile.objects.using(db).bulk_create(
+        [
+            BorrowerProfile(user_id=user_id, active_loans=counts.get(user_id, {}).get('active', 0),
+                            overdue_loans=counts.get(user_id, {}).get('overdue', 0))
+            for user_id in User.objects.using(db).values_list('pk', flat=True).iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('book', '0009_borrow_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BorrowerProfile',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='borrower_profile', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('active_loans', models.IntegerField(default=0)),
+                ('overdue_loans', models.IntegerField(default=0)),
+                ('loan_limit', models.PositiveIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Borrower Profile',
+                'verbose_name_plural': 'Borrower Profiles',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['borrower', 'is_returned', 'due_date', 'id'], name='book_borrower_loans_idx'),
+        ),
+        migrations.RunPython(create_profiles, migrations.RunPython.noop),
+    ]
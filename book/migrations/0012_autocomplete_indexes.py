@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:19
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+#auth_user belongs to django.contrib.auth, so its index is added here by hand
+USERNAME_INDEX = models.Index(Lower('username'), 'id', name='book_user_username_lower_idx')
+
+
+def add_username_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model(settings.AUTH_USER_MODEL), USERNAME_INDEX)
+
+
+def remove_username_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model(settings.AUTH_USER_MODEL), USERNAME_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0011_holds'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(django.db.models.functions.text.Lower('name'), models.F('id'), name='book_author_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.db.models.functions.text.Lower('title'), models.F('id'), name='book_title_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(django.db.models.functions.text.Lower('name'), models.F('id'), name='book_category_name_lower_idx'),
+        ),
+        migrations.RunPython(add_username_index, remove_username_index),
+    ]
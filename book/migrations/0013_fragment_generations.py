@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0012_autocomplete_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FragmentGeneration',
+            fields=[
+                ('label', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name': 'Fragment Generation',
+                'verbose_name_plural': 'Fragment Generations',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:50
+
+from django.db import migrations, models
+
+from book.rollups import backfill_periods
+
+
+def backfill_rollups(apps, schema_editor):
+    backfill_periods(schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0013_fragment_generations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodCirculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('month', 'Month'), ('quarter', 'Quarter'), ('year', 'Year')], max_length=7)),
+                ('start', models.DateField()),
+                ('dimension', models.CharField(choices=[('library', 'Library'), ('book', 'Book'), ('author', 'Author'), ('category', 'Category'), ('borrower', 'Borrower')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('loans', models.IntegerField(default=0)),
+                ('returns', models.IntegerField(default=0)),
+                ('overdue', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Period Circulation',
+                'verbose_name_plural': 'Period Circulation',
+                'indexes': [models.Index(fields=['dimension', 'period', 'start', '-loans', 'object_id'], name='book_period_loans_rank'), models.Index(fields=['dimension', 'period', 'start', '-returns', 'object_id'], name='book_period_returns_rank'), models.Index(fields=['dimension', 'period', 'start', '-overdue', 'object_id'], name='book_period_overdue_rank')],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'period', 'start', 'object_id'), name='book_period_circulation_key')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
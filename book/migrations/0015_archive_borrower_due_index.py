@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0014_period_circulation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedborrowrecord',
+            index=models.Index(fields=['borrower', 'due_date', 'id'], name='book_archive_borrower_due_idx'),
+        ),
+    ]
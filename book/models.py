@@ -2,6 +2,7 @@ from django.db import models
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.db.models.functions import Coalesce, Lower
 # Create your models here.
 
 
@@ -16,6 +17,11 @@ class Author(models.Model):
         ordering = ['name']
         verbose_name = 'Author'
         verbose_name_plural = 'Authors'
+        indexes = [
+            models.Index(fields=['name', 'id'], name='book_author_name_idx'),
+            #case-insensitive prefix lookups for the author picker (book.autocomplete)
+            models.Index(Lower('name'), 'id', name='book_author_name_lower_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -25,16 +31,35 @@ class Author(models.Model):
         return reverse('author_details', kwargs={'pk': self.pk})
 
 
+class CategoryQuerySet(models.QuerySet):
+    def with_book_counts(self):
+        #book_count as a correlated subquery, evaluated only for the rows returned
+        #and served by the category_id index instead of a GROUP BY over all books
+        books = (
+            Book.objects.filter(category=models.OuterRef('pk'))
+            .order_by()
+            .values('category')
+            .annotate(count=models.Count('pk'))
+            .values('count')
+        )
+        return self.annotate(book_count=Coalesce(models.Subquery(books), 0))
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         ordering = ['name']
         verbose_name = 'Category'
         verbose_name_plural = 'Categories'
+        indexes = [
+            models.Index(Lower('name'), 'id', name='book_category_name_lower_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -67,6 +92,13 @@ class Book(models.Model):
         ordering = ['title']
         verbose_name = 'Book'
         verbose_name_plural = 'Books'
+        indexes = [
+            models.Index(fields=['title', 'id'], name='book_title_idx'),
+            models.Index(fields=['category', 'title', 'id'], name='book_category_title_idx'),
+            models.Index(fields=['author', 'title', 'id'], name='book_author_title_idx'),
+            #case-insensitive prefix lookups for the book picker (book.autocomplete)
+            models.Index(Lower('title'), 'id', name='book_title_lower_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.author.name}"
@@ -74,10 +106,34 @@ class Book(models.Model):
     def get_absolute_url(self):
         return reverse('author_details', kwargs={'pk': self.pk})
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        #remember the stored status so the stats counters can follow status changes
+        instance._loaded_status = instance.__dict__.get('status')
+        #and the stored cover, so a new upload is sent to the cover workers once
+        instance._loaded_cover = instance.__dict__.get('cover_image') or None
+        return instance
+
     def is_available(self):
         #check if book is available for borrowing
         return self.status == 'available'
     
+#the BorrowRecord fields book.rollups derives a loan's daily events from
+CIRCULATION_FIELDS = ('book_id', 'borrower_id', 'borrow_date', 'return_date', 'due_date',
+                      'is_returned', 'overdue_since')
+
+
+class BorrowRecordQuerySet(models.QuerySet):
+    def open(self):
+        return self.filter(is_returned=False)
+
+    def overdue(self, now=None):
+        #open loans past their due date, most overdue first: a range scan on the
+        #book_open_due_idx partial index instead of the -borrow_date default ordering
+        return self.open().filter(due_date__lt=now or timezone.now()).order_by('due_date', 'pk')
+
+
 class BorrowRecord(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='borrow_records')
     borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='borrow_records')
@@ -86,22 +142,275 @@ class BorrowRecord(models.Model):
     due_date = models.DateTimeField()
     is_returned = models.BooleanField(default=False)
     notes = models.TextField(blank=True, null=True)
+    #set by the sweep_overdue command the first time the loan is found overdue
+    overdue_since = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BorrowRecordQuerySet.as_manager()
+
     class Meta:
         ordering = ['-borrow_date']
         verbose_name = 'Borrow Record'
         verbose_name_plural = 'Borrow Records'
+        indexes = [
+            models.Index(fields=['borrow_date', 'id'], name='book_borrow_date_idx'),
+            models.Index(fields=['return_date', 'id'], name='book_return_date_idx'),
+            #only open loans are indexed, so overdue lookups never touch returned history
+            models.Index(fields=['due_date', 'id'], condition=models.Q(is_returned=False),
+                         name='book_open_due_idx'),
+            #a borrower's open (or returned) loans by due date, for the "my loans" pages
+            models.Index(fields=['borrower', 'is_returned', 'due_date', 'id'], name='book_borrower_loans_idx'),
+        ]
 
     def __str__(self):
         return f"{self.book.title} - {self.borrower.username}"
     
     def get_absolute_url(self):
         return reverse('borrow_detail', kwargs={'pk': self.pk})
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        #remember the stored return flag so the stats counters can follow returns,
+        #and the dates the circulation rollups were counted from
+        instance._loaded_is_returned = instance.__dict__.get('is_returned')
+        loaded = instance.__dict__
+        instance._loaded_circulation = (
+            {name: loaded[name] for name in CIRCULATION_FIELDS}
+            if all(name in loaded for name in CIRCULATION_FIELDS) else None
+        )
+        return instance
     
     def is_overdue(self):
         #check if bool is overdue
         if self.is_returned:
             return False
-        return timezone.now() > self.due_date
\ No newline at end of file
+        return timezone.now() > self.due_date
+
+
+class ArchivedBorrowRecord(models.Model):
+    #a returned BorrowRecord moved out of the hot table by book.archive, same id and fields
+    id = models.BigIntegerField(primary_key=True)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='archived_borrow_records')
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_borrow_records')
+    borrow_date = models.DateTimeField()
+    return_date = models.DateTimeField(blank=True, null=True)
+    due_date = models.DateTimeField()
+    is_returned = models.BooleanField(default=True)
+    notes = models.TextField(blank=True, null=True)
+    overdue_since = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-borrow_date']
+        verbose_name = 'Archived Borrow Record'
+        verbose_name_plural = 'Archived Borrow Records'
+        indexes = [
+            models.Index(fields=['borrow_date', 'id'], name='book_archive_borrow_date_idx'),
+            models.Index(fields=['return_date', 'id'], name='book_archive_return_date_idx'),
+            #a borrower's returned loans, latest due first (My Loans)
+            models.Index(fields=['borrower', 'due_date', 'id'], name='book_archive_borrower_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book.title} - {self.borrower.username}"
+
+    def is_overdue(self):
+        #archived loans are always returned
+        return False
+
+
+class HoldQuerySet(models.QuerySet):
+    def waiting(self):
+        return self.filter(status=Hold.WAITING)
+
+    def queue(self, book):
+        #the book's waiting holds in FIFO order, along the book_hold_queue_idx partial index
+        return self.waiting().filter(book=book).order_by('pk')
+
+    def with_positions(self):
+        #queue position of each waiting hold (1 is next in line) as a correlated count of
+        #the waiting holds ahead of it, read from the same partial index
+        ahead = (
+            Hold.objects.waiting().filter(book=models.OuterRef('book'), pk__lt=models.OuterRef('pk'))
+            .order_by()
+            .values('book')
+            .annotate(count=models.Count('pk'))
+            .values('count')
+        )
+        return self.annotate(position=Coalesce(models.Subquery(ahead), 0) + 1)
+
+
+class Hold(models.Model):
+    #a patron waiting for a copy that is out; book.holds hands returned copies to
+    #the oldest waiting hold, ids give the FIFO order
+    WAITING = 'waiting'
+    READY = 'ready'
+    FULFILLED = 'fulfilled'
+    EXPIRED = 'expired'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (EXPIRED, 'Expired'),
+        (CANCELLED, 'Cancelled'),
+    ]
+    #holds that still take part in the queue
+    ACTIVE = (WAITING, READY)
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    placed_at = models.DateTimeField(default=timezone.now)
+    #set when a returned copy is put aside for this hold
+    ready_at = models.DateTimeField(blank=True, null=True)
+    expires_at = models.DateTimeField(blank=True, null=True)
+    closed_at = models.DateTimeField(blank=True, null=True)
+
+    objects = HoldQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['pk']
+        verbose_name = 'Hold'
+        verbose_name_plural = 'Holds'
+        indexes = [
+            #the FIFO of each book, holding only waiting holds however long the history gets
+            models.Index(fields=['book', 'id'], condition=models.Q(status='waiting'), name='book_hold_queue_idx'),
+            #uncollected copies, oldest pickup deadline first, for expire_holds
+            models.Index(fields=['expires_at', 'id'], condition=models.Q(status='ready'), name='book_hold_ready_idx'),
+            models.Index(fields=['borrower', 'status', 'id'], name='book_hold_borrower_idx'),
+        ]
+        constraints = [
+            #one place in the queue per borrower and book
+            models.UniqueConstraint(fields=['book', 'borrower'], condition=models.Q(status__in=['waiting', 'ready']),
+                                    name='book_hold_active_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.book.title} - {self.borrower.username} ({self.status})"
+
+
+class DailyCirculation(models.Model):
+    #one day of circulation for one book, author, category or borrower, or for the
+    #whole library (object_id 0); kept up to date by book.rollups
+    DIMENSION_CHOICES = [
+        ('library', 'Library'),
+        ('book', 'Book'),
+        ('author', 'Author'),
+        ('category', 'Category'),
+        ('borrower', 'Borrower'),
+    ]
+
+    day = models.DateField()
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    object_id = models.BigIntegerField(default=0)
+    loans = models.IntegerField(default=0)
+    returns = models.IntegerField(default=0)
+    #loans that went past their due date, counted on the due date
+    overdue = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Daily Circulation'
+        verbose_name_plural = 'Daily Circulation'
+        constraints = [
+            #the upsert target, and a range scan for any dimension over a period
+            models.UniqueConstraint(fields=['dimension', 'day', 'object_id'], name='book_daily_circulation_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.dimension} {self.object_id}: {self.loans} loans, {self.returns} returns"
+
+
+class PeriodCirculation(models.Model):
+    #the DailyCirculation rows of one book, author, category or borrower added up over
+    #a month, quarter or year, so a report ranks them by reading the top of an index;
+    #kept up to date by book.rollups
+    PERIOD_CHOICES = [
+        ('month', 'Month'),
+        ('quarter', 'Quarter'),
+        ('year', 'Year'),
+    ]
+
+    period = models.CharField(max_length=7, choices=PERIOD_CHOICES)
+    #first day of the period
+    start = models.DateField()
+    dimension = models.CharField(max_length=10, choices=DailyCirculation.DIMENSION_CHOICES)
+    object_id = models.BigIntegerField()
+    loans = models.IntegerField(default=0)
+    returns = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Period Circulation'
+        verbose_name_plural = 'Period Circulation'
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'period', 'start', 'object_id'],
+                                    name='book_period_circulation_key'),
+        ]
+        #one ranking per metric: the leaders of a period are the first rows of its range
+        indexes = [
+            models.Index(fields=['dimension', 'period', 'start', '-loans', 'object_id'], name='book_period_loans_rank'),
+            models.Index(fields=['dimension', 'period', 'start', '-returns', 'object_id'], name='book_period_returns_rank'),
+            models.Index(fields=['dimension', 'period', 'start', '-overdue', 'object_id'], name='book_period_overdue_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} of {self.start} {self.dimension} {self.object_id}: {self.loans} loans"
+
+
+class LibraryStats(models.Model):
+    #single row of running totals for the dashboard, kept up to date by book.signals
+    total_books = models.IntegerField(default=0)
+    available_books = models.IntegerField(default=0)
+    borrowed_books = models.IntegerField(default=0)
+    reserved_books = models.IntegerField(default=0)
+    total_authors = models.IntegerField(default=0)
+    total_categories = models.IntegerField(default=0)
+    total_loans = models.IntegerField(default=0)
+    active_loans = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Library Stats'
+        verbose_name_plural = 'Library Stats'
+
+    def __str__(self):
+        return f"{self.total_books} books, {self.active_loans} on loan"
+
+
+class FragmentGeneration(models.Model):
+    #the generation of one model's cached fragments (book.fragments), in the database so every
+    #server process, and the replica's copy of the data, agrees on it
+    label = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = 'Fragment Generation'
+        verbose_name_plural = 'Fragment Generations'
+
+    def __str__(self):
+        return f"{self.label}: {self.value}"
+
+
+class BorrowerProfile(models.Model):
+    #per-user loan counters, kept up to date by book.borrowers, so a checkout checks the
+    #loan limits with one primary key lookup instead of counting the user's loans
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='borrower_profile')
+    active_loans = models.IntegerField(default=0)
+    #open loans that sweep_overdue has marked overdue
+    overdue_loans = models.IntegerField(default=0)
+    #overrides settings.LOAN_LIMIT for this borrower when set
+    loan_limit = models.PositiveIntegerField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Borrower Profile'
+        verbose_name_plural = 'Borrower Profiles'
+
+    def __str__(self):
+        return f"{self.user_id}: {self.active_loans} on loan, {self.overdue_loans} overdue"
@@ -0,0 +1,241 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+from django.http import QueryDict
+
+# -----------------------------
+# KEYSET (CURSOR) PAGINATION
+# -----------------------------
+# Pages are addressed by the ordering key values of the row at the page edge
+# instead of an OFFSET, so page 10,000 is a single index range seek just like
+# page one. The ordering keys must be non-null and backed by an index that ends
+# with the primary key (see the Meta.indexes on the models).
+
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 100
+
+
+class KeysetPage:
+    #one page of results plus the query strings that link to its neighbours
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None,
+                 request=None, cursor_param='cursor'):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.request = request
+        self.cursor_param = cursor_param
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _query_string(self, cursor):
+        params = self.request.GET.copy() if self.request is not None else QueryDict(mutable=True)
+        params[self.cursor_param] = cursor
+        return '?' + params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query_string(self.next_cursor) if self.has_next else ''
+
+    @property
+    def previous_query(self):
+        return self._query_string(self.previous_cursor) if self.has_previous else ''
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, ordering=None, per_page=DEFAULT_PER_PAGE):
+        self.queryset = queryset
+        self.per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+        self.keys = self._ordering_keys(queryset, ordering)
+
+    @staticmethod
+    def _ordering_keys(queryset, ordering):
+        #[(field name, descending)] from the explicit ordering or the model Meta.ordering,
+        #ending with the pk as a unique tie-breaker in the same direction as the last key
+        ordering = list(ordering or queryset.query.order_by or queryset.model._meta.ordering)
+        keys = []
+        for name in ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name == queryset.model._meta.pk.name:
+                name = 'pk'
+            keys.append((name, descending))
+        if not any(name == 'pk' for name, _ in keys):
+            keys.append(('pk', keys[-1][1] if keys else False))
+        return keys
+
+    def _field(self, name):
+        opts = self.queryset.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    def _key_value(self, obj, name):
+        #rows are model instances, or dicts from values() that include every ordering key
+        if isinstance(obj, dict):
+            return obj[name]
+        return getattr(obj, self._field(name).attname)
+
+    # cursors are urlsafe base64 JSON of [direction, key values]
+    def encode_cursor(self, obj, direction):
+        values = [self._key_value(obj, name) for name, _ in self.keys]
+        #full-precision isoformat, DjangoJSONEncoder would drop microseconds
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        raw = json.dumps([direction, values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if direction not in ('n', 'p') or len(values) != len(self.keys):
+                raise ValueError
+            values = [self._field(name).to_python(value) for (name, _), value in zip(self.keys, values)]
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            raise BadRequest('Invalid page cursor.')
+        return direction, values
+
+    def _after(self, values, backwards):
+        #rows strictly after `values` in the (possibly reversed) ordering, written as
+        #key1 >= v1 AND (key1 > v1 OR (key1 = v1 AND key2 > v2) ...) so the leading
+        #comparison can seek the index directly
+        def lookup(descending):
+            return 'lt' if descending != backwards else 'gt'
+
+        first_name, first_desc = self.keys[0]
+        condition = Q()
+        equal_so_far = Q()
+        for (name, descending), value in zip(self.keys, values):
+            condition |= equal_so_far & Q(**{f'{name}__{lookup(descending)}': value})
+            equal_so_far &= Q(**{name: value})
+        leading = Q(**{f'{first_name}__{lookup(first_desc)}e': values[0]})  # gte / lte
+        return leading & condition
+
+    def _order_by(self, backwards):
+        return [('-' if descending != backwards else '') + name for name, descending in self.keys]
+
+    def _window(self, queryset, values, backwards):
+        #the rows of one page from `queryset`, plus one extra row that tells whether there is more
+        queryset = queryset.order_by(*self._order_by(backwards))
+        if values is not None:
+            queryset = queryset.filter(self._after(values, backwards))
+        return queryset[:self.per_page + 1]
+
+    def _slice(self, cursor):
+        direction, values = self.decode_cursor(cursor) if cursor else ('n', None)
+        backwards = direction == 'p'
+        return self._window(self.queryset, values, backwards), values, backwards
+
+    def _build_page(self, rows, values, backwards, request, cursor_param):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        if backwards:
+            more_after, more_before = True, has_more
+        else:
+            more_after, more_before = has_more, values is not None
+        next_cursor = previous_cursor = None
+        if rows:
+            next_cursor = self.encode_cursor(rows[-1], 'n') if more_after else None
+            previous_cursor = self.encode_cursor(rows[0], 'p') if more_before else None
+        return KeysetPage(rows, next_cursor, previous_cursor, request, cursor_param)
+
+    def page(self, cursor=None, request=None, cursor_param='cursor'):
+        queryset, values, backwards = self._slice(cursor)
+        return self._build_page(list(queryset), values, backwards, request, cursor_param)
+
+    async def apage(self, cursor=None, request=None, cursor_param='cursor'):
+        queryset, values, backwards = self._slice(cursor)
+        rows = [row async for row in queryset.aiterator()]
+        return self._build_page(rows, values, backwards, request, cursor_param)
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """
+    Keyset pages over a queryset and `cold` querysets of another model with the
+    same ordering keys (an archive table), merged in key order. `cold` holds
+    (queryset, newest) pairs, newest being the largest leading key value in that
+    queryset or None when it is empty; a cold queryset is only read for pages
+    that reach that far back.
+    """
+
+    def __init__(self, queryset, cold=(), ordering=None, per_page=DEFAULT_PER_PAGE):
+        super().__init__(queryset, ordering=ordering, per_page=per_page)
+        self.cold = list(cold)
+
+    def _reaches(self, newest, rows, values, backwards):
+        if newest is None:
+            return False
+        name, descending = self.keys[0]
+        if descending != backwards:
+            #walking towards smaller values: needed unless the page filled up before `newest`
+            return len(rows) <= self.per_page or self._key_value(rows[-1], name) <= newest
+        #walking towards larger values: cold rows lie ahead only if the cursor is at or before `newest`
+        return values is None or values[0] <= newest
+
+    def _merge(self, rows, backwards):
+        #stable sorts from the last key to the first give the full (mixed direction) ordering
+        for name, descending in reversed(self.keys):
+            rows.sort(key=lambda row: self._key_value(row, name), reverse=descending != backwards)
+        return rows[:self.per_page + 1]
+
+    def page(self, cursor=None, request=None, cursor_param='cursor'):
+        queryset, values, backwards = self._slice(cursor)
+        rows = list(queryset)
+        cold = [cold for cold, newest in self.cold if self._reaches(newest, rows, values, backwards)]
+        for cold_queryset in cold:
+            rows.extend(self._window(cold_queryset, values, backwards))
+        if cold:
+            rows = self._merge(rows, backwards)
+        return self._build_page(rows, values, backwards, request, cursor_param)
+
+
+def _per_page(request, per_page):
+    if per_page is None:
+        try:
+            per_page = int(request.GET.get('per_page', DEFAULT_PER_PAGE))
+        except ValueError:
+            per_page = DEFAULT_PER_PAGE
+    return per_page
+
+
+def paginate(request, queryset, cursor_param='cursor', ordering=None, per_page=None):
+    #shared entry point for the list views: reads ?cursor= and ?per_page= from the request
+    paginator = KeysetPaginator(queryset, ordering=ordering, per_page=_per_page(request, per_page))
+    return paginator.page(request.GET.get(cursor_param) or None, request, cursor_param)
+
+
+def paginate_merged(request, queryset, cold, cursor_param='cursor', ordering=None, per_page=None):
+    #paginate() over a queryset and its archived rows, see MergedKeysetPaginator
+    paginator = MergedKeysetPaginator(queryset, cold, ordering=ordering, per_page=_per_page(request, per_page))
+    return paginator.page(request.GET.get(cursor_param) or None, request, cursor_param)
+
+
+async def apaginate(request, queryset, cursor_param='cursor', ordering=None, per_page=None):
+    #paginate() for async views, the page is read with the async ORM
+    paginator = KeysetPaginator(queryset, ordering=ordering, per_page=_per_page(request, per_page))
+    return await paginator.apage(request.GET.get(cursor_param) or None, request, cursor_param)
@@ -0,0 +1,354 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import Tags, Warning, register
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+# -----------------------------
+# REQUEST PROFILING
+# -----------------------------
+# ProfilingMiddleware times every request and splits the time into SQL (count
+# and duration of each statement, through an execute_wrapper on every
+# connection), template rendering (through the ProfiledTemplates backend) and
+# the view as a whole, i.e. everything below the middleware. The numbers go
+# back to the browser in a Server-Timing header and into per-route aggregates:
+# request count, a latency histogram with fixed buckets, the SQL/template share
+# and the slowest statements (SQL text with placeholders, never parameters).
+#
+# Each process adds up its requests in memory and writes them to the cache every
+# FLUSH_SECONDS, into its own slot of the current WINDOW_SECONDS window (slots
+# come from an atomic incr, so processes never overwrite each other). Reports
+# read the last WINDOWS windows of every slot: a rolling view over all server
+# processes, as long as they share the cache (see CACHES in settings). With a
+# process-local backend (the default LocMemCache) each process reports only its
+# own requests, which `check --deploy` warns about. The work per request is a
+# few clock reads and dict updates.
+#
+# SQL time is the time spent in cursor.execute(); rows a template iterates
+# lazily are fetched, and counted, while the template renders. A streaming
+# response's body is produced after the middleware returns, so an export's time
+# is the time to its first byte.
+
+KEY_PREFIX = 'book:perf'
+WINDOW_SECONDS = 60
+WINDOWS = 15
+FLUSH_SECONDS = 5
+
+#upper bounds of the latency histogram buckets in milliseconds, plus one open-ended bucket
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+#slowest distinct statements kept per route
+WORST_QUERIES = 5
+SQL_TEXT_LIMIT = 500
+
+_current = contextvars.ContextVar('book_request_profile', default=None)
+
+
+#backends whose entries only the process that wrote them can read
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _cache():
+    return caches[getattr(settings, 'PROFILING_CACHE', 'default')]
+
+
+@register(Tags.caches, deploy=True)
+def check_profiling_cache(app_configs, **kwargs):
+    alias = getattr(settings, 'PROFILING_CACHE', 'default')
+    if settings.CACHES.get(alias, {}).get('BACKEND') not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        f"PROFILING_CACHE {alias!r} is local to each process, so perf_stats and perf_report "
+        f"only show the requests of the process that answers them.",
+        hint="Point PROFILING_CACHE at a cache every server process shares, with an atomic incr "
+             "(memcached or Redis).",
+        id='book.W002',
+    )]
+
+
+class RequestProfile:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.rendering = False
+        #sql -> [count, total ms, max ms]
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.sql_count += 1
+            self.sql_ms += elapsed
+            stats = self.statements.get(sql)
+            if stats is None:
+                self.statements[sql] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+
+
+def _empty_route():
+    return {
+        'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+        'sql_count': 0, 'sql_ms': 0.0, 'template_ms': 0.0,
+        'buckets': [0] * (len(BUCKETS_MS) + 1),
+        'queries': {},
+    }
+
+
+def _keep_worst(queries):
+    #the WORST_QUERIES statements with the highest single-run time
+    worst = sorted(queries.items(), key=lambda item: item[1][2], reverse=True)[:WORST_QUERIES]
+    return dict(worst)
+
+
+def merge_route(into, route):
+    for field in ('count', 'errors', 'total_ms', 'sql_count', 'sql_ms', 'template_ms'):
+        into[field] += route[field]
+    into['max_ms'] = max(into['max_ms'], route['max_ms'])
+    into['buckets'] = [a + b for a, b in zip(into['buckets'], route['buckets'])]
+    for sql, (count, total, worst) in route['queries'].items():
+        stats = into['queries'].setdefault(sql, [0, 0.0, 0.0])
+        stats[0] += count
+        stats[1] += total
+        stats[2] = max(stats[2], worst)
+    into['queries'] = _keep_worst(into['queries'])
+    return into
+
+
+class Recorder:
+    #this process's aggregates, written to its cache slot every FLUSH_SECONDS
+    def __init__(self):
+        #`lock` guards the requests not yet flushed, `flush_lock` the window and its cache slot
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.flushed_at = time.monotonic()
+        self.window = None
+        self.slot = None
+        self.window_routes = {}
+
+    def record(self, route, total_ms, profile, status):
+        with self.lock:
+            stats = self.pending.get(route)
+            if stats is None:
+                stats = self.pending[route] = _empty_route()
+            stats['count'] += 1
+            stats['errors'] += status >= 500
+            stats['total_ms'] += total_ms
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+            stats['buckets'][bisect_left(BUCKETS_MS, total_ms)] += 1
+            stats['sql_count'] += profile.sql_count
+            stats['sql_ms'] += profile.sql_ms
+            stats['template_ms'] += profile.template_ms
+            for sql, (count, total, worst) in profile.statements.items():
+                query = stats['queries'].setdefault(sql[:SQL_TEXT_LIMIT], [0, 0.0, 0.0])
+                query[0] += count
+                query[1] += total
+                query[2] = max(query[2], worst)
+            if len(stats['queries']) > WORST_QUERIES * 4:
+                stats['queries'] = _keep_worst(stats['queries'])
+            due = time.monotonic() - self.flushed_at >= FLUSH_SECONDS
+            if due:
+                self.flushed_at = time.monotonic()
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+        if not pending:
+            return
+        timeout = WINDOW_SECONDS * (WINDOWS + 1)
+        with self.flush_lock:
+            window = int(time.time() // WINDOW_SECONDS)
+            cache = _cache()
+            if window != self.window:
+                #a new window: take a fresh slot in it
+                slots_key = f'{KEY_PREFIX}:{window}:slots'
+                cache.add(slots_key, 0, timeout)
+                try:
+                    self.slot = cache.incr(slots_key)
+                except ValueError:
+                    self.slot = 1
+                    cache.set(slots_key, 1, timeout)
+                self.window, self.window_routes = window, {}
+            for route, stats in pending.items():
+                merge_route(self.window_routes.setdefault(route, _empty_route()), stats)
+            cache.set(f'{KEY_PREFIX}:{window}:{self.slot}', self.window_routes, timeout)
+
+
+recorder = Recorder()
+
+
+def snapshot(windows=WINDOWS):
+    #{route: aggregates} over the last `windows` windows of every process
+    recorder.flush()
+    cache = _cache()
+    current = int(time.time() // WINDOW_SECONDS)
+    window_ids = range(current - windows + 1, current + 1)
+    slots = cache.get_many([f'{KEY_PREFIX}:{window}:slots' for window in window_ids])
+    keys = [
+        f'{KEY_PREFIX}:{window}:{slot}'
+        for window in window_ids
+        for slot in range(1, slots.get(f'{KEY_PREFIX}:{window}:slots', 0) + 1)
+    ]
+    routes = {}
+    for window_routes in cache.get_many(keys).values():
+        for route, stats in window_routes.items():
+            merge_route(routes.setdefault(route, _empty_route()), stats)
+    return routes
+
+
+def reset():
+    #drop the collected numbers; other processes start writing again in the next window
+    current = int(time.time() // WINDOW_SECONDS)
+    cache = _cache()
+    for window in range(current - WINDOWS, current + 1):
+        slots = cache.get(f'{KEY_PREFIX}:{window}:slots', 0)
+        cache.delete_many([f'{KEY_PREFIX}:{window}:{slot}' for slot in range(1, slots + 1)])
+        cache.delete(f'{KEY_PREFIX}:{window}:slots')
+    with recorder.lock, recorder.flush_lock:
+        recorder.pending, recorder.window, recorder.window_routes = {}, None, {}
+
+
+def percentile_ms(stats, fraction):
+    #upper bound of the histogram bucket holding the given fraction of the requests
+    if not stats['count']:
+        return 0.0
+    target = stats['count'] * fraction
+    seen = 0
+    for bound, count in zip(BUCKETS_MS, stats['buckets']):
+        seen += count
+        if seen >= target:
+            return float(bound)
+    return stats['max_ms']
+
+
+def summary(routes, limit=None):
+    #one row per route, slowest p95 first
+    rows = []
+    for route, stats in routes.items():
+        count = stats['count'] or 1
+        rows.append({
+            'route': route,
+            'count': stats['count'],
+            'errors': stats['errors'],
+            'mean_ms': round(stats['total_ms'] / count, 2),
+            'p50_ms': percentile_ms(stats, 0.5),
+            'p95_ms': percentile_ms(stats, 0.95),
+            'max_ms': round(stats['max_ms'], 2),
+            'sql_per_request': round(stats['sql_count'] / count, 1),
+            'sql_ms': round(stats['sql_ms'] / count, 2),
+            'template_ms': round(stats['template_ms'] / count, 2),
+            'worst_queries': [
+                {'sql': sql, 'count': calls, 'mean_ms': round(total / calls, 2), 'max_ms': round(worst, 2)}
+                for sql, (calls, total, worst) in sorted(
+                    stats['queries'].items(), key=lambda item: item[1][2], reverse=True)
+            ],
+        })
+    rows.sort(key=lambda row: (row['p95_ms'], row['mean_ms']), reverse=True)
+    return rows[:limit] if limit else rows
+
+
+def server_timing(profile, view_ms):
+    return (f'sql;dur={profile.sql_ms:.1f};desc="{profile.sql_count} queries", '
+            f'tpl;dur={profile.template_ms:.1f};desc="templates", '
+            f'view;dur={view_ms:.1f};desc="view"')
+
+
+def _watch(profile):
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(profile))
+    return stack
+
+
+class ProfilingMiddleware:
+    #runs natively under both WSGI and ASGI
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            with _watch(profile):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile, started)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        #connections belong to a thread, and the async ORM (like a sync view under ASGI)
+        #runs its queries on the thread sync_to_async uses, so the wrappers go on that one
+        stack = await sync_to_async(_watch)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        return self.finish(request, response, profile, started)
+
+    def finish(self, request, response, profile, started):
+        view_ms = (time.perf_counter() - started) * 1000
+        response['Server-Timing'] = server_timing(profile, view_ms)
+        match = getattr(request, 'resolver_match', None)
+        recorder.record(match.view_name if match else '<unresolved>', view_ms, profile, response.status_code)
+        return response
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        #nested renders (a fragment rendered inside a page) are counted once
+        if profile is None or profile.rendering:
+            return self.template.render(context, request)
+        profile.rendering = True
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            profile.template_ms += (time.perf_counter() - started) * 1000
+            profile.rendering = False
+
+
+class ProfiledTemplates(DjangoTemplates):
+    #the Django template backend with render time counted into the request profile
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
@@ -0,0 +1,100 @@
+import functools
+import logging
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.test import override_settings
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# QUERY BUDGETS
+# -----------------------------
+# Every view declares how many SQL queries it may issue with @query_budget(n).
+# The count covers the view body and its template rendering; session and user
+# lookups done by login_required before the view runs are not included.
+# When settings.QUERY_BUDGET_ENFORCE is on (DEBUG and the test suite) going over
+# the budget raises QueryBudgetExceeded, otherwise it is logged as a warning.
+# Async views are counted too: their queries run on the request's thread
+# sensitive sync thread, so the counter is installed on that thread's connections.
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# transaction control statements: an outer atomic() sends BEGIN and COMMIT, a nested one
+# (every atomic() inside a test transaction) savepoints, so both count the same statements
+_NOT_COUNTED = ('BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(_NOT_COUNTED):
+            self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+def _watch(counter):
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(counter))
+    return stack
+
+
+def _check(view, counter, max_queries):
+    used = len(counter.queries)
+    if used > max_queries:
+        message = (
+            f"{view.__module__}.{view.__name__} ran {used} queries, "
+            f"over its budget of {max_queries}:\n" + '\n'.join(counter.queries)
+        )
+        if getattr(settings, 'QUERY_BUDGET_ENFORCE', settings.DEBUG):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def query_budget(max_queries):
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                counter = _QueryCounter()
+                stack = await sync_to_async(_watch)(counter)
+                try:
+                    response = await view(request, *args, **kwargs)
+                finally:
+                    await sync_to_async(stack.close)()
+                _check(view, counter, max_queries)
+                return response
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                counter = _QueryCounter()
+                with _watch(counter):
+                    response = view(request, *args, **kwargs)
+                _check(view, counter, max_queries)
+                return response
+
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+
+class QueryBudgetTestMixin:
+    #TestCase mixin: request a URL with budgets enforced, failing if the view has none
+
+    def request_within_budget(self, url, data=None, method='get', **extra):
+        view = resolve(url.split('?')[0]).func
+        self.assertIsNotNone(
+            getattr(view, 'query_budget', None),
+            f"{view.__module__}.{view.__name__} is missing a @query_budget",
+        )
+        with override_settings(QUERY_BUDGET_ENFORCE=True):
+            return getattr(self.client, method)(url, data, **extra)
@@ -0,0 +1,213 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from . import archive, borrowers, rollups
+from .models import Author, Book, BorrowRecord, Category, Hold
+from .querybudget import _NOT_COUNTED
+
+# -----------------------------
+# QUERY PLAN CHECKS
+# -----------------------------
+# Every GET view in book.urls is requested against a seeded (and ANALYZEd)
+# database, each SQL statement it issues is run through EXPLAIN QUERY PLAN, and
+# plans that read a whole large table or sort through a temporary B-tree are
+# reported unless they are listed in ALLOWED_PLANS. A missing index then shows
+# up as a failing check instead of as latency in production.
+
+#tables that grow with the library, a full scan of any of them is a problem
+LARGE_TABLES = {'book_book', 'book_borrowrecord', 'book_author', 'book_category', 'auth_user',
+                'book_dailycirculation', 'book_archivedborrowrecord'}
+
+#(url name, SQL pattern, plan detail pattern) for plans that are expected
+ALLOWED_PLANS = [
+    #full dumps read every row on purpose, in primary key order
+    ('export_books', r'', r'^SCAN book_(book|author|category)$'),
+    #ranked search sorts only the matching rows
+    ('book_list', r'FROM book_search', r'^USE TEMP B-TREE FOR ORDER BY$'),
+    #the shelf re-sorts at most SHELF_SIZE books per category on the page
+    ('book_shelf', r'"qualify"', r'^USE TEMP B-TREE FOR ORDER BY$'),
+]
+
+_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+def seed(size=20):
+    #size users (the first one staff, so the staff-only views are planned too), categories
+    #and authors, size**2 books with two loans each (one still open, some of the returned
+    #ones archived) and three holds on each borrowed book
+    now = timezone.now()
+    users = User.objects.bulk_create([User(username=f'query-plans-{index}', is_staff=index == 0)
+                                      for index in range(size)])
+    categories = Category.objects.bulk_create(
+        [Category(name=f'Plan category {index}') for index in range(size)])
+    authors = Author.objects.bulk_create(
+        [Author(name=f'Plan author {index}') for index in range(size)])
+    books = Book.objects.bulk_create([
+        Book(title=f'Plan book {index}-{number}', author=author, category=categories[number],
+             status='borrowed' if number % 2 else 'available')
+        for index, author in enumerate(authors) for number in range(size)
+    ])
+    BorrowRecord.objects.bulk_create([
+        record
+        for index, book in enumerate(books)
+        for record in (
+            BorrowRecord(book=book, borrower=users[index % size], is_returned=True,
+                         borrow_date=now - timedelta(days=60 + index % 30),
+                         due_date=now - timedelta(days=46),
+                         return_date=now - timedelta(days=50 - index % 30)),
+            BorrowRecord(book=book, borrower=users[-1 - index % size],
+                         borrow_date=now - timedelta(days=index % 20),
+                         due_date=now + timedelta(days=14 - index % 20)),
+        )
+    ])
+    #a waiting list on every borrowed book
+    Hold.objects.bulk_create([
+        Hold(book=book, borrower=users[(index + offset) % size])
+        for index, book in enumerate(books) if book.status == 'borrowed'
+        for offset in range(3)
+    ])
+    rollups.rebuild()
+    borrowers.recompute()
+    #the oldest returns, about a sixth, go to the archive
+    archive.archive_returned(older_than_days=45)
+    return users[0]
+
+
+def view_urls(search='plan'):
+    #one URL for every GET view (plus the variants that run different SQL)
+    book = Book.objects.order_by('pk').first()
+    author = Author.objects.order_by('pk').first()
+    category = Category.objects.order_by('pk').first()
+    loan = BorrowRecord.objects.open().order_by('pk').first()
+    return [
+        reverse('book:dashboard'),
+        reverse('book:book_list'),
+        reverse('book:book_list') + f'?search={search}',
+        reverse('book:book_create'),
+        reverse('book:book_update', args=[book.pk]),
+        reverse('book:book_detail', args=[book.pk]),
+        reverse('book:book_delete', args=[book.pk]),
+        reverse('book:available_books'),
+        reverse('book:book_shelf'),
+        reverse('book:author_list'),
+        reverse('book:author_create'),
+        reverse('book:author_detail', args=[author.pk]),
+        reverse('book:author_update', args=[author.pk]),
+        reverse('book:category_list'),
+        reverse('book:category_create'),
+        reverse('book:category_detail', args=[category.pk]),
+        reverse('book:category_update', args=[category.pk]),
+        reverse('book:borrow_list'),
+        reverse('book:borrow_create'),
+        reverse('book:return_list'),
+        reverse('book:return_book', args=[loan.pk]),
+        reverse('book:overdue_list'),
+        reverse('book:my_loans'),
+        reverse('book:my_loans') + '?show=returned',
+        #POST-only, a GET is refused before any SQL
+        reverse('book:hold_place', args=[book.pk]),
+        reverse('book:hold_cancel', args=[1]),
+        reverse('book:circulation_report'),
+        reverse('book:circulation_report') + '?period=year',
+        reverse('book:autocomplete', args=['books']) + '?q=plan b',
+        reverse('book:autocomplete', args=['books']) + '?q=978',
+        reverse('book:autocomplete', args=['borrowers']) + '?q=query',
+        reverse('book:autocomplete', args=['authors']) + '?q=plan',
+        reverse('book:autocomplete', args=['categories']),
+        reverse('book:export_books'),
+        reverse('book:export_borrows') + '?start=2000-01-01',
+        reverse('book:api_books') + '?fields=id,title,author,category,status',
+        reverse('book:api_books') + f'?category={category.pk}',
+        reverse('book:api_authors'),
+        reverse('book:api_categories') + '?fields=id,name,book_count',
+        reverse('book:api_loans'),
+        reverse('book:api_loans') + '?overdue=1',
+        reverse('book:perf_stats'),
+    ]
+
+
+class _Capture:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and not sql.lstrip().upper().startswith(_NOT_COUNTED):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def allowed_host():
+    #a host name the site accepts, views that build absolute URLs raise DisallowedHost otherwise
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def capture(url, user):
+    #url name, status code and (sql, params) of every statement the view behind url runs,
+    #streamed content included
+    match = resolve(url.split('?')[0])
+    request = RequestFactory(HTTP_HOST=allowed_host()).get(url)
+    request.user = user
+    capture = _Capture()
+    with connection.execute_wrapper(capture):
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+    return match.url_name, response.status_code, capture.statements
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def allowed_patterns(url_name, sql):
+    return [detail for name, pattern, detail in ALLOWED_PLANS
+            if name == url_name and re.search(pattern, sql)]
+
+
+def plan_problems(details, allowed=()):
+    #the plan lines that scan a large table or build a temporary B-tree
+    problems = []
+    for detail in details:
+        if any(re.search(pattern, detail) for pattern in allowed):
+            continue
+        scan = _SCAN.match(detail)
+        if (scan and scan.group(1) in LARGE_TABLES) or 'USE TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def analyze():
+    #refresh sqlite_stat1 so the planner knows how selective each index is
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def check_views(size=20, urls=None):
+    #[(url name, sql, [problems])] for every view, run on seeded data that is rolled back
+    report = []
+    with transaction.atomic():
+        user = seed(size)
+        analyze()
+        for url in urls or view_urls():
+            name, status, statements = capture(url, user)
+            if status == 302:
+                #a redirect to the login page runs none of the view's own SQL
+                report.append((name, url, [f'redirected instead of answering ({status})']))
+            for sql, params in statements:
+                problems = plan_problems(explain(sql, params), allowed_patterns(name, sql))
+                report.append((name, sql % tuple(repr(param) for param in params or ()), problems))
+        transaction.set_rollback(True)
+    return report
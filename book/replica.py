@@ -0,0 +1,73 @@
+import os
+import sqlite3
+
+from django.conf import settings
+from django.db import connections
+
+from .routers import PRIMARY, REPLICA
+
+# -----------------------------
+# REPLICA SYNC
+# -----------------------------
+# The replica is a whole-file copy of the primary made with SQLite's online
+# backup API: the copy reads one consistent snapshot of the primary (in WAL
+# mode writers carry on meanwhile) and replaces the replica's pages in a single
+# write transaction, so readers of the replica see either the old or the new
+# copy, never a mix. PRAGMA data_version tells whether anything was committed
+# since the last copy, so an idle primary isn't copied over and over. Every
+# check, copy or not, stamps the replica file's modification time: the router
+# (book.routers.replica_age) reads from the replica only while that stamp is
+# recent, so it falls back to the primary when the sync loop isn't running.
+
+
+def database_path(alias):
+    #from the connection, which points at the test database under the test runner
+    return str(connections[alias].settings_dict['NAME'])
+
+
+def is_separate():
+    #False without a replica, when it is the primary itself (the test mirror) or
+    #when the primary is an in-memory database, which has no file to copy
+    if REPLICA not in settings.DATABASES or connections[PRIMARY].is_in_memory_db():
+        return False
+    return database_path(REPLICA) != database_path(PRIMARY)
+
+
+class ReplicaSync:
+    def __init__(self, source=None, target=None, timeout=30):
+        self.target_path = target or database_path(REPLICA)
+        self.source = sqlite3.connect(source or database_path(PRIMARY), timeout=timeout)
+        self.target = sqlite3.connect(self.target_path, timeout=timeout)
+        self.version = None
+
+    def changed(self):
+        #data_version moves whenever another connection commits to the primary
+        version = self.source.execute('PRAGMA data_version').fetchone()[0]
+        changed, self.version = version != self.version, version
+        return changed
+
+    def run(self, force=False):
+        #copy the primary if it changed, returns whether a copy was made
+        copied = force or self.changed()
+        if copied:
+            #the fragment generations (book.fragments) are copied along with the data they
+            #describe, so pages cached from the replica are keyed by the replica's state
+            self.source.backup(self.target)
+        #the replica is now known to match the primary
+        os.utime(self.target_path)
+        return copied
+
+    def close(self):
+        self.source.close()
+        self.target.close()
+
+
+def sync():
+    #one forced copy, e.g. right after migrate
+    if not is_separate():
+        return False
+    replica = ReplicaSync()
+    try:
+        return replica.run(force=True)
+    finally:
+        replica.close()
@@ -0,0 +1,448 @@
+import heapq
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.contrib.auth.models import User
+from django.db import connections, router, transaction
+from django.db.models import Count, DateField, F, Func, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncQuarter, TruncYear
+from django.utils import timezone
+
+from .bulk import chunked
+from . import fragments
+from .models import (
+    CIRCULATION_FIELDS, ArchivedBorrowRecord, Author, Book, BorrowRecord, Category, DailyCirculation,
+    PeriodCirculation,
+)
+
+# -----------------------------
+# CIRCULATION ROLLUPS
+# -----------------------------
+# book_dailycirculation holds, per day, the number of loans, returns and newly
+# overdue loans of every book, author, category and borrower, plus a 'library'
+# row with the totals. Reports read those rows instead of counting BorrowRecord:
+# a year of library totals is at most 366 rows.
+#
+# A loan counts on the day it was borrowed, a return on the day it was returned
+# and an overdue loan on its due date (days in the site's time zone). A loan is
+# overdue once sweep_overdue has stamped it, or if it was returned late.
+#
+# The rows are kept current incrementally, in the transaction of each change:
+# book.signals handles saved and deleted records, and the circulation engine
+# and sweep_overdue, which write with QuerySet.update(), call add() themselves.
+# Each change is one INSERT ... ON CONFLICT DO UPDATE that adds to the counts.
+# rebuild() (the rebuild_rollups command) recounts them from BorrowRecord and
+# the archived loans (book.archive), which keep counting after they are moved.
+#
+# book_periodcirculation adds the same counts up per month, quarter and year
+# for every book, author, category and borrower, written in the same upserts.
+# Ranking the leaders of a period then reads the first rows of one index range
+# instead of summing a row per object and day.
+
+LIBRARY = 'library'
+METRICS = ('loans', 'returns', 'overdue')
+
+#dimension -> BorrowRecord lookup of the id it is counted under
+DIMENSIONS = {
+    'book': 'book_id',
+    'author': 'book__author_id',
+    'category': 'book__category_id',
+    'borrower': 'borrower_id',
+}
+
+#metric -> (BorrowRecord date field the event is counted on, which records have the event)
+EVENTS = {
+    'loans': ('borrow_date', Q()),
+    'returns': ('return_date', Q(is_returned=True, return_date__isnull=False)),
+    'overdue': ('due_date', Q(overdue_since__isnull=False)
+                | Q(is_returned=True, return_date__gt=F('due_date'))),
+}
+
+#what a values() query reads to count a loan without touching its book again
+LOAN_VALUES = (*CIRCULATION_FIELDS, 'book__author_id', 'book__category_id')
+
+_UPSERT = """
+    INSERT INTO {table} (day, dimension, object_id, loans, returns, overdue)
+    VALUES {values}
+    ON CONFLICT (dimension, day, object_id) DO UPDATE SET
+        loans = loans + excluded.loans,
+        returns = returns + excluded.returns,
+        overdue = overdue + excluded.overdue
+"""
+_MERGE = """
+    INSERT INTO {table} (day, dimension, object_id, loans, returns, overdue)
+    SELECT day, dimension, %s, loans, returns, overdue FROM {table}
+    WHERE dimension = %s AND object_id = %s
+    ON CONFLICT (dimension, day, object_id) DO UPDATE SET
+        loans = loans + excluded.loans,
+        returns = returns + excluded.returns,
+        overdue = overdue + excluded.overdue
+"""
+_PERIOD_UPSERT = """
+    INSERT INTO {table} (period, start, dimension, object_id, loans, returns, overdue)
+    VALUES {values}
+    ON CONFLICT (dimension, period, start, object_id) DO UPDATE SET
+        loans = loans + excluded.loans,
+        returns = returns + excluded.returns,
+        overdue = overdue + excluded.overdue
+"""
+_PERIOD_MERGE = """
+    INSERT INTO {table} (period, start, dimension, object_id, loans, returns, overdue)
+    SELECT period, start, dimension, %s, loans, returns, overdue FROM {table}
+    WHERE dimension = %s AND object_id = %s
+    ON CONFLICT (dimension, period, start, object_id) DO UPDATE SET
+        loans = loans + excluded.loans,
+        returns = returns + excluded.returns,
+        overdue = overdue + excluded.overdue
+"""
+#rows per INSERT, six (or seven for the periods) parameters each, under SQLite's 999 parameter limit
+UPSERT_ROWS = 140
+#rows per executemany() when backfilling
+BACKFILL_BATCH = 5000
+
+
+def _day(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def is_overdue(record):
+    #record: a BorrowRecord or a dict of its CIRCULATION_FIELDS
+    get = record.get if isinstance(record, dict) else record.__dict__.get
+    if get('overdue_since') is not None:
+        return True
+    return bool(get('is_returned') and get('return_date') and get('return_date') > get('due_date'))
+
+
+def loan_events(record, sign=1):
+    #{day: {metric: count}} that one loan contributes, negated with sign=-1
+    get = record.get if isinstance(record, dict) else record.__dict__.get
+    events = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    events[_day(get('borrow_date'))]['loans'] += sign
+    if get('is_returned') and get('return_date'):
+        events[_day(get('return_date'))]['returns'] += sign
+    if is_overdue(record):
+        events[_day(get('due_date'))]['overdue'] += sign
+    return events
+
+
+def diff_events(old, new):
+    #the events to add to go from the `old` loan state to the `new` one
+    events = loan_events(new)
+    for day, counts in loan_events(old, -1).items():
+        for metric, count in counts.items():
+            events[day][metric] += count
+    return {day: counts for day, counts in events.items() if any(counts.values())}
+
+
+def period_rows(rows):
+    #the [(period, start, dimension, object_id, loans, returns, overdue)] that daily rows add to;
+    #the library's own totals are left out, its reports sum at most a year of daily rows
+    totals = defaultdict(lambda: [0] * len(METRICS))
+    for day, dimension, object_id, *counts in rows:
+        if dimension == LIBRARY:
+            continue
+        day = date.fromisoformat(day)
+        for period in PERIODS:
+            row = totals[(period, period_bounds(period, day)[0].isoformat(), dimension, object_id)]
+            for index, count in enumerate(counts):
+                row[index] += count
+    return [(*key, *row) for key, row in totals.items() if any(row)]
+
+
+def write(rows, using='default'):
+    #add [(day, dimension, object_id, loans, returns, overdue)] to the stored counts, daily and per period
+    quote = connections[using].ops.quote_name
+    with connections[using].cursor() as cursor:
+        for sql, model, table_rows in ((_UPSERT, DailyCirculation, rows),
+                                       (_PERIOD_UPSERT, PeriodCirculation, period_rows(rows))):
+            table = quote(model._meta.db_table)
+            for chunk in chunked(table_rows, UPSERT_ROWS):
+                row_values = '(' + ', '.join(['%s'] * len(chunk[0])) + ')'
+                values = ', '.join([row_values] * len(chunk))
+                params = [value for row in chunk for value in row]
+                cursor.execute(sql.format(table=table, values=values), params)
+
+
+def add(ids, events, using=None):
+    """
+    Count `events` ({day: {metric: count}}) for one loan.
+    `ids` maps each dimension in DIMENSIONS to the loan's id for it (category may be None).
+    """
+    keys = [(LIBRARY, 0)] + [(dimension, ids[dimension]) for dimension in DIMENSIONS
+                             if ids.get(dimension) is not None]
+    rows = [
+        (day.isoformat(), dimension, object_id, *(counts.get(metric, 0) for metric in METRICS))
+        for day, counts in events.items()
+        for dimension, object_id in keys
+    ]
+    if rows:
+        write(rows, using or router.db_for_write(DailyCirculation))
+
+
+def merge_objects(dimension, mapping, using=None):
+    #fold the counts of each id in `mapping` ({old id: new id}) into its new id and drop its rows,
+    #for the authors and books merged by book.duplicates
+    using = using or router.db_for_write(DailyCirculation)
+    quote = connections[using].ops.quote_name
+    with connections[using].cursor() as cursor:
+        for sql, model in ((_MERGE, DailyCirculation), (_PERIOD_MERGE, PeriodCirculation)):
+            for old, new in mapping.items():
+                cursor.execute(sql.format(table=quote(model._meta.db_table)), [new, dimension, old])
+            model.objects.using(using).filter(dimension=dimension, object_id__in=list(mapping)).delete()
+
+
+def loan_ids(loan, using=None):
+    #{dimension: id} of a loan dict, reading the book's author and category unless the dict has them
+    if 'book__author_id' not in loan:
+        books = Book.objects.using(using or router.db_for_write(DailyCirculation))
+        author_id, category_id = books.filter(pk=loan['book_id']).values_list(
+            'author_id', 'category_id').get()
+        loan = dict(loan, book__author_id=author_id, book__category_id=category_id)
+    return {dimension: loan[lookup] for dimension, lookup in DIMENSIONS.items()}
+
+
+def loan_changed(old, new, using=None):
+    """
+    Move the counts from the `old` state of a loan to the `new` one; either is
+    None for a created or deleted loan. States are dicts of CIRCULATION_FIELDS,
+    optionally with book__author_id and book__category_id.
+    """
+    if old is not None and new is not None and all(old[name] == new[name] for name in ('book_id', 'borrower_id')):
+        events = diff_events(old, new)
+        if events:
+            add(loan_ids(new, using), events, using)
+        return
+    if old is not None:
+        add(loan_ids(old, using), loan_events(old, -1), using)
+    if new is not None:
+        add(loan_ids(new, using), loan_events(new), using)
+
+
+def _add_events(loan_events_pairs, metrics=METRICS, using=None):
+    #add (loan dict with its book's author and category, {day: {metric: count}}) pairs in one upsert
+    totals = defaultdict(lambda: [0] * len(METRICS))
+    for loan, events in loan_events_pairs:
+        keys = [(LIBRARY, 0)] + [(dimension, loan[lookup]) for dimension, lookup in DIMENSIONS.items()
+                                 if loan[lookup] is not None]
+        for day, counts in events.items():
+            for key in keys:
+                row = totals[(day.isoformat(), *key)]
+                for index, metric in enumerate(METRICS):
+                    if metric in metrics:
+                        row[index] += counts[metric]
+    write([(*key, *row) for key, row in totals.items()], using)
+
+
+def _add_loans(loans, sign=1, metrics=METRICS, using=None):
+    #add the events of many loan dicts (with their book's author and category) in one upsert
+    _add_events(((loan, loan_events(loan, sign)) for loan in loans), metrics, using)
+
+
+def overdue_marked(pks, marked_at, using=None):
+    #count the loans among `pks` that sweep_overdue stamped at `marked_at`
+    using = using or router.db_for_write(DailyCirculation)
+    loans = BorrowRecord.objects.using(using).filter(pk__in=pks, overdue_since=marked_at)
+    _add_loans(loans.values(*LOAN_VALUES), metrics=('overdue',), using=using)
+
+
+def loans_returned(loans, using=None):
+    #count the return of many loans at once, dicts of LOAN_VALUES read after return_loans() closed them
+    using = using or router.db_for_write(DailyCirculation)
+    _add_events(((loan, diff_events(dict(loan, is_returned=False, return_date=None), loan)) for loan in loans),
+                using=using)
+
+
+def loans_removed(loans, using=None):
+    #take a queryset of loans about to be deleted out of the counts
+    using = using or router.db_for_write(DailyCirculation)
+    _add_loans(loans.using(using).order_by().values(*LOAN_VALUES).iterator(), -1, using=using)
+
+
+def loan_state(record):
+    state = {name: getattr(record, name) for name in CIRCULATION_FIELDS}
+    if BorrowRecord.book.is_cached(record) and record.book.pk == record.book_id:
+        state.update(book__author_id=record.book.author_id, book__category_id=record.book.category_id)
+    return state
+
+
+def _aware_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _day_of(field, using):
+    #the local day of a datetime column; SQLite's date() is native but only right in UTC,
+    #TruncDate calls back into Python for every row
+    if connections[using].vendor == 'sqlite' and timezone.get_current_timezone_name() == 'UTC':
+        return Func(F(field), function='date', output_field=DateField())
+    return TruncDate(field)
+
+
+def _event_counts(borrow_records, metric, lookup, using, since=None):
+    #(day, object_id, metric, count) per day and id with `metric` events, ordered by day and id
+    field, condition = EVENTS[metric]
+    records = borrow_records.filter(condition)
+    if since is not None:
+        records = records.filter(**{f'{field}__gte': _aware_start(since)})
+    if lookup:
+        records = records.filter(**{f'{lookup}__isnull': False})
+    keys = ['rollup_day'] + ([lookup] if lookup else [])
+    rows = (records.annotate(rollup_day=_day_of(field, using)).values(*keys)
+            .annotate(n=Count('pk')).order_by(*keys))
+    for row in rows.iterator(chunk_size=5000):
+        yield row['rollup_day'], row[lookup] if lookup else 0, metric, row['n']
+
+
+def backfill(borrow_records, using='default', since=None, archived=None):
+    """
+    Recount every row from `since` (a date, default: all of them) out of
+    `borrow_records`, a BorrowRecord manager, and `archived`, the manager of
+    the archived loans if there is one; historical models work too.
+    Returns the number of rows written.
+    """
+    quote = connections[using].ops.quote_name
+    table = quote(DailyCirculation._meta.db_table)
+    with connections[using].cursor() as cursor:
+        if since is None:
+            cursor.execute(f'DELETE FROM {table}')
+        else:
+            cursor.execute(f'DELETE FROM {table} WHERE day >= %s', [since.isoformat()])
+    insert = f'INSERT INTO {table} (day, dimension, object_id, loans, returns, overdue) VALUES (%s, %s, %s, %s, %s, %s)'
+    written = 0
+    for dimension, lookup in [(LIBRARY, None)] + list(DIMENSIONS.items()):
+        #the three event counts, each sorted by (day, id), merged into one row per day and id
+        sources = [borrow_records] if archived is None else [borrow_records, archived]
+        merged = heapq.merge(*(_event_counts(records, metric, lookup, using, since)
+                               for records in sources for metric in METRICS))
+        rows = []
+        for (day, object_id), events in groupby(merged, key=itemgetter(0, 1)):
+            counts = dict.fromkeys(METRICS, 0)
+            for _, _, metric, count in events:
+                counts[metric] += count
+            rows.append((day.isoformat(), dimension, object_id, *counts.values()))
+            if len(rows) == BACKFILL_BATCH:
+                written += _insert_many(insert, rows, using)
+                rows = []
+        written += _insert_many(insert, rows, using)
+    return written
+
+
+def backfill_periods(using='default', since=None):
+    """
+    Add the daily rows up into the period rows again, from the year holding
+    `since` (default: all of them). Returns the number of rows written.
+    """
+    periods = PeriodCirculation.objects.using(using)
+    days = DailyCirculation.objects.using(using).exclude(dimension=LIBRARY)
+    if since is not None:
+        #every period that holds a recounted day starts in the year of `since` or later
+        since = period_bounds('year', since)[0]
+        periods = periods.filter(start__gte=since)
+        days = days.filter(day__gte=since)
+    periods.delete()
+    table = connections[using].ops.quote_name(PeriodCirculation._meta.db_table)
+    insert = (f'INSERT INTO {table} (period, start, dimension, object_id, loans, returns, overdue) '
+              f'VALUES (%s, %s, %s, %s, %s, %s, %s)')
+    written = 0
+    for period, trunc in (('month', TruncMonth), ('quarter', TruncQuarter), ('year', TruncYear)):
+        sums = (days.annotate(period_start=trunc('day')).values('dimension', 'object_id', 'period_start')
+                .annotate(**{f'total_{metric}': Sum(metric) for metric in METRICS}).order_by())
+        rows = (
+            (period, row['period_start'].isoformat(), row['dimension'], row['object_id'],
+             *(row[f'total_{metric}'] for metric in METRICS))
+            for row in sums.iterator(chunk_size=BACKFILL_BATCH)
+        )
+        for chunk in chunked(rows, BACKFILL_BATCH):
+            written += _insert_many(insert, chunk, using)
+    return written
+
+
+def _insert_many(sql, rows, using):
+    with connections[using].cursor() as cursor:
+        cursor.executemany(sql, rows)
+    return len(rows)
+
+
+def rebuild(since=None, using='default'):
+    #recount the rollups from BorrowRecord in one transaction; returns the number of rows written
+    with transaction.atomic(using=using):
+        written = backfill(BorrowRecord.objects.using(using), using, since,
+                           ArchivedBorrowRecord.objects.using(using))
+        written += backfill_periods(using, since)
+        fragments.invalidate(BorrowRecord, using=using)
+    return written
+
+
+# ------------------ Reports ------------------
+
+PERIODS = ('month', 'quarter', 'year')
+
+def period_bounds(period, day):
+    #(first day, last day) of the month, quarter or year holding `day`
+    if period == 'month':
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    elif period == 'quarter':
+        start = day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+        end = (start + timedelta(days=95)).replace(day=1)
+    elif period == 'year':
+        start = day.replace(month=1, day=1)
+        end = start.replace(year=start.year + 1)
+    else:
+        raise ValueError(f'Unknown period {period!r}.')
+    return start, end - timedelta(days=1)
+
+
+def _rows(dimension, start, end):
+    return DailyCirculation.objects.filter(dimension=dimension, day__gte=start, day__lte=end)
+
+
+def totals(start, end):
+    #{'loans': n, 'returns': n, 'overdue': n} for the library between two days
+    sums = _rows(LIBRARY, start, end).aggregate(**{metric: Sum(metric) for metric in METRICS})
+    return {metric: sums[metric] or 0 for metric in METRICS}
+
+
+def series(start, end, by='day'):
+    #library totals per day or per month: [{'period': date, 'loans': n, ...}]
+    rows = _rows(LIBRARY, start, end).order_by('day').values(*METRICS, period=F('day'))
+    if by == 'day':
+        return list(rows)
+    #at most 366 rows, read in day order and added up here instead of grouped in a temporary B-tree
+    months = []
+    for month, days in groupby(rows, key=lambda row: row['period'].replace(day=1)):
+        sums = dict.fromkeys(METRICS, 0)
+        for row in days:
+            for metric in METRICS:
+                sums[metric] += row[metric]
+        months.append({'period': month, **sums})
+    return months
+
+
+def top(dimension, period, day, metric='loans', limit=10):
+    #[(object_id, total)] with the highest totals of `metric` over the month, quarter or year holding `day`
+    rows = (
+        PeriodCirculation.objects
+        .filter(dimension=dimension, period=period, start=period_bounds(period, day)[0], **{f'{metric}__gt': 0})
+        .order_by(f'-{metric}', 'object_id').values_list('object_id', metric)[:limit]
+    )
+    return list(rows)
+
+
+def _names(dimension, ids):
+    model, field = {
+        'book': (Book, 'title'),
+        'author': (Author, 'name'),
+        'category': (Category, 'name'),
+        'borrower': (User, 'username'),
+    }[dimension]
+    return dict(model.objects.filter(pk__in=ids).order_by().values_list('pk', field))
+
+
+def leaders(dimension, period, day, metric='loans', limit=10):
+    #top() with names: [{'id': pk, 'name': str, 'total': n}]; rows deleted since are left out
+    ranked = top(dimension, period, day, metric, limit)
+    names = _names(dimension, [object_id for object_id, _ in ranked]) if ranked else {}
+    return [{'id': object_id, 'name': names[object_id], 'total': total}
+            for object_id, total in ranked if object_id in names]
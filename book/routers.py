@@ -0,0 +1,136 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+# -----------------------------
+# READ / WRITE ROUTING
+# -----------------------------
+# Writes go to the primary ('default'), plain reads to a read replica that the
+# sync_replica command keeps current by copying the primary with SQLite's
+# backup API. Reads go to the primary as well when the replica could show stale
+# data to someone who just changed it:
+#   - inside a transaction on the primary (checkouts, returns, edits read their
+#     own rows under the write lock, see book.services),
+#   - for the rest of a request once it has written anything,
+#   - for the next few seconds of the same browser, through a cookie, so the
+#     redirect after a POST shows the change before the replica has caught up,
+#   - whenever the replica's copy is older than that pin window: sync_replica
+#     stamps the replica file after every check, so a stopped loop sends every
+#     read back to the primary instead of serving an ever older copy.
+#
+# Without a 'replica' entry in settings.DATABASES (the default, see
+# REPLICA_SYNC_INTERVAL) everything uses 'default'.
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+PIN_COOKIE = 'book_primary'
+
+#apps always read from the primary and whose writes don't pin the request: a
+#session saved by a login must be found by the very next request, and a user
+#created or changed by another process must be able to log in at once
+PRIMARY_APPS = {'sessions', 'auth'}
+
+_pinned = contextvars.ContextVar('book_primary_pinned', default=False)
+
+
+def pin_seconds():
+    #long enough for at least one replica sync to have run after a write
+    interval = getattr(settings, 'REPLICA_SYNC_INTERVAL', None) or 2
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 2 * interval)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+@contextmanager
+def primary_pin(pinned=True):
+    #reads inside the block go to the primary (pinned=True) or follow the normal rules;
+    #a write inside it pins only the block, not whatever runs after it
+    token = _pinned.set(pinned)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def replica_age():
+    #seconds since sync_replica last confirmed the replica's copy (book.replica), 0 when the
+    #replica is the primary itself (the test mirror)
+    primary, replica = settings.DATABASES[PRIMARY], settings.DATABASES[REPLICA]
+    if str(replica['NAME']) == str(primary['NAME']):
+        return 0
+    try:
+        return time.time() - os.stat(replica['NAME']).st_mtime
+    except OSError:
+        return float('inf')
+
+
+def replica_alias():
+    #the replica while it is configured and current, one stat() of its file
+    if REPLICA not in settings.DATABASES or replica_age() > pin_seconds():
+        return None
+    return REPLICA
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (_pinned.get() or model._meta.app_label in PRIMARY_APPS
+                or connections[PRIMARY].in_atomic_block):
+            return PRIMARY
+        return replica_alias() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in PRIMARY_APPS:
+            _pinned.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #both aliases hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        #the replica gets its schema from the copy, never from migrate
+        return db == PRIMARY
+
+
+class PrimaryPinningMiddleware:
+    #scopes the pin to one request and carries it over to the next ones with a cookie;
+    #runs natively under both WSGI and ASGI
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with primary_pin(self.pinned(request)):
+            response = self.get_response(request)
+            wrote = _pinned.get() and request.method not in ('GET', 'HEAD')
+        return self.carry_over(response, wrote)
+
+    async def __acall__(self, request):
+        with primary_pin(self.pinned(request)):
+            response = await self.get_response(request)
+            wrote = _pinned.get() and request.method not in ('GET', 'HEAD')
+        return self.carry_over(response, wrote)
+
+    def pinned(self, request):
+        pinned_until = request.COOKIES.get(PIN_COOKIE, '')
+        return pinned_until.isdigit() and int(pinned_until) > time.time()
+
+    def carry_over(self, response, wrote):
+        if wrote:
+            seconds = pin_seconds()
+            response.set_cookie(PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,170 @@
+import re
+
+from django.db import connection, connections, router
+from django.utils.html import escape
+
+# -----------------------------
+# FULL-TEXT SEARCH (SQLite FTS5)
+# -----------------------------
+# book_search is an FTS5 table with one row per book (rowid = book id) holding
+# the book's text plus its author and category names. The triggers below keep it
+# in sync with every insert/update/delete, including bulk_create() and
+# QuerySet.update() which never send model signals.
+
+SEARCH_TABLE = 'book_search'
+
+# bm25() weights, in column order: title, isbn, description, author, category
+COLUMN_WEIGHTS = (10.0, 8.0, 1.0, 4.0, 2.0)
+DESCRIPTION_COLUMN = 2
+
+# markers FTS5 wraps around matches; swapped for <mark> after HTML escaping
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+MAX_RESULTS = 200
+
+_BOOK_ROW = """
+    SELECT b.id, b.title, coalesce(b.isbn, ''), coalesce(b.description, ''),
+           coalesce(a.name, ''), coalesce(c.name, '')
+    FROM book_book b
+    LEFT JOIN book_author a ON a.id = b.author_id
+    LEFT JOIN book_category c ON c.id = b.category_id
+"""
+
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        title, isbn, description, author, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS book_search_insert AFTER INSERT ON book_book BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, title, isbn, description, author, category)
+        {_BOOK_ROW} WHERE b.id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS book_search_update
+        AFTER UPDATE OF title, isbn, description, author_id, category_id ON book_book BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        INSERT INTO {SEARCH_TABLE}(rowid, title, isbn, description, author, category)
+        {_BOOK_ROW} WHERE b.id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS book_search_delete AFTER DELETE ON book_book BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS book_search_author_rename
+        AFTER UPDATE OF name ON book_author BEGIN
+        UPDATE {SEARCH_TABLE} SET author = new.name
+        WHERE rowid IN (SELECT id FROM book_book WHERE author_id = new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS book_search_category_rename
+        AFTER UPDATE OF name ON book_category BEGIN
+        UPDATE {SEARCH_TABLE} SET category = new.name
+        WHERE rowid IN (SELECT id FROM book_book WHERE category_id = new.id);
+    END""",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS book_search_category_rename',
+    'DROP TRIGGER IF EXISTS book_search_author_rename',
+    'DROP TRIGGER IF EXISTS book_search_delete',
+    'DROP TRIGGER IF EXISTS book_search_update',
+    'DROP TRIGGER IF EXISTS book_search_insert',
+    f'DROP TABLE IF EXISTS {SEARCH_TABLE}',
+]
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def build_match_query(text):
+    #turn free text into an FTS5 query: every word must match, the last one as a prefix
+    terms = _TERM_RE.findall(text or '')
+    if not terms:
+        return ''
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _highlight(text):
+    return escape(text).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def search_books(text, limit=MAX_RESULTS, using='default'):
+    """
+    Return [(book_id, rank, title_html, snippet_html)] best match first.
+    rank is the bm25() score, lower is better.
+    """
+    query = build_match_query(text)
+    if not query:
+        return []
+    weights = ', '.join(str(w) for w in COLUMN_WEIGHTS)
+    sql = f"""
+        SELECT rowid,
+               bm25({SEARCH_TABLE}, {weights}) AS rank,
+               highlight({SEARCH_TABLE}, 0, %s, %s),
+               snippet({SEARCH_TABLE}, {DESCRIPTION_COLUMN}, %s, %s, '…', 16)
+        FROM {SEARCH_TABLE}
+        WHERE {SEARCH_TABLE} MATCH %s
+        ORDER BY rank
+        LIMIT %s
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [MATCH_START, MATCH_END, MATCH_START, MATCH_END, query, limit])
+        rows = cursor.fetchall()
+    return [(pk, rank, _highlight(title), _highlight(snippet)) for pk, rank, title, snippet in rows]
+
+
+def rebuild_index():
+    #repopulate the whole index with one INSERT ... SELECT, then merge its b-trees
+    with connection.cursor() as cursor:
+        for statement in CREATE_SQL:
+            cursor.execute(statement)
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE}(rowid, title, isbn, description, author, category) {_BOOK_ROW}'
+        )
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def drop_index():
+    #remove the table and its triggers, e.g. before a bulk load that ends with rebuild_index()
+    with connection.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+def find_books(text, limit=MAX_RESULTS):
+    #ranked Book objects for a search box query, with search_title/search_snippet set
+    from django.db.models import Q
+    from django.utils.safestring import mark_safe
+
+    from .models import Book
+
+    books = Book.objects.select_related('author', 'category')
+    #the raw FTS query goes wherever the router sends the Book reads that follow it
+    using = router.db_for_read(Book)
+    if not is_supported(using):
+        terms = _TERM_RE.findall(text or '')
+        query = Q()
+        for term in terms:
+            query &= (Q(title__icontains=term) | Q(isbn__icontains=term)
+                      | Q(author__name__icontains=term) | Q(category__name__icontains=term))
+        return list(books.filter(query)[:limit]) if terms else []
+
+    hits = search_books(text, limit, using)
+    found = books.using(using).in_bulk([pk for pk, _, _, _ in hits])
+    results = []
+    for pk, rank, title_html, snippet_html in hits:
+        book = found.get(pk)
+        if book is None:
+            continue
+        book.search_rank = rank
+        book.search_title = mark_safe(title_html)
+        book.search_snippet = mark_safe(snippet_html)
+        results.append(book)
+    return results
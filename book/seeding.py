@@ -0,0 +1,213 @@
+import itertools
+import random
+from array import array
+from datetime import date, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import borrowers, fragments, replica, rollups, search
+from .bulk import chunked
+from .models import Author, Book, BorrowRecord, Category
+from .queryplans import analyze
+from .stats import recompute
+
+# -----------------------------
+# BENCHMARK DATA
+# -----------------------------
+# A synthetic library for performance work. The same seed and sizes always
+# produce the same rows (dates are offsets from the moment of seeding). Usage
+# is skewed the way a real library's is: authors, categories, books and
+# borrowers are each ranked by a Zipf law, so a few authors write most of the
+# books and a few bestsellers take most of the loans. The most popular books
+# are the ones currently out on loan.
+#
+# The small tables are written with bulk_create; books and borrow records, the
+# millions of rows, go through executemany() with values already in their
+# database form, which skips the ORM's per-field preparation (several times
+# faster). One transaction per batch. The search triggers are dropped during
+# the load and the index is rebuilt once at the end, then the stats counters,
+# borrower profiles, circulation rollups, fragment generations, planner
+# statistics and the read replica are refreshed, since none of this sends signals.
+
+USER_PREFIX = 'bench'
+
+#share of the books that are on loan right now, and of those, the share that is overdue
+OPEN_SHARE = 0.05
+OVERDUE_SHARE = 0.2
+LOAN_DAYS = 14
+HISTORY_DAYS = 3 * 365
+
+WORDS = (
+    'river night garden stone winter silent house shadow golden city empire storm letters '
+    'journey island daughter secret kingdom fire memory song forest wind ocean hunger road '
+    'mountain season glass lost last first broken hidden wild quiet long little great new '
+    'paradise harvest desert bridge crown mirror promise thread tide voice heart'
+).split()
+FIRST_NAMES = (
+    'Amina Chinua Ngozi Wole Yaa Ama Tsitsi Nuruddin Binyavanga Leila Maaza Teju Petina '
+    'Abdulrazak Imbolo Helon NoViolet Zukiswa Ayobami Jennifer Marlon Oyinkan Mia Akwaeke'
+).split()
+LAST_NAMES = (
+    'Achebe Adichie Soyinka Gyasi Aidoo Dangarembga Farah Wainaina Aboulela Mengiste Cole '
+    'Gappah Gurnah Mbue Habila Bulawayo Mda Adebayo Makumbi James Braithwaite Emezi Couto'
+).split()
+GENRES = (
+    'Fiction', 'History', 'Poetry', 'Science', 'Biography', 'Children', 'Travel', 'Philosophy',
+    'Drama', 'Crime', 'Romance', 'Fantasy', 'Politics', 'Religion', 'Art', 'Cooking',
+)
+
+
+class Zipf:
+    #draws ranks 0..n-1 with P(rank k) proportional to 1 / (k + 1) ** s
+    def __init__(self, n, s, rng):
+        self.ranks = range(n)
+        self.cum_weights = list(itertools.accumulate(1 / (k + 1) ** s for k in range(n)))
+        self.rng = rng
+
+    def sample(self, k):
+        return self.rng.choices(self.ranks, cum_weights=self.cum_weights, k=k)
+
+
+def _popularity(ids, rng):
+    #ids reordered by popularity: position 0 is the most popular row
+    ids = array('q', ids)
+    rng.shuffle(ids)
+    return ids
+
+
+def _insert(model, objects, batch_size):
+    #bulk_create in batches, one transaction each; returns the new primary keys
+    ids = array('q')
+    for chunk in chunked(objects, batch_size):
+        with transaction.atomic():
+            ids.extend(obj.pk for obj in model.objects.bulk_create(chunk))
+    return ids
+
+
+def _insert_rows(model, fields, rows, batch_size):
+    #executemany INSERT of tuples of database values for `fields`, returns the row count
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    sql = (f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+           f"VALUES ({', '.join(['%s'] * len(fields))})")
+    count = 0
+    for chunk in chunked(rows, batch_size):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, chunk)
+        count += len(chunk)
+    return count
+
+
+def _title(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+def seed_library(authors=1000, books=20_000, loans=200_000, users=500, categories=16,
+                 seed=1, batch_size=5000, log=lambda message: None):
+    """
+    Load a benchmark library into an empty catalog and return the row counts.
+    `log` receives a line of progress per table.
+    """
+    rng = random.Random(seed)
+    #datetimes are stored as naive UTC text, dates as ISO text
+    now = timezone.make_naive(timezone.now(), dt_timezone.utc).replace(microsecond=0)
+    today = now.date()
+
+    user_ids = _popularity(_insert(User, (
+        User(username=f'{USER_PREFIX}-{index}', password='!')
+        for index in range(users)
+    ), batch_size), rng)
+    log(f'{len(user_ids)} users')
+
+    category_ids = array('q', _insert(Category, (
+        Category(name=GENRES[index] if index < len(GENRES) else f'{GENRES[index % len(GENRES)]} {index}')
+        for index in range(categories)
+    ), batch_size))
+    log(f'{len(category_ids)} categories')
+
+    author_ids = _popularity(_insert(Author, (
+        Author(name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+               birth_date=date(1900, 1, 1) + timedelta(days=rng.randrange(36_500)))
+        for _ in range(authors)
+    ), batch_size), rng)
+    log(f'{len(author_ids)} authors')
+
+    #book numbers, most popular first; the top ones are the open loans
+    popular_books = _popularity(range(books), rng)
+    open_loans = min(int(books * OPEN_SHARE), loans)
+    on_loan = set(popular_books[:open_loans])
+    author_zipf = Zipf(len(author_ids), 0.9, rng)
+    category_zipf = Zipf(len(category_ids), 0.8, rng)
+
+    #explicit primary keys, so the new books' ids are known without reading them back
+    first_id = (Book.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    book_ids = array('q', range(first_id, first_id + books))
+    created = str(now)
+
+    def book_rows():
+        for numbers in chunked(range(books), batch_size):
+            author_ranks = author_zipf.sample(len(numbers))
+            category_ranks = category_zipf.sample(len(numbers))
+            for number, author_rank, category_rank in zip(numbers, author_ranks, category_ranks):
+                yield (
+                    book_ids[number], _title(rng), f'979{number:010d}',
+                    author_ids[author_rank], category_ids[category_rank],
+                    str(today - timedelta(days=int(rng.expovariate(1 / 7000)))), rng.randint(60, 900),
+                    'borrowed' if number in on_loan else 'available', created, created,
+                )
+
+    searchable = search.is_supported()
+    if searchable:
+        with transaction.atomic():
+            search.drop_index()
+    _insert_rows(Book, ['id', 'title', 'isbn', 'author', 'category', 'published_date', 'pages',
+                        'status', 'created_at', 'updated_at'], book_rows(), batch_size)
+    log(f'{len(book_ids)} books')
+
+    book_zipf = Zipf(len(book_ids), 0.8, rng)
+    borrower_zipf = Zipf(len(user_ids), 0.9, rng)
+
+    def loan_rows():
+        #the open loans first, then the returned ones spread over the last HISTORY_DAYS
+        for rank in range(open_loans):
+            borrowed_at = now - timedelta(seconds=rng.randrange(LOAN_DAYS * 86400))
+            if rng.random() < OVERDUE_SHARE:
+                borrowed_at -= timedelta(days=LOAN_DAYS)
+            borrowed = str(borrowed_at)
+            yield (
+                book_ids[popular_books[rank]], user_ids[borrower_zipf.sample(1)[0]],
+                borrowed, str(borrowed_at + timedelta(days=LOAN_DAYS)), None, False, borrowed, borrowed,
+            )
+        for numbers in chunked(range(loans - open_loans), batch_size):
+            book_ranks = book_zipf.sample(len(numbers))
+            borrower_ranks = borrower_zipf.sample(len(numbers))
+            for book_rank, borrower_rank in zip(book_ranks, borrower_ranks):
+                #returned at most a week late, and before today
+                borrowed = now - timedelta(days=LOAN_DAYS + 8, seconds=rng.randrange(HISTORY_DAYS * 86400))
+                returned = str(borrowed + timedelta(days=rng.randint(1, LOAN_DAYS + 7)))
+                yield (
+                    book_ids[popular_books[book_rank]], user_ids[borrower_rank],
+                    str(borrowed), str(borrowed + timedelta(days=LOAN_DAYS)), returned, True,
+                    str(borrowed), returned,
+                )
+
+    loan_count = _insert_rows(BorrowRecord, ['book', 'borrower', 'borrow_date', 'due_date', 'return_date',
+                                             'is_returned', 'created_at', 'updated_at'], loan_rows(), batch_size)
+    log(f'{loan_count} borrow records ({open_loans} open)')
+
+    if searchable:
+        log(f'{search.rebuild_index()} books indexed for search')
+    recompute()
+    log(f'{borrowers.recompute()} borrower profiles')
+    log(f'{rollups.rebuild()} circulation rollup rows')
+    fragments.invalidate(Book, Author, Category, BorrowRecord)
+    analyze()
+    if replica.sync():
+        log('replica synced')
+    return {
+        'users': len(user_ids), 'categories': len(category_ids), 'authors': len(author_ids),
+        'books': len(book_ids), 'loans': loan_count, 'open_loans': open_loans,
+    }
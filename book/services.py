@@ -0,0 +1,256 @@
+import logging
+import random
+import time
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import borrowers, fragments, holds, rollups, stats
+from .models import Book, BorrowRecord, Hold
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# CIRCULATION ENGINE
+# -----------------------------
+# Checkout and return each run as one short transaction built around a
+# conditional UPDATE (... WHERE status = 'available' / is_returned = 0), so two
+# clerks racing for the same copy can never both win: the database decides and
+# the loser sees zero rows updated. Book.status changes made here go through
+# QuerySet.update(), which sends no signals, so the stats counters and
+# circulation rollups are bumped and the cached fragments invalidated explicitly
+# inside the same transaction. A checkout also reads the borrower's profile
+# counters (see book.borrowers) once it holds the book, and backs out if the
+# borrower is at their loan limit or has too many overdue loans. A returned
+# copy goes to the next hold in line (book.holds) before it is released, and a
+# reserved copy can only be checked out by the holder it was put aside for.
+# return_loans() and release_books(), behind the admin's bulk actions, do the
+# same for many rows with set-based UPDATEs, a batch of rows per transaction.
+
+# SQLite allows one writer at a time; a transaction that loses the race for the
+# write lock fails with "database is locked" and is retried with backoff
+MAX_ATTEMPTS = 20
+BACKOFF_BASE = 0.005
+BACKOFF_MAX = 0.25
+
+#rows changed per transaction by the bulk operations (return_loans, release_books)
+BULK_BATCH = 500
+
+
+class CirculationError(Exception):
+    pass
+
+
+class BookUnavailable(CirculationError):
+    pass
+
+
+class LoanAlreadyClosed(CirculationError):
+    pass
+
+
+class LoanLimitReached(CirculationError):
+    pass
+
+
+class HoldError(CirculationError):
+    pass
+
+
+def _is_lock_error(exc):
+    message = str(exc).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def run_with_retry(operation, attempts=MAX_ATTEMPTS, using=None):
+    #run operation() in its own transaction, retrying when the database is locked
+    connection = transaction.get_connection(using)
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic(using=using):
+                return operation()
+        except OperationalError as exc:
+            #inside an outer transaction a retry can't start over, let the caller handle it
+            if not _is_lock_error(exc) or attempt == attempts or connection.in_atomic_block:
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+            logger.debug('database locked, retrying in %.3fs (attempt %d)', delay, attempt)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+def check_loan_limits(borrower_id):
+    #raise LoanLimitReached unless the borrower may take out another book; run inside the
+    #checkout transaction so the counters can't move between the check and the loan
+    profile = borrowers.get_profile(borrower_id, for_update=True)
+    limit = borrowers.loan_limit(profile)
+    if limit is not None and profile.active_loans >= limit:
+        raise LoanLimitReached(f'This borrower already has {profile.active_loans} books on loan, '
+                               f'the limit is {limit}.')
+    overdue_limit = borrowers.overdue_limit()
+    if overdue_limit is not None and profile.overdue_loans >= overdue_limit:
+        raise LoanLimitReached(f'This borrower has {profile.overdue_loans} overdue books to return first.')
+    return profile
+
+
+def checkout(book, borrower, due_date, notes=None, borrow_date=None):
+    #lend an available book, raising BookUnavailable if someone else got it first
+    book_id = getattr(book, 'pk', book)
+    borrower_id = getattr(borrower, 'pk', borrower)
+
+    def operation():
+        was = 'available'
+        claimed = Book.objects.filter(pk=book_id, status='available').update(
+            status='borrowed', updated_at=timezone.now())
+        if not claimed and holds.collect(book_id, borrower_id):
+            #a copy put aside for this borrower's hold
+            was = 'reserved'
+            claimed = Book.objects.filter(pk=book_id, status='reserved').update(
+                status='borrowed', updated_at=timezone.now())
+        if not claimed:
+            raise BookUnavailable('This book is no longer available.')
+        #read the clock only once the UPDATE holds the write lock, so loan periods
+        #of the same book are stamped in the order they were committed
+        now = timezone.now()
+        #the new loan bumps the profile counters through the post_save signal
+        check_loan_limits(borrower_id)
+        stats.status_changed(was, 'borrowed')
+        fragments.invalidate(Book)
+        #a Book instance saves the circulation rollups a lookup of its author and category
+        loan_book = {'book': book} if isinstance(book, Book) else {'book_id': book_id}
+        return BorrowRecord.objects.create(
+            **loan_book,
+            borrower_id=borrower_id,
+            borrow_date=borrow_date or now,
+            due_date=due_date,
+            notes=notes,
+        )
+
+    return run_with_retry(operation)
+
+
+def return_loan(record, return_date=None, notes=None):
+    #close an open loan and put its book back on the shelf
+    record_id = getattr(record, 'pk', record)
+
+    def operation():
+        loan = BorrowRecord.objects.filter(pk=record_id, is_returned=False)
+        closed = loan.update(is_returned=True, updated_at=timezone.now())
+        if not closed:
+            raise LoanAlreadyClosed('This book has already been returned.')
+        now = timezone.now()
+        changes = {'return_date': return_date or now}
+        if notes is not None:
+            changes['notes'] = notes
+        BorrowRecord.objects.filter(pk=record_id).update(**changes)
+        closed_loan = BorrowRecord.objects.filter(pk=record_id).values(
+            *rollups.LOAN_VALUES).get()
+        book_id = closed_loan['book_id']
+        #the copy goes to the next hold in line, or back on the shelf
+        stats.bump(active_loans=-1, **holds.hand_off([book_id], 'borrowed', now))
+        rollups.loan_changed(dict(closed_loan, is_returned=False, return_date=None), closed_loan)
+        borrowers.bump(closed_loan['borrower_id'], active_loans=-1,
+                       overdue_loans=-1 if closed_loan['overdue_since'] is not None else 0)
+        fragments.invalidate(Book, BorrowRecord)
+        return book_id
+
+    return run_with_retry(operation)
+
+
+def _batches(pks):
+    for start in range(0, len(pks), BULK_BATCH):
+        yield pks[start:start + BULK_BATCH]
+
+
+def return_loans(loans, return_date=None):
+    """
+    Close every open loan of a queryset, e.g. the admin's bulk return: what
+    return_loan() does for one loan, with set-based UPDATEs over a batch of
+    loans per transaction. Returns the number of loans closed.
+    """
+    def operation(pks):
+        now = timezone.now()
+        closed = BorrowRecord.objects.filter(pk__in=pks, is_returned=False).update(
+            is_returned=True, return_date=return_date or now, updated_at=now)
+        if not closed:
+            return 0
+        #the loans this UPDATE closed; one returned meanwhile by someone else has another updated_at
+        closed_loans = list(BorrowRecord.objects.filter(pk__in=pks, is_returned=True, updated_at=now)
+                            .values(*rollups.LOAN_VALUES))
+        book_ids = [loan['book_id'] for loan in closed_loans]
+        stats.bump(active_loans=-len(closed_loans), **holds.hand_off(book_ids, 'borrowed', now))
+        rollups.loans_returned(closed_loans)
+        borrowers.loans_returned(closed_loans)
+        fragments.invalidate(Book, BorrowRecord)
+        return len(closed_loans)
+
+    pks = list(loans.open().order_by().values_list('pk', flat=True))
+    return sum(run_with_retry(lambda: operation(batch)) for batch in _batches(pks))
+
+
+def release_books(books):
+    """
+    Put the books of a queryset that are marked borrowed or reserved, but have
+    no open loan and no copy set aside for a hold, back into circulation: each
+    goes to the next waiting hold, or on the shelf. Set-based UPDATEs over a
+    batch of books per transaction; returns the number of books released.
+    """
+    idle = (
+        Book.objects.exclude(status='available')
+        .exclude(Exists(BorrowRecord.objects.open().filter(book=OuterRef('pk'))))
+        .exclude(Exists(Hold.objects.filter(book=OuterRef('pk'), status=Hold.READY)))
+    )
+
+    def operation(pks):
+        #read again in the batch's transaction, a checkout since the first read leaves the book alone
+        released = list(idle.filter(pk__in=pks).values_list('pk', 'status'))
+        now = timezone.now()
+        for status in {status for _, status in released}:
+            stats.bump(**holds.hand_off([pk for pk, was in released if was == status], status, now))
+        if released:
+            fragments.invalidate(Book)
+        return len(released)
+
+    pks = list(idle.filter(pk__in=books.order_by().values('pk')).values_list('pk', flat=True))
+    return sum(run_with_retry(lambda: operation(batch)) for batch in _batches(pks))
+
+
+def place_hold(book, borrower):
+    #join the book's queue; raises HoldError when there is nothing to wait for
+    book_id = getattr(book, 'pk', book)
+    borrower_id = getattr(borrower, 'pk', borrower)
+
+    def operation():
+        try:
+            with transaction.atomic():
+                hold = Hold.objects.create(book_id=book_id, borrower_id=borrower_id)
+        except IntegrityError:
+            raise HoldError('You already have a hold on this book.')
+        #checked once the INSERT holds the write lock, so a copy returned meanwhile
+        #has either been handed to the queue or is seen as available here
+        if Book.objects.filter(pk=book_id, status='available').exists():
+            raise HoldError('This book is available, borrow it instead.')
+        if BorrowRecord.objects.open().filter(book_id=book_id, borrower_id=borrower_id).exists():
+            raise HoldError('You already have this book on loan.')
+        return hold
+
+    return run_with_retry(operation)
+
+
+def cancel_hold(hold):
+    #leave the queue; a copy that was put aside for the hold goes to the next in line
+    hold_id = getattr(hold, 'pk', hold)
+
+    def operation():
+        now = timezone.now()
+        hold = Hold.objects.filter(pk=hold_id, status__in=Hold.ACTIVE).values('book_id', 'status').first()
+        if hold is None or not Hold.objects.filter(pk=hold_id, status=hold['status']).update(
+                status=Hold.CANCELLED, closed_at=now):
+            raise HoldError('This hold is no longer active.')
+        if hold['status'] == Hold.READY:
+            deltas = holds.hand_off([hold['book_id']], 'reserved', now)
+            stats.bump(**deltas)
+            if deltas:
+                fragments.invalidate(Book)
+
+    return run_with_retry(operation)
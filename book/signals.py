@@ -0,0 +1,233 @@
+import threading
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import borrowers, covers, fragments, replica, rollups, stats
+from .models import (CIRCULATION_FIELDS, ArchivedBorrowRecord, Author, Book, BorrowerProfile, BorrowRecord,
+                     Category)
+from .routers import PRIMARY
+
+
+# -----------------------------
+# LIBRARY STATS COUNTERS
+# -----------------------------
+# The handlers run on the same connection as the save/delete that fired them,
+# so a write wrapped in transaction.atomic commits or rolls back with its counters.
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.bump(total_books=1, **stats.status_deltas(None, instance.status))
+    else:
+        old_status = getattr(instance, '_loaded_status', None)
+        if old_status is not None:
+            stats.status_changed(old_status, instance.status)
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    status = getattr(instance, '_loaded_status', None) or instance.status
+    stats.bump(total_books=-1, **stats.status_deltas(status, None))
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(total_authors=1)
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    stats.bump(total_authors=-1)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(total_categories=1)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    stats.bump(total_categories=-1)
+
+
+@receiver(post_save, sender=BorrowRecord)
+def borrow_record_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.bump(total_loans=1, active_loans=0 if instance.is_returned else 1)
+    else:
+        was_returned = getattr(instance, '_loaded_is_returned', None)
+        if was_returned is not None and was_returned != instance.is_returned:
+            stats.bump(active_loans=-1 if instance.is_returned else 1)
+    instance._loaded_is_returned = instance.is_returned
+
+
+@receiver(post_delete, sender=BorrowRecord)
+def borrow_record_deleted(sender, instance, **kwargs):
+    was_returned = getattr(instance, '_loaded_is_returned', None)
+    if was_returned is None:
+        was_returned = instance.is_returned
+    stats.bump(total_loans=-1, active_loans=0 if was_returned else -1)
+
+
+@receiver(post_delete, sender=ArchivedBorrowRecord)
+def archived_borrow_record_deleted(sender, instance, using=None, **kwargs):
+    #archived loans are history pages of BorrowRecord as far as the fragment cache goes
+    stats.bump(total_loans=-1)
+    fragments.invalidate(BorrowRecord, using=using)
+
+
+# -----------------------------
+# BORROWER PROFILES
+# -----------------------------
+# Same idea as the rollups below: a saved loan moves its borrower's counters from
+# the state it was loaded in (_loaded_circulation) to the saved one. Registered
+# before the rollups handler, which moves _loaded_circulation on to the new state.
+
+
+#ids of the books being deleted on this thread, whose loans were already counted out
+#of the borrower profiles and the rollups (see book_rollups_deleted)
+_deleting = threading.local()
+
+
+@receiver(post_save, sender=User)
+def user_profile_created(sender, instance, created, raw=False, using=None, **kwargs):
+    if created and not raw:
+        BorrowerProfile.objects.using(using).get_or_create(user=instance)
+
+
+@receiver(post_save, sender=BorrowRecord)
+def borrow_record_borrower(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    old = None if created else getattr(instance, '_loaded_circulation', None)
+    if created or old is not None:
+        new = {name: getattr(instance, name) for name in CIRCULATION_FIELDS}
+        borrowers.loan_changed(old, new, using)
+
+
+@receiver(pre_delete, sender=Book)
+def book_borrowers_deleted(sender, instance, using=None, **kwargs):
+    #archived loans are all returned, only the hot table holds counted loans
+    borrowers.loans_removed(BorrowRecord.objects.filter(book=instance), using)
+
+
+@receiver(post_delete, sender=BorrowRecord)
+def borrow_record_borrower_deleted(sender, instance, using=None, **kwargs):
+    if instance.book_id in getattr(_deleting, 'books', ()):
+        return
+    old = getattr(instance, '_loaded_circulation', None)
+    if old is None and not instance.get_deferred_fields():
+        old = {name: getattr(instance, name) for name in CIRCULATION_FIELDS}
+    if old is not None:
+        borrowers.loan_changed(old, None, using)
+
+
+# -----------------------------
+# CIRCULATION ROLLUPS
+# -----------------------------
+# A saved loan moves its daily counts from the state it was loaded in to the
+# saved one; a loan saved without all of CIRCULATION_FIELDS loaded is skipped.
+# A deleted loan's counts are taken out again.
+
+@receiver(post_save, sender=BorrowRecord)
+def borrow_record_rollups(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    old = None if created else getattr(instance, '_loaded_circulation', None)
+    if created or old is not None:
+        new = rollups.loan_state(instance)
+        rollups.loan_changed(old, new, using)
+        instance._loaded_circulation = new
+
+
+@receiver(pre_delete, sender=Book)
+def book_rollups_deleted(sender, instance, using=None, **kwargs):
+    #a deleted book takes its loans along; count them out in one pass instead of one by one
+    rollups.loans_removed(BorrowRecord.objects.filter(book=instance), using)
+    rollups.loans_removed(ArchivedBorrowRecord.objects.filter(book=instance), using)
+    if not hasattr(_deleting, 'books'):
+        _deleting.books = set()
+    _deleting.books.add(instance.pk)
+
+
+@receiver(post_delete, sender=Book)
+def book_rollups_done(sender, instance, **kwargs):
+    getattr(_deleting, 'books', set()).discard(instance.pk)
+
+
+@receiver(post_delete, sender=BorrowRecord)
+@receiver(post_delete, sender=ArchivedBorrowRecord)
+def borrow_record_rollups_deleted(sender, instance, using=None, **kwargs):
+    if instance.book_id in getattr(_deleting, 'books', ()):
+        return
+    old = getattr(instance, '_loaded_circulation', None)
+    if old is None and not instance.get_deferred_fields():
+        old = rollups.loan_state(instance)
+    if old is not None:
+        rollups.loan_changed(old, None, using)
+
+
+# -----------------------------
+# COVER IMAGES
+# -----------------------------
+# A fresh upload is written under its content hash before the row is saved, so
+# ImageField's own upload is skipped; the derivatives are rendered off-thread
+# once the save commits.
+
+@receiver(pre_save, sender=Book)
+def book_cover_store(sender, instance, raw=False, **kwargs):
+    cover = instance.cover_image
+    if raw or not cover or cover._committed:
+        return
+    cover.name = covers.store_original(cover.file, cover.storage)
+    cover._committed = True
+
+
+@receiver(post_save, sender=Book)
+def book_cover_schedule(sender, instance, raw=False, using=None, **kwargs):
+    name = instance.cover_image.name or None
+    if raw or name == getattr(instance, '_loaded_cover', None):
+        return
+    covers.schedule(name, using=using)
+    instance._loaded_cover = name
+
+
+# -----------------------------
+# FRAGMENT CACHE
+# -----------------------------
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=BorrowRecord)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=BorrowRecord)
+@receiver(post_delete, sender=User)
+def invalidate_fragments(sender, raw=False, using=None, **kwargs):
+    if not raw:
+        fragments.invalidate(sender, using=using)
+
+
+# -----------------------------
+# READ REPLICA
+# -----------------------------
+# migrate only touches the primary, so the replica is refreshed right after it
+# and never serves a schema older than the code. 'book' is the last installed
+# app, so every other app's post_migrate rows are in the copy too.
+
+@receiver(post_migrate)
+def replica_after_migrate(sender, using='default', **kwargs):
+    if sender.name == 'book' and using == PRIMARY:
+        replica.sync()
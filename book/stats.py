@@ -0,0 +1,115 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import ArchivedBorrowRecord, Author, Book, BorrowRecord, Category, LibraryStats
+
+# the dashboard reads this single row instead of counting every table
+STATS_PK = 1
+
+# which counter holds the books of each Book.status value
+STATUS_COUNTERS = {
+    'available': 'available_books',
+    'borrowed': 'borrowed_books',
+    'reserved': 'reserved_books',
+}
+
+
+def get_stats():
+    #one primary key lookup, the row is created by the migration or recompute()
+    stats = LibraryStats.objects.filter(pk=STATS_PK).first()
+    if stats is None:
+        stats = recompute()
+    return stats
+
+
+async def aget_stats():
+    #get_stats() for async views
+    stats = await LibraryStats.objects.filter(pk=STATS_PK).afirst()
+    if stats is None:
+        stats = await sync_to_async(recompute)()
+    return stats
+
+
+_pending = threading.local()
+
+
+@contextmanager
+def batched():
+    #collect every bump() made inside the block and apply them as one UPDATE at the end,
+    #e.g. around a delete that cascades to thousands of borrow records
+    outer = getattr(_pending, 'deltas', None)
+    if outer is not None:
+        yield
+        return
+    _pending.deltas = Counter()
+    try:
+        yield
+        deltas = dict(_pending.deltas)
+    finally:
+        _pending.deltas = None
+    bump(**deltas)
+
+
+def bump(**deltas):
+    #add the given deltas to the counters with a single UPDATE ... SET x = x + n
+    pending = getattr(_pending, 'deltas', None)
+    if pending is not None:
+        pending.update(deltas)
+        return
+    changes = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    if not changes:
+        return
+    updated = LibraryStats.objects.filter(pk=STATS_PK).update(updated_at=timezone.now(), **changes)
+    if not updated:
+        #the row is missing (e.g. a flushed database), rebuild it from the tables
+        recompute()
+
+
+def status_deltas(old_status, new_status, count=1):
+    #counter deltas for `count` books moving from one status to another
+    deltas = {}
+    if old_status in STATUS_COUNTERS:
+        deltas[STATUS_COUNTERS[old_status]] = -count
+    if new_status in STATUS_COUNTERS:
+        key = STATUS_COUNTERS[new_status]
+        deltas[key] = deltas.get(key, 0) + count
+    return deltas
+
+
+def status_changed(old_status, new_status, count=1):
+    if old_status != new_status:
+        bump(**status_deltas(old_status, new_status, count))
+
+
+@transaction.atomic
+def recompute():
+    #rebuild every counter from scratch, used by the recompute_stats command
+    books = Book.objects.aggregate(
+        total_books=Count('pk'),
+        **{
+            counter: Count('pk', filter=Q(status=status))
+            for status, counter in STATUS_COUNTERS.items()
+        },
+    )
+    loans = BorrowRecord.objects.aggregate(
+        total_loans=Count('pk'),
+        active_loans=Count('pk', filter=Q(is_returned=False)),
+    )
+    #archived loans are all returned but still count towards the total
+    loans['total_loans'] += ArchivedBorrowRecord.objects.count()
+    stats, _ = LibraryStats.objects.update_or_create(
+        pk=STATS_PK,
+        defaults={
+            **books,
+            **loans,
+            'total_authors': Author.objects.count(),
+            'total_categories': Category.objects.count(),
+        },
+    )
+    return stats
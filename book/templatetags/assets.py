@@ -0,0 +1,11 @@
+from django import template
+
+from book import assets
+
+register = template.Library()
+
+
+@register.simple_tag
+def vendor_url(name):
+    #URL of a third-party file listed in book.assets.VENDOR, served locally once vendored
+    return assets.vendor_url(name)
@@ -0,0 +1,29 @@
+from django import template
+
+from book import covers
+
+register = template.Library()
+
+
+@register.simple_tag
+def cover_url(book, size='thumb'):
+    #URL of the cover derivative for `size` ('thumb' or 'medium'), '' without a cover
+    if not book.cover_image:
+        return ''
+    return covers.derivative_url(book.cover_image.name, size, book.cover_image.storage)
+
+
+@register.simple_tag
+def cover_srcset(book):
+    #srcset listing every rendered size by its real width, for <img sizes="..."> to choose from;
+    #sizes not rendered yet are left out (src falls back to the original) and a small original
+    #that fits several boxes is listed once
+    if not book.cover_image:
+        return ''
+    name, storage = book.cover_image.name, book.cover_image.storage
+    candidates = {}
+    for size in covers.SIZES:
+        width = covers.derivative_width(name, size, storage)
+        if width is not None and width not in candidates:
+            candidates[width] = storage.url(covers.derivative_name(name, size))
+    return ', '.join(f'{url} {width}w' for width, url in candidates.items())
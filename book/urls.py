@@ -1,26 +1,35 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# under ASGI the read-heavy pages are served by their native async versions
+reads = async_views if settings.ASYNC_READ_VIEWS else views
 
 app_name = 'book'
 
 urlpatterns = [
     # dashboard
-    path('start/', views.dashboard, name='dashboard'),
+    path('start/', reads.dashboard, name='dashboard'),
 
     # Books
-    path('books/', views.book_list, name='book_list'),
+    path('books/', reads.book_list, name='book_list'),
     path('books/add/', views.book_create, name='book_create'),
     path('books/edit/<int:pk>', views.book_update, name='book_update'),
-    path('books/<int:pk>', views.book_detail, name='book_detail'),
+    path('books/<int:pk>', reads.book_detail, name='book_detail'),
+    path('books/delete/<int:pk>', views.book_delete, name='book_delete'),
+    path('books/available/', views.available_books, name='available_books'),
+    path('books/shelf/', views.book_shelf, name='book_shelf'),
     # Authors
-    path('authors/', views.author_list, name='author_list'),
+    path('authors/', reads.author_list, name='author_list'),
     path('authors/add/', views.author_create, name='author_create'),
+    path('authors/<int:pk>/', reads.author_detail, name='author_detail'),
     path('authors/<int:pk>/edit/', views.author_update, name='author_update'),
 
 
     # Categories
-    path('categories/', views.category_list, name='category_list'),
+    path('categories/', reads.category_list, name='category_list'),
     path('categories/add/', views.category_create, name='category_create'),
+    path('categories/<int:pk>/', reads.category_detail, name='category_detail'),
     path('categories/<int:pk>/edit/', views.category_update, name='category_update'),
     # Borrow Records
     path('borrow/', views.borrow_list, name='borrow_list'),
@@ -28,6 +37,25 @@ urlpatterns = [
     # Return URLs
     path('return/', views.return_list, name='return_list'),
     path('return/<int:pk>/', views.return_book, name='return_book'),
+    path('return/overdue/', views.overdue_list, name='overdue_list'),
+    path('loans/mine/', views.my_loans, name='my_loans'),
+    # Holds
+    path('holds/place/<int:pk>/', views.hold_place, name='hold_place'),
+    path('holds/<int:pk>/cancel/', views.hold_cancel, name='hold_cancel'),
+    # Reports
+    path('reports/circulation/', views.circulation_report, name='circulation_report'),
+    # Form pickers
+    path('autocomplete/<slug:source>/', views.autocomplete_lookup, name='autocomplete'),
+    # Exports
+    path('export/books/', views.export_books, name='export_books'),
+    path('export/borrows/', views.export_borrows, name='export_borrows'),
+    # JSON API
+    path('api/books/', views.api_books, name='api_books'),
+    path('api/authors/', views.api_authors, name='api_authors'),
+    path('api/categories/', views.api_categories, name='api_categories'),
+    path('api/loans/', views.api_loans, name='api_loans'),
+    # Live timings (staff)
+    path('perf/', views.perf_stats, name='perf_stats'),
 ]
 
 
@@ -1,70 +1,63 @@
+import functools
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.shortcuts import render, get_list_or_404, get_object_or_404, redirect
 from django.contrib import messages
 from django.utils import timezone
-from .models import Book, Author, Category, BorrowRecord
+from .models import ArchivedBorrowRecord, Book, Author, Category, BorrowRecord, Hold
 from .forms import BookForm, AuthorForm, CategoryForm, BorrowForm, ReturnForm
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
 from django.urls import reverse_lazy
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.utils.decorators import method_decorator
+from django.db import transaction
+from .stats import batched, get_stats
+from .services import (
+    BookUnavailable, HoldError, LoanAlreadyClosed, LoanLimitReached, cancel_hold, checkout, place_hold, return_loan,
+)
+from .search import find_books
+from .pagination import paginate, paginate_merged
+from .querybudget import query_budget
+from .fragments import cached_fragment
+from .conditional import conditional_page
+from . import api, archive, autocomplete, borrowers, fragments, profiling, rollups
+from django.db.models import Prefetch, Value
+from datetime import timedelta
+from django.core.exceptions import BadRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from .export import FORMATS, export_filename, parse_day, stream_export
 
 
 
 # Dashboard view
 @login_required
+@query_budget(3)
 def dashboard(request):
     # Dashboard view that will show all the liblary statistics
-
-
-    return render(request, 'dashboard.html')
-
-# -----------------------------
-# BOOK VIEWS
-# -----------------------------
-def book_list(request):
-    search_query = request.GET.get('search', '')
-    books = Book.objects.all()
-    if search_query:
-        books = books.filter(title__icontains=search_query)
+    # the totals come from the counters row kept up to date by book.signals
+    stats = get_stats()
+    recent_activity = BorrowRecord.objects.select_related('book', 'borrower')[:10]
+    categories = Category.objects.with_book_counts()[:10]
 
     context = {
-        'books': books,
-        'request': request,
+        'total_books': stats.total_books,
+        'available_books': stats.available_books,
+        'borrowed_books': stats.borrowed_books,
+        'total_authors': stats.total_authors,
+        'total_categories': stats.total_categories,
+        'recent_activity': recent_activity,
+        'categories': categories,
     }
-    return render(request, 'book.html', context)
-
-def book_create(request):
-    form = BookForm(request.POST or None, request.FILES or None)
-    context = {'form': form, 'title': 'Add New'}
-    if form.is_valid():
-        form.save()
-        messages.success(request, "Book created successfully.")
-        return redirect('book:book_list')
-    return render(request, 'book_form.html', context)
-
-def book_update(request, pk):
-    book = get_object_or_404(Book, pk=pk)
-    form = BookForm(request.POST or None, request.FILES or None, instance=book)
-    if form.is_valid():
-        form.save()
-        messages.success(request, "Book updated successfully.")
-        return redirect('book:book_list')
-    return render(request, 'book_form.html', {'form': form, 'title': 'Edit'})
-
-def book_detail(request, pk):
-    book = get_object_or_404(Book, pk=pk)
-    context =  {'book': book}
-    return render(request, 'book_detail.html',context)
+    return render(request, 'dashboard.html', context)
 
 # -----------------------------
 # AUTHOR VIEWS
 # -----------------------------
-def author_list(request):
-    authors = Author.objects.all()
-    context = {'authors': authors}
-    return render(request, 'author_list.html', context)
-
+@transaction.atomic
+@query_budget(3)
 def author_create(request):
     form = AuthorForm(request.POST or None)
     if form.is_valid():
@@ -73,6 +66,8 @@ def author_create(request):
         return redirect('book:author_list')
     return render(request, 'author_form.html', {'form': form, 'title': 'Add Author'})
 
+@transaction.atomic
+@query_budget(4)
 def author_update(request, pk):
     author = get_object_or_404(Author, pk=pk)
     form = AuthorForm(request.POST , instance=author)
@@ -85,11 +80,8 @@ def author_update(request, pk):
 # -----------------------------
 # CATEGORY VIEWS
 # -----------------------------
-def category_list(request):
-    categories = Category.objects.all()
-    context = {'categories': categories}
-    return render(request, 'category_list.html', context)
-
+@transaction.atomic
+@query_budget(4)
 def category_create(request):
     form = CategoryForm(request.POST or None)
     if form.is_valid():
@@ -98,6 +90,8 @@ def category_create(request):
         return redirect('book:category_list')
     return render(request, 'category_form.html', {'form': form, 'title': 'Add Category'})
 
+@transaction.atomic
+@query_budget(4)
 def category_update(request, pk):
     category = get_object_or_404(Category, pk=pk)
     form = CategoryForm(request.POST, instance=category)
@@ -111,17 +105,23 @@ def category_update(request, pk):
 # -----------------------------
 # BORROW VIEWS
 # -----------------------------
+@query_budget(4)
 def borrow_list(request):
-    available_books = Book.objects.filter(status='available')
-    borrowed_records = BorrowRecord.objects.filter(is_returned=False)
+    # two independently paged lists, each with its own cursor parameter
+    available_books = paginate(
+        request, Book.objects.filter(status='available').select_related('author', 'category'))
+    borrowed_records = paginate(
+        request, BorrowRecord.objects.filter(is_returned=False).select_related('book', 'borrower'),
+        cursor_param='loans_cursor')
 
     context = {
         'available_books': available_books,
         'borrowed_records': borrowed_records,
         'request': request,
     }
-    return render(request, 'borrow_list.html', context)
+    return render(request, 'borrow.html', context)
 
+@query_budget(14)
 def borrow_create(request):
     book_id = request.GET.get('book')
     initial = {}
@@ -129,11 +129,7 @@ def borrow_create(request):
         initial['book'] = get_object_or_404(Book, pk=book_id)
 
     form = BorrowForm(request.POST or None, initial=initial)
-    if form.is_valid():
-        borrow = form.save(commit=False)
-        borrow.save()
-        borrow.book.status = 'borrowed'
-        borrow.book.save()
+    if form.is_valid() and _checkout(form):
         messages.success(request, "Book borrowed successfully.")
         return redirect('book:borrow_list')
     return render(request, 'borrow_form.html', {'form': form, 'title': 'Borrow Book'})
@@ -141,15 +137,23 @@ def borrow_create(request):
 # -----------------------------
 # RETURN VIEWS
 # -----------------------------
+@query_budget(9)
 def return_list(request):
-    returned_records = BorrowRecord.objects.filter(is_returned=True).order_by('-return_date')
-    unreturned_records = BorrowRecord.objects.filter(is_returned=False)
-    currently_borrowed_count = BorrowRecord.objects.filter(is_returned=False).count()
-    overdue_count = BorrowRecord.objects.filter(is_returned=False, due_date__lt=timezone.now()).count()
-    returned_this_month = BorrowRecord.objects.filter(
-        is_returned=True,
-        return_date__month=timezone.now().month
-    ).count()
+    # the history carries on into the archive table once a page goes back past its newest return
+    archived = ArchivedBorrowRecord.objects.select_related('book', 'borrower')
+    returned_records = paginate_merged(
+        request,
+        BorrowRecord.objects.filter(is_returned=True).select_related('book', 'borrower'),
+        [(archived, archive.newest('return_date'))],
+        ordering=['-return_date'],
+    )
+    unreturned_records = BorrowRecord.objects.filter(is_returned=False).select_related('book', 'borrower')[:5]
+    # both counts are served by the partial index over open loans
+    currently_borrowed_count = BorrowRecord.objects.open().count()
+    overdue_count = BorrowRecord.objects.overdue().count()
+    # summed from at most 31 rows of the daily circulation rollups
+    today = timezone.localdate()
+    returned_this_month = rollups.totals(today.replace(day=1), today)['returns']
 
     context = {
         'returned_records': returned_records,
@@ -158,45 +162,139 @@ def return_list(request):
         'overdue_count': overdue_count,
         'returned_this_month': returned_this_month,
     }
-    return render(request, 'return_list.html', context)
+    return render(request, 'return.html', context)
 
-def return_book(request, pk):
-    record = get_object_or_404(BorrowRecord, pk=pk)
-    if request.method == 'POST':
-        record.is_returned = True
-        record.return_date = timezone.now()
-        record.save()
-        record.book.status = 'available'
-        record.book.save()
-        messages.success(request, "Book returned successfully.")
-        return redirect('book:return_list')
-    return render(request, 'return_confirm.html', {'record': record})
+@login_required
+@query_budget(1)
+def overdue_list(request):
+    # most overdue first, walking the (due_date, id) partial index of open loans
+    overdue_records = paginate(request, BorrowRecord.objects.overdue().select_related('book', 'borrower'))
+    context = {'overdue_records': overdue_records, 'now': timezone.now(), 'title': 'Overdue Loans'}
+    return render(request, 'overdue.html', context)
 
+@login_required
+@query_budget(5)
+def my_loans(request):
+    # the signed-in user's open loans, next due first, or with ?show=returned their returned ones,
+    # latest due first; both walk the (borrower, is_returned, due_date, id) index. is_returned is
+    # compared with = as a Value, a bare "NOT is_returned" can't seek on the index column
+    returned = request.GET.get('show') == 'returned'
+    loans = BorrowRecord.objects.filter(borrower=request.user, is_returned=Value(returned)).select_related('book__author')
+    if returned:
+        # the returned loans carry on into the archive, along its (borrower, due_date, id) index
+        archived = ArchivedBorrowRecord.objects.filter(borrower=request.user).select_related('book__author')
+        newest = archive.newest('due_date', borrower=request.user)
+        loans = paginate_merged(request, loans, [(archived, newest)], ordering=['-due_date'])
+    else:
+        loans = paginate(request, loans, ordering=['due_date'])
+    profile = borrowers.get_profile(request.user.pk)
+    # waiting and ready holds with their queue positions, counted in the same query
+    holds = list(Hold.objects.filter(borrower=request.user, status__in=Hold.ACTIVE)
+                 .select_related('book').with_positions())
+    context = {
+        'loans': loans,
+        'holds': holds,
+        'returned': returned,
+        'profile': profile,
+        'loan_limit': borrowers.loan_limit(profile),
+        'now': timezone.now(),
+        'title': 'My Loans',
+    }
+    return render(request, 'my_loans.html', context)
 
-# ------------------ Book Views ------------------
 @login_required
+@query_budget(10)
+def circulation_report(request):
+    # loans, returns and overdue loans over ?period=month|quarter|year holding ?date=YYYY-MM-DD
+    # (default today), all read from the daily circulation rollups
+    period = request.GET.get('period', 'month')
+    if period not in rollups.PERIODS:
+        raise BadRequest(f"Unknown report period {period!r}.")
+    try:
+        day = parse_day(request.GET.get('date')) or timezone.localdate()
+    except ValueError:
+        raise BadRequest("Dates must be given as YYYY-MM-DD.")
+    start, end = rollups.period_bounds(period, day)
 
+    context = {
+        'title': 'Circulation Report',
+        'period': period,
+        'periods': rollups.PERIODS,
+        'day': day,
+        'start': start,
+        'end': end,
+        'previous': start - timedelta(days=1),
+        'next': end + timedelta(days=1),
+        'totals': rollups.totals(start, end),
+        'series': rollups.series(start, end, by='day' if period == 'month' else 'month'),
+        'top_lists': [
+            ('Most Borrowed Books', rollups.leaders('book', period, day)),
+            ('Most Borrowed Authors', rollups.leaders('author', period, day)),
+            ('Busiest Categories', rollups.leaders('category', period, day)),
+            ('Most Active Borrowers', rollups.leaders('borrower', period, day)),
+        ],
+    }
+    return render(request, 'circulation_report.html', context)
+
+# ------------------ Book Views ------------------
+@login_required
+@conditional_page(Book, Author, Category)
+@query_budget(2)
 def book_list(request):
-    books = get_list_or_404(Book.objects.all())  # List view using get_list_or_404
-    return render(request, 'book_list.html', {'books': books, 'title': 'Books'})
+    search_query = request.GET.get('search', '').strip()
+
+    def get_context():
+        if search_query:
+            # ranked full-text search over title, isbn, description, author and category
+            books = find_books(search_query)
+        else:
+            books = paginate(request, Book.objects.select_related('author', 'category'))
+        return {'books': books, 'search_query': search_query}
+
+    # the table is served from the fragment cache until a book, author or category changes
+    table = cached_fragment(request, 'book_list', [Book, Author, Category], 'book_list_table.html', get_context)
+    context = {'table': table, 'title': 'Books', 'search_query': search_query}
+    return render(request, 'book_list.html', context)
 
 @login_required
+@query_budget(1)
 def available_books(request):
-    book = get_list_or_404(Book.objects.all())
+    book = paginate(request, Book.objects.filter(status='available').select_related('author', 'category'))
     return render(request, 'available_books.html', {'available_books':book, 'title': 'Available Books' })
 
 
+# books shown per category on the shelf page, the rest are on the category page
+SHELF_SIZE = 8
 
 @login_required
+@query_budget(2)
+def book_shelf(request):
+    # one query for the page of categories (with counts) and one for all their shelves:
+    # the sliced Prefetch becomes a single ROW_NUMBER() OVER (PARTITION BY category) query
+    shelf_books = Book.objects.select_related('author').order_by('title', 'pk')[:SHELF_SIZE]
+    categories = paginate(
+        request,
+        Category.objects.with_book_counts().prefetch_related(
+            Prefetch('books', queryset=shelf_books, to_attr='shelf_books')
+        ),
+        per_page=10,
+    )
+    return render(request, 'book.html', {'categories': categories, 'title': 'Shelves'})
+
+
 
+@login_required
+@conditional_page(Book, Author, Category)
+@query_budget(1)
 def book_detail(request, pk):
-    book = get_object_or_404(Book, pk=pk)  # Single book
+    book = get_object_or_404(Book.objects.select_related('author', 'category'), pk=pk)  # Single book
 
-    return render(request, 'base.html', {'book': book, 'title': book.title})
+    return render(request, 'book_detail.html', {'book': book, 'title': book.title})
 
 
 @login_required
-
+@transaction.atomic
+@query_budget(7)
 def book_create(request):
     if request.method == 'POST':
         form = BookForm(request.POST, request.FILES)
@@ -210,6 +308,8 @@ def book_create(request):
 
 
 @login_required
+@transaction.atomic
+@query_budget(7)
 def book_update(request, pk):
     book = get_object_or_404(Book, pk=pk)
     if request.method == 'POST':
@@ -224,51 +324,78 @@ def book_update(request, pk):
 
 
 @login_required
+@transaction.atomic
+@query_budget(14)
 def book_delete(request, pk):
     book = get_object_or_404(Book, pk=pk)
     if request.method == 'POST':
-        book.delete()
+        # the cascade sends a post_delete per borrow record, fold their counter and generation updates together
+        with batched(), fragments.batched():
+            book.delete()
         messages.success(request, "Book deleted successfully!")
         return redirect('book:book_list')
-    return render(request, 'return.html', {'book': book, 'title': 'Delete Book'})
+    return render(request, 'book_confirm_delete.html', {'book': book, 'title': 'Delete Book'})
 
 
 # ------------------ Author Views ------------------
 @login_required
+@conditional_page(Author)
+@query_budget(1)
 def author_list(request):
-    authors = get_list_or_404(Author.objects.all())
-    return render(request, 'author_list.html', {'authors': authors, 'title': 'Authors'})
+    table = cached_fragment(request, 'author_list', [Author], 'author_table.html',
+                            lambda: {'authors': paginate(request, Author.objects.all())})
+    return render(request, 'author_list.html', {'table': table, 'title': 'Authors'})
 
 
 @login_required
+@conditional_page(Author, Book, Category)
+@query_budget(2)
 def author_detail(request, pk):
     author = get_object_or_404(Author, pk=pk)
-    return render(request, 'author_detail.html', {'author': author, 'title': author.name})
+    books = paginate(request, author.books.select_related('category'))
+    return render(request, 'author_detail.html', {'author': author, 'books': books, 'title': author.name})
 
 
 # ------------------ Category Views ------------------
 @login_required
+@conditional_page(Category, Book)
+@query_budget(1)
 def category_list(request):
-    categories = get_list_or_404(Category.objects.all())
-    return render(request, 'category_list.html', {'categories': categories, 'title': 'Categories'})
+    # the book counts change with the books, so both generations are part of the key
+    table = cached_fragment(request, 'category_list', [Category, Book], 'category_table.html',
+                            lambda: {'categories': paginate(request, Category.objects.with_book_counts())})
+    return render(request, 'category_list.html', {'table': table, 'title': 'Categories'})
 
 
 @login_required
+@conditional_page(Category, Book, Author)
+@query_budget(2)
 def category_detail(request, pk):
     category = get_object_or_404(Category, pk=pk)
-    return render(request, 'category_detail.html', {'category': category, 'title': category.name})
+    books = paginate(request, category.books.select_related('author'))
+    return render(request, 'category_detail.html', {'category': category, 'books': books, 'title': category.name})
 
 
 # ------------------ Borrow Views ------------------
+def _checkout(form):
+    # lend the book through the circulation engine, a lost race or a borrower at their limit
+    # becomes a form error
+    data = form.cleaned_data
+    try:
+        return checkout(data['book'], data['borrower'], data['due_date'], data.get('notes'))
+    except BookUnavailable as exc:
+        form.add_error('book', str(exc))
+    except LoanLimitReached as exc:
+        form.add_error('borrower', str(exc))
+    return None
+
+
 @login_required
+@query_budget(13)
 def borrow_book(request):
     if request.method == 'POST':
         form = BorrowForm(request.POST)
-        if form.is_valid():
-            borrow_record = form.save(commit=False)
-            borrow_record.book.status = 'borrowed'
-            borrow_record.book.save()
-            borrow_record.save()
+        if form.is_valid() and _checkout(form):
             messages.success(request, "Book borrowed successfully!")
             return redirect('book:dashboard')
     else:
@@ -277,20 +404,161 @@ def borrow_book(request):
 
 
 @login_required
+@query_budget(12)
 def return_book(request, pk):
     borrow_record = get_object_or_404(BorrowRecord, pk=pk)
     if request.method == 'POST':
         form = ReturnForm(request.POST, instance=borrow_record)
         if form.is_valid():
-            borrow_record = form.save(commit=False)
-            borrow_record.is_returned = True
-            borrow_record.book.status = 'available'
-            borrow_record.book.save()
-            borrow_record.save()
-            messages.success(request, "Book returned successfully!")
+            try:
+                return_loan(borrow_record, form.cleaned_data['return_date'], form.cleaned_data['notes'])
+            except LoanAlreadyClosed as exc:
+                messages.warning(request, str(exc))
+            else:
+                messages.success(request, "Book returned successfully!")
             return redirect('book:dashboard')
     else:
         form = ReturnForm(instance=borrow_record)
     return render(request, 'return_form.html', {'form': form, 'title': 'Return Book'})
 
 
+# ------------------ Hold Views ------------------
+@login_required
+@require_POST
+@query_budget(5)
+def hold_place(request, pk):
+    # join the queue for a book that is out, instead of retrying the borrow page
+    book = get_object_or_404(Book, pk=pk)
+    try:
+        place_hold(book, request.user)
+    except HoldError as exc:
+        messages.warning(request, str(exc))
+        return redirect('book:book_detail', pk=book.pk)
+    messages.success(request, f"You are on the waiting list for {book.title}.")
+    return redirect('book:my_loans')
+
+
+@login_required
+@require_POST
+@query_budget(7)
+def hold_cancel(request, pk):
+    hold = get_object_or_404(Hold, pk=pk, borrower=request.user)
+    try:
+        cancel_hold(hold)
+    except HoldError as exc:
+        messages.warning(request, str(exc))
+    else:
+        messages.success(request, "Hold cancelled.")
+    return redirect('book:my_loans')
+
+
+# ------------------ Autocomplete ------------------
+@login_required
+@query_budget(3)
+def autocomplete_lookup(request, source):
+    # ?q= prefix matches for the form pickers, from the cache or one index range scan
+    # (two for books when q looks like an ISBN prefix)
+    if source not in autocomplete.SOURCES:
+        raise Http404("Unknown autocomplete source.")
+    response = JsonResponse({'results': autocomplete.suggest(source, request.GET.get('q'))})
+    patch_cache_control(response, private=True, max_age=autocomplete.CACHE_SECONDS)
+    return response
+
+
+# ------------------ Export Views ------------------
+def _export(request, kind):
+    # ?format=csv|jsonl, ?gzip=1 and, for borrows, ?start= / ?end= days (YYYY-MM-DD)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise BadRequest(f"Unknown export format {fmt!r}.")
+    compress = request.GET.get('gzip') in ('1', 'true', 'yes')
+    try:
+        start = parse_day(request.GET.get('start'))
+        end = parse_day(request.GET.get('end'))
+    except ValueError:
+        raise BadRequest("Dates must be given as YYYY-MM-DD.")
+
+    response = StreamingHttpResponse(
+        stream_export(kind, fmt, compress, start, end),
+        content_type='application/gzip' if compress else f'{FORMATS[fmt]}; charset=utf-8',
+    )
+    filename = export_filename(kind, fmt, compress, start, end)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# the rows are read while the response streams, after the view has returned; staff only,
+# the borrows carry every borrower's loan history
+@staff_member_required
+@query_budget(0)
+def export_books(request):
+    return _export(request, 'books')
+
+
+@staff_member_required
+@query_budget(0)
+def export_borrows(request):
+    return _export(request, 'borrows')
+
+
+# ------------------ API Views ------------------
+def api_login_required(view):
+    # a JSON 401 instead of the login redirect, checked before conditional_page so the
+    # refusal neither carries an ETag nor can be answered with a 304
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required.'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _api(request, name):
+    # JSON errors instead of the HTML error pages
+    try:
+        return JsonResponse(api.page(request, name))
+    except BadRequest as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+
+@api_login_required
+@conditional_page(Book, Author, Category)
+@query_budget(1)
+def api_books(request):
+    return _api(request, 'books')
+
+
+@api_login_required
+@conditional_page(Author)
+@query_budget(1)
+def api_authors(request):
+    return _api(request, 'authors')
+
+
+@api_login_required
+@conditional_page(Category, Book)
+@query_budget(1)
+def api_categories(request):
+    return _api(request, 'categories')
+
+
+@api_login_required
+@conditional_page(BorrowRecord, Book)
+@query_budget(1)
+def api_loans(request):
+    return _api(request, 'loans')
+
+
+# ------------------ Performance Views ------------------
+@staff_member_required
+@query_budget(0)
+def perf_stats(request):
+    # live per-route timings from book.profiling, slowest first
+    # ?windows=N limits them to the last N minutes, ?limit=N to the N slowest routes
+    try:
+        windows = min(max(int(request.GET.get('windows', profiling.WINDOWS)), 1), profiling.WINDOWS)
+        limit = int(request.GET.get('limit', 0)) or None
+    except ValueError:
+        return JsonResponse({'error': 'windows and limit must be numbers.'}, status=400)
+    routes = profiling.summary(profiling.snapshot(windows), limit)
+    return JsonResponse({'seconds': profiling.WINDOW_SECONDS * windows, 'routes': routes})
@@ -11,6 +11,12 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from book.assets import ASGIStaticAssetsHandler
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'book_display.settings')
+# the read-heavy pages use the sync views here too unless BOOK_ASYNC_VIEWS=1 routes them to
+# the native async views (book.async_views); `manage.py bench_asgi` compares the two
 
-application = get_asgi_application()
+# collected static files are answered before the Django app: hashed names cached
+# forever, precompressed variants picked by Accept-Encoding (book.assets)
+application = ASGIStaticAssetsHandler(get_asgi_application())
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,11 +42,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'book.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'book.routers.PrimaryPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,7 +57,8 @@ ROOT_URLCONF = 'book_display.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        #the Django backend, with render time counted per request (book.profiling)
+        'BACKEND': 'book.profiling.ProfiledTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -73,13 +77,45 @@ WSGI_APPLICATION = 'book_display.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+#pragmas run on every new connection: WAL lets readers and the single writer work
+#side by side, synchronous=NORMAL is durable in WAL mode without an fsync per commit
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -32000',
+    'PRAGMA mmap_size = 268435456',
+]
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'init_command': '; '.join(SQLITE_PRAGMAS)},
+    },
 }
 
+DATABASE_ROUTERS = ['book.routers.PrimaryReplicaRouter']
+
+#seconds between replica copies made by `manage.py sync_replica --loop`; a browser that
+#wrote something keeps reading the primary for REPLICA_PIN_SECONDS (default: two
+#intervals). The replica is opt-in: without BOOK_REPLICA_SYNC_INTERVAL there is none and
+#every read uses the primary, since the copy is only as fresh as a separately run loop.
+REPLICA_SYNC_INTERVAL = float(os.environ.get('BOOK_REPLICA_SYNC_INTERVAL') or 0) or None
+
+if REPLICA_SYNC_INTERVAL:
+    #read replica (see book.routers); tests read it through the primary's test database
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-replica.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'init_command': '; '.join(SQLITE_PRAGMAS + ['PRAGMA query_only = 1'])},
+        'TEST': {'MIRROR': 'default'},
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,6 +157,13 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# collectstatic writes content-hashed copies plus .gz/.br variants (book.assets),
+# which the wsgi/asgi entry points serve with far-future immutable caching.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'book.assets.CompressedManifestStorage'},
+}
+
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
@@ -128,3 +171,48 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Views declare their SQL query budget with book.querybudget.query_budget;
+# going over it raises in development and in the test suite, and logs otherwise.
+QUERY_BUDGET_ENFORCE = DEBUG
+
+# Threads in the pool that renders cover thumbnails (book.covers) off the request thread.
+COVER_WORKERS = 2
+
+# Rendered catalog tables are cached by book.fragments. Any backend works, the
+# generations that invalidate them are kept in the database; with several server
+# processes a shared one saves rendering each table once per process, e.g.
+# {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': BASE_DIR / 'cache'}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'book-display',
+    },
+}
+FRAGMENT_CACHE = 'default'
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# Returned loans older than this many days are moved to the archive table by
+# `manage.py archive_loans` (book.archive); history pages and exports still show them.
+ARCHIVE_AFTER_DAYS = 365
+
+# Checkout limits enforced from the borrower profile counters (book.borrowers):
+# open loans per borrower (a profile's own loan_limit overrides it), and the number
+# of overdue loans at which a borrower can't take out more books. None disables either.
+LOAN_LIMIT = 5
+OVERDUE_LOAN_LIMIT = 1
+
+# Days a patron has to collect a copy put aside for their hold (book.holds) before
+# `manage.py expire_holds` passes it to the next in line.
+HOLD_PICKUP_DAYS = 3
+
+# Per-route timings collected by book.profiling.ProfilingMiddleware, shown by the
+# staff-only /perf/ endpoint and `manage.py perf_report`. Reports cover every server
+# process only when they share this cache; LocMemCache (the default above) keeps each
+# process's numbers to itself, and `check --deploy` warns about it.
+PROFILING_CACHE = 'default'
+
+# Serve the read-heavy pages with the native async views in book.async_views.
+# Opt-in with BOOK_ASYNC_VIEWS=1 when serving over ASGI, once `manage.py bench_asgi`
+# shows them ahead of the sync views; under WSGI the sync views are always used.
+ASYNC_READ_VIEWS = os.environ.get('BOOK_ASYNC_VIEWS') == '1'
@@ -11,6 +11,10 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from book.assets import StaticAssetsHandler
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'book_display.settings')
 
-application = get_wsgi_application()
+# collected static files are answered before the Django app: hashed names cached
+# forever, precompressed variants picked by Accept-Encoding (book.assets)
+application = StaticAssetsHandler(get_wsgi_application())
@@ -0,0 +1,18 @@
+// Autocomplete list filters of the admin changelists (book/admin.py): picking a
+// row, or clearing the pick, reloads the list filtered by it from the first page.
+(function ($) {
+    'use strict';
+
+    $(function () {
+        $('.autocomplete-filter select').on('change', function () {
+            var params = new URLSearchParams(window.location.search);
+            params.delete('cursor');
+            if (this.value) {
+                params.set(this.name, this.value);
+            } else {
+                params.delete(this.name);
+            }
+            window.location.search = params.toString();
+        });
+    });
+})(django.jQuery);
@@ -0,0 +1,67 @@
+// Typeahead for the AutocompleteSelect form widget (book/forms.py): the text box
+// asks the autocomplete endpoint for matches as you type and a pick stores the
+// row's id in the hidden input the form submits.
+(function () {
+    'use strict';
+
+    var DELAY_MS = 200;
+
+    function setup(input) {
+        var target = document.getElementById(input.dataset.autocompleteTarget);
+        var menu = document.createElement('div');
+        menu.className = 'dropdown-menu w-100';
+        input.parentNode.appendChild(menu);
+        var timer = null;
+        var request = 0;
+
+        function close() {
+            menu.classList.remove('show');
+        }
+
+        function choose(result) {
+            target.value = result.id;
+            input.value = result.text;
+            close();
+        }
+
+        function show(results) {
+            menu.innerHTML = '';
+            results.forEach(function (result) {
+                var item = document.createElement('button');
+                item.type = 'button';
+                item.className = 'dropdown-item';
+                item.textContent = result.text;
+                item.addEventListener('mousedown', function (event) {
+                    event.preventDefault();
+                    choose(result);
+                });
+                menu.appendChild(item);
+            });
+            menu.classList.toggle('show', results.length > 0);
+        }
+
+        function search() {
+            var current = ++request;
+            var url = input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(input.value);
+            fetch(url, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+                .then(function (response) { return response.ok ? response.json() : {results: []}; })
+                .then(function (data) {
+                    // a slower answer to an earlier keystroke never replaces a newer one
+                    if (current === request) {
+                        show(data.results);
+                    }
+                });
+        }
+
+        input.addEventListener('input', function () {
+            // typing drops the previous pick until a new one is made
+            target.value = '';
+            clearTimeout(timer);
+            timer = setTimeout(search, DELAY_MS);
+        });
+        input.addEventListener('focus', search);
+        input.addEventListener('blur', close);
+    }
+
+    document.querySelectorAll('[data-autocomplete-url]').forEach(setup);
+})();